@@ -0,0 +1,131 @@
+#
+# @author:Don Dennis
+# bench_encode.py
+#
+# Per instruction encoding cost of the integer bit-field encoder,
+# compared with the previous binary string encoder.
+#
+# The string encoder is kept here only as a reference: it builds every
+# field as a string of '0' and '1' characters, concatenates them and
+# converts back with int(instr, 2) for hex output, the way the
+# assembler used to. Both encoders are run over the same instructions,
+# their hex output is checked to be identical, and the time per
+# instruction of each is reported.
+#
+#     python benchmarks/bench_encode.py [-n INSTRUCTIONS] [-r REPEAT]
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'src'))
+
+from lib.cprint import cprint as cp
+from lib.machinecodeconst import MachineCodeConst
+from lib.machinecodegen import mcg
+from lib.parser import decode_line
+
+mcc = MachineCodeConst()
+
+
+def random_program(n, seed=0):
+    '''
+    Returns n random instruction lines covering every instruction
+    format with in range immediates.
+    '''
+    rnd = random.Random(seed)
+    ranges = {
+        mcc.FMT_I: (-2048, 2047),
+        mcc.FMT_S: (-2048, 2047),
+        mcc.FMT_SB: (-2048, 2047),
+        mcc.FMT_U: (-2 ** 19, 2 ** 19 - 1),
+        mcc.FMT_UJ: (-2 ** 19, 2 ** 19 - 1)
+    }
+    instrs = sorted(mcc.INSTR_DESC)
+    lines = []
+    for _ in range(n):
+        opcode = rnd.choice(instrs)
+        desc = mcc.INSTR_DESC[opcode]
+        operands = ['$%d' % rnd.randint(0, 31)
+                    for op in desc.operands if op != 'imm']
+        if desc.fmt != mcc.FMT_R:
+            imm = rnd.randint(*ranges[desc.fmt])
+            if desc.fmt in (mcc.FMT_SB, mcc.FMT_UJ):
+                imm *= 2
+            operands.append(str(imm))
+        lines.append(opcode + ' ' + ', '.join(operands) + '\n')
+    return lines
+
+
+def string_encode(instr):
+    '''
+    Reference binary string encoder, equivalent to the string based
+    implementation the integer encoder replaced.
+    '''
+    desc = mcc.INSTR_DESC[instr.opcode]
+    opcode = format(desc.opcode, '07b')
+    regs = {}
+    for name in desc.operands:
+        if name != 'imm':
+            regs[name] = format(getattr(instr, name), '05b')
+    if desc.fmt == mcc.FMT_R:
+        return (format(desc.funct7, '07b') + regs['rs2'] + regs['rs1'] +
+                format(desc.funct3, '03b') + regs['rd'] + opcode)
+    imm = instr.imm
+    if desc.fmt == mcc.FMT_I:
+        imm2 = format(imm & 0xFFF, '012b')
+        return (imm2 + regs['rs1'] + format(desc.funct3, '03b') +
+                regs['rd'] + opcode)
+    if desc.fmt == mcc.FMT_S:
+        imm2 = format(imm & 0xFFF, '012b')
+        return (imm2[:7] + regs['rs2'] + regs['rs1'] +
+                format(desc.funct3, '03b') + imm2[7:] + opcode)
+    if desc.fmt == mcc.FMT_SB:
+        imm2 = format(imm & 0x1FFF, '013b')[0:12]
+        return (imm2[-12] + imm2[-10:-4] + regs['rs2'] + regs['rs1'] +
+                format(desc.funct3, '03b') + imm2[-4:] + imm2[-11] +
+                opcode)
+    if desc.fmt == mcc.FMT_U:
+        return format(imm & 0xFFFFF, '020b') + regs['rd'] + opcode
+    imm2 = format(imm & 0x1FFFFF, '021b')[0:-1]
+    return (imm2[0] + imm2[10:20] + imm2[9] + imm2[1:9] + regs['rd'] +
+            opcode)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="RVI encoder benchmark.")
+    ap.add_argument('-n', '--instructions', type=int, default=100000)
+    ap.add_argument('-r', '--repeat', type=int, default=5)
+    args = ap.parse_args()
+
+    cp.warn = False
+    cp.warn32 = False
+    program = [decode_line(line, lineno) for lineno, line in
+               enumerate(random_program(args.instructions), 1)]
+
+    def run_int():
+        return ['%08X' % mcg.encode(instr) for instr in program]
+
+    def run_string():
+        return ['%08X' % int(string_encode(instr), 2)
+                for instr in program]
+
+    if run_int() != run_string():
+        print("Error: integer and string encoders disagree")
+        return 1
+
+    n = len(program)
+    t_int = min(timeit.repeat(run_int, number=1, repeat=args.repeat))
+    t_str = min(timeit.repeat(run_string, number=1, repeat=args.repeat))
+    print("%d instructions" % n)
+    print("string encoder  %7.3f us/instr" % (t_str / n * 1e6))
+    print("integer encoder %7.3f us/instr" % (t_int / n * 1e6))
+    print("speedup         %7.2fx" % (t_str / t_int))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
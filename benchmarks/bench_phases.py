@@ -0,0 +1,317 @@
+#
+# @author:Don Dennis
+# bench_phases.py
+#
+# Throughput of each phase of the two pass assembler on synthetic
+# programs (see corpus.py) from a thousand to ten million lines.
+#
+# Each size is assembled in a fresh interpreter, so that its peak
+# resident set size is its own. The phases are timed separately:
+#
+#     lex       decoding the source lines into Instr and Label records
+#               (parse_lines: the fast path standing for the lexer and
+#               the parser on canonical lines, ply on the others)
+#     pass_one  parse_pass_one, lexing and the symbols table
+#     pass_two  parse_pass_two, lexing again and encoding
+#     encode    encode_statements on the records lexed already: label
+#               offsets and the conversion to binary
+#     write     writing the image as memb text
+#
+# pass_one, pass_two and write are the assembly as rvi.py runs it, and
+# peak_rss is measured once they are done. lex and encode are then
+# taken apart on the same source.
+#
+# The results are written as JSON, and compared with those of another
+# version, each phase of each size being reported as a regression when
+# it is slower by more than the threshold.
+#
+#     python benchmarks/bench_phases.py [-s 1K,10K,...] [-o RESULTS]
+#         [--compare BASELINE] [corpus options, see corpus.py]
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir, 'src')
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus
+
+DEFAULT_SIZES = '1K,10K,100K,1M,10M'
+
+# Larger programs are assembled only once
+REPEAT_LINES = 10 ** 6
+
+PHASES = ('pass_one', 'pass_two', 'write', 'lex', 'encode')
+
+# Options of the assembler the phases read
+ARGS = {
+    'echo': False,
+    'echo_symbols': False,
+    'hex': False,
+    'tokenize': False
+}
+
+
+def parse_size(text):
+    '''
+    returns: the number of lines of a size such as 100K or 10M
+    '''
+    scale = {'K': 10 ** 3, 'M': 10 ** 6}.get(text[-1:].upper(), 1)
+    if scale != 1:
+        text = text[:-1]
+    return int(float(text) * scale)
+
+
+def peak_rss():
+    '''
+    returns: the peak resident set size of this process, in KiB
+    '''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In bytes on macOS
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def timed(function, *args):
+    '''
+    returns: (result of function, wall time)
+    '''
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def measure(path, repeat):
+    '''
+    Times the phases of the assembly of the source file path, keeping
+    the best of repeat runs of each.
+
+    returns: the dict of the measures
+    '''
+    from lib import emitter, parser
+    from lib.cprint import cprint as cp
+    from lib.reader import MappedSource
+    from lib.tokenizer import get_lexer
+    cp.warn = False
+    cp.warn32 = False
+    # Built on first use, not part of any phase
+    parser.get_parser()
+    get_lexer()
+
+    times = dict((phase, float('inf')) for phase in PHASES)
+
+    def best(phase, elapsed):
+        times[phase] = min(times[phase], elapsed)
+
+    fin = MappedSource(path)
+    out = tempfile.NamedTemporaryFile(suffix='.b', delete=False)
+    out.close()
+    try:
+        for _ in range(repeat):
+            symbols_table, elapsed = timed(parser.parse_pass_one, fin, ARGS)
+            best('pass_one', elapsed)
+            image = emitter.Image()
+            _, elapsed = timed(parser.parse_pass_two, fin, image,
+                               symbols_table, ARGS)
+            best('pass_two', elapsed)
+            with open(out.name, 'wb') as fout:
+                _, elapsed = timed(emitter.emit, image, 'memb', {}, fout)
+            best('write', elapsed)
+        rss = peak_rss()
+        instructions = len(image)
+        del image
+
+        for _ in range(repeat):
+            records, elapsed = timed(list, parser.parse_lines(fin))
+            best('lex', elapsed)
+            image = emitter.Image()
+            _, elapsed = timed(parser.encode_statements, records, image,
+                               symbols_table, ARGS)
+            best('encode', elapsed)
+            del records, image
+        lines = len(fin)
+    finally:
+        fin.close()
+        os.unlink(out.name)
+
+    assembly = times['pass_one'] + times['pass_two'] + times['write']
+    return {
+        'lines': lines,
+        'instructions': instructions,
+        'labels': len(symbols_table),
+        'seconds': times,
+        'assembly_seconds': assembly,
+        'lines_per_second': dict((phase, lines / elapsed if elapsed else None)
+                                 for phase, elapsed in
+                                 list(times.items()) +
+                                 [('assembly', assembly)]),
+        'peak_rss_kib': rss,
+        'peak_rss_kib_total': peak_rss()
+    }
+
+
+def version():
+    '''
+    returns: the version of the assembler and the commit of the tree,
+    None if it is not a git checkout
+    '''
+    from rvi import VERSION
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                cwd=SRC_DIR, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'version': VERSION, 'commit': commit}
+
+
+def corpus_file(directory, lines, args):
+    '''
+    returns: the path of the program of the given number of lines and
+    corpus options, generated unless already in directory
+    '''
+    mix = args.mix if args.mix is not None else corpus.DEFAULT_MIX
+    name = 'corpus-%d-%g-%g-%s-%d.rvi' % (
+        lines, args.labels, args.backward,
+        '_'.join('%s%g' % item for item in sorted(mix.items())), args.seed)
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        partial = path + '.part'
+        with open(partial, 'w') as fout:
+            corpus.generator(args).write(fout, lines)
+        os.replace(partial, path)
+    return path
+
+
+def compare(baseline, results, threshold):
+    '''
+    Prints the change of each phase from baseline to results.
+
+    returns: the number of regressions
+    '''
+    before = dict((r['lines'], r) for r in baseline['results'])
+    regressions = 0
+    print("%10s %-10s %12s %12s %8s" % ('lines', 'phase', 'before (s)',
+                                        'after (s)', 'change'))
+    for result in results['results']:
+        old = before.get(result['lines'])
+        if old is None:
+            continue
+        for phase in PHASES + ('assembly',):
+            key = 'assembly_seconds'
+            if phase != 'assembly':
+                t_old = old['seconds'].get(phase)
+                t_new = result['seconds'].get(phase)
+            else:
+                t_old, t_new = old.get(key), result.get(key)
+            if not t_old or t_new is None:
+                continue
+            change = t_new / t_old - 1
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print("%10d %-10s %12.4f %12.4f %+7.1f%%%s" % (
+                result['lines'], phase, t_old, t_new, change * 100, flag))
+        rss_old, rss_new = old['peak_rss_kib'], result['peak_rss_kib']
+        print("%10d %-10s %10d K %10d K %+7.1f%%" % (
+            result['lines'], 'peak_rss', rss_old, rss_new,
+            (rss_new / rss_old - 1) * 100))
+    return regressions
+
+
+def report(result):
+    rates = result['lines_per_second']
+    print("%10d lines  %s  assembly %9.0f lines/s  peak RSS %7.1f MiB" % (
+        result['lines'],
+        '  '.join('%s %9.0f' % (phase, rates[phase]) for phase in PHASES),
+        rates['assembly'], result['peak_rss_kib'] / 1024))
+    sys.stdout.flush()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="RVI per phase throughput" +
+                                 " benchmark.")
+    ap.add_argument('-s', '--sizes', default=DEFAULT_SIZES,
+                    help="Comma separated program sizes in lines, " +
+                    DEFAULT_SIZES + " by default.")
+    ap.add_argument('-r', '--repeat', type=int, default=3,
+                    help="Runs of each phase, the best one is kept. 3 by" +
+                    " default, programs of more than a million lines" +
+                    " are run once.")
+    ap.add_argument('-o', '--outfile',
+                    help="Write the results to this JSON file.")
+    ap.add_argument('--compare', metavar="BASELINE",
+                    help="Compare with the results of a previous run.")
+    ap.add_argument('--threshold', type=float, default=0.1,
+                    help="Slowdown reported as a regression, 0.1 (10%%)" +
+                    " by default.")
+    ap.add_argument('--corpus-dir',
+                    help="Keep the generated programs in this directory" +
+                    " to reuse them.")
+    ap.add_argument('--child', help=argparse.SUPPRESS)
+    corpus.add_arguments(ap)
+    args = ap.parse_args()
+
+    if args.child:
+        json.dump(measure(args.child, args.repeat), sys.stdout)
+        return 0
+
+    try:
+        sizes = [parse_size(size) for size in args.sizes.split(',')]
+    except ValueError:
+        print("Error: invalid sizes '" + args.sizes + "'")
+        return 1
+    results = dict(version())
+    results.update({
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': {
+            'labels': args.labels,
+            'backward': args.backward,
+            'mix': args.mix if args.mix is not None else corpus.DEFAULT_MIX,
+            'seed': args.seed
+        },
+        'repeat': args.repeat,
+        'results': []
+    })
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.corpus_dir or tmp
+        os.makedirs(directory, exist_ok=True)
+        for lines in sizes:
+            path = corpus_file(directory, lines, args)
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', path,
+                 '-r', str(args.repeat if lines <= REPEAT_LINES else 1)],
+                capture_output=True, text=True)
+            if child.returncode:
+                print("Error: the benchmark of %d lines failed:" % lines)
+                print(child.stderr)
+                return 1
+            result = json.loads(child.stdout)
+            results['results'].append(result)
+            report(result)
+
+    if args.outfile:
+        with open(args.outfile, 'w') as fout:
+            json.dump(results, fout, indent=2)
+            fout.write('\n')
+    if args.compare:
+        with open(args.compare) as fin:
+            baseline = json.load(fin)
+        if compare(baseline, results, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#
+# @author:Don Dennis
+# bench_startup.py
+#
+# Startup time budget for the assembler.
+#
+# Times `rvi.py --help` and the assembly of a one line program, each in a
+# fresh interpreter, and fails if the median exceeds the budget. Run the
+# table generation step (`python -m lib.tables` in `src`) first, otherwise
+# the parser tables are rebuilt on every launch.
+#
+#     python benchmarks/bench_startup.py [-n RUNS]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.pardir, 'src')
+RVI = os.path.join(SRC_DIR, 'rvi.py')
+
+# Median wall time budgets in milliseconds
+BUDGET_HELP = 60
+BUDGET_ONE_LINE = 120
+
+
+def time_run(cmd, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def report(name, times, budget):
+    median = statistics.median(times)
+    ok = median <= budget
+    print("%-10s min %7.1fms  median %7.1fms  budget %5dms  %s" %
+          (name, min(times), median, budget, 'ok' if ok else 'OVER BUDGET'))
+    return ok
+
+
+def main():
+    ap = argparse.ArgumentParser(description="RVI startup time budget.")
+    ap.add_argument('-n', '--runs', type=int, default=20,
+                    help="Number of launches per measurement.")
+    ap.add_argument('--budget-help', type=float, default=BUDGET_HELP)
+    ap.add_argument('--budget-one-line', type=float, default=BUDGET_ONE_LINE)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        infile = os.path.join(tmp, 'one.rvi')
+        with open(infile, 'w') as f:
+            f.write('addi $1, $0, 1\n')
+        outfile = os.path.join(tmp, 'a.b')
+        ok = report('--help', time_run([sys.executable, RVI, '--help'],
+                                       args.runs), args.budget_help)
+        ok &= report('one line',
+                     time_run([sys.executable, RVI, infile, '-o', outfile],
+                              args.runs), args.budget_one_line)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
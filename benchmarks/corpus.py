@@ -0,0 +1,296 @@
+#
+# @author:Don Dennis
+# corpus.py
+#
+# Deterministic generator of synthetic assembly programs for the
+# benchmarks.
+#
+# A program is a sequence of instruction and label lines. The share of
+# label lines, the share of branches and jumps going back to a label
+# already declared rather than forward to one declared further down,
+# and the mix of instruction formats (the INSTR_TYPE_* lists) are
+# parameters. The same parameters and seed always give the same
+# program, so that the timings of two versions of the assembler are
+# taken on the same input.
+#
+# Branch targets are kept within the reach of the SB format, so the
+# programs assemble without warnings. A branch with no label in reach
+# gets a numeric offset instead.
+#
+#     python benchmarks/corpus.py -n LINES -o FILE [--labels DENSITY]
+#         [--backward RATIO] [--mix R=1,I=1,...] [--seed SEED]
+
+import argparse
+import os
+import random
+import sys
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'src'))
+
+from lib.machinecodeconst import MachineCodeConst
+
+mcc = MachineCodeConst()
+
+# Instructions of each format
+FORMATS = {
+    mcc.FMT_R: sorted(mcc.INSTR_TYPE_R),
+    mcc.FMT_I: sorted(mcc.INSTR_TYPE_I),
+    mcc.FMT_S: sorted(mcc.INSTR_TYPE_S),
+    mcc.FMT_SB: sorted(mcc.INSTR_TYPE_SB),
+    mcc.FMT_U: sorted(mcc.INSTR_TYPE_U),
+    mcc.FMT_UJ: sorted(mcc.INSTR_TYPE_UJ)
+}
+
+# Default weight of each format: its number of instructions, every
+# instruction being as likely
+DEFAULT_MIX = dict((fmt, len(instrs)) for fmt, instrs in FORMATS.items())
+
+# Farthest label a branch goes to, in instructions, well within the
+# 4 KiB reach of the SB format
+REACH = 1000
+
+# Lines generated at a time
+BATCH = 1 << 14
+
+
+def parse_mix(spec):
+    '''
+    returns: format -> weight of a spec such as 'R=4,I=3,SB=1', the
+    formats left out having no weight
+
+    raises: ValueError if the spec is not valid
+    '''
+    mix = dict((fmt, 0) for fmt in FORMATS)
+    for item in spec.split(','):
+        fmt, _, weight = item.partition('=')
+        fmt = fmt.strip().upper()
+        if fmt not in FORMATS:
+            raise ValueError("unknown instruction format '" + fmt + "'")
+        mix[fmt] = float(weight)
+        if mix[fmt] < 0:
+            raise ValueError("negative weight for format '" + fmt + "'")
+    if not any(mix.values()):
+        raise ValueError("no instruction format has a weight")
+    return mix
+
+
+class Generator:
+    '''
+    Generator of the lines of a program.
+
+    labels: share of the lines that are label declarations
+    backward: share of the branches and jumps to a label going to one
+        already declared
+    mix: format -> weight of the instructions, DEFAULT_MIX if None
+    seed: seed of the pseudo random numbers
+    '''
+
+    def __init__(self, labels=0.05, backward=0.5, mix=None, seed=0):
+        if not 0 <= labels < 1:
+            raise ValueError("the label density must be in [0, 1)")
+        if not 0 <= backward <= 1:
+            raise ValueError("the backward ratio must be in [0, 1]")
+        self.labels = labels
+        self.backward = backward
+        self.mix = dict(DEFAULT_MIX if mix is None else mix)
+        self.seed = seed
+        # The label positions are drawn from their own stream, so that
+        # they can be drawn ahead of the instructions branching to them
+        self.rnd = random.Random(seed)
+        self.label_rnd = random.Random(seed + 1)
+        formats = [fmt for fmt in FORMATS if self.mix[fmt]]
+        self.formats = formats
+        self.weights = [self.mix[fmt] for fmt in formats]
+        # Counts of the generated program
+        self.instructions = 0
+        self.label_count = 0
+        self.forward = 0
+        self.backward_count = 0
+
+    def label_gaps(self):
+        '''
+        Yields the number of instructions before each label, from the
+        previous one.
+        '''
+        rnd = self.label_rnd
+        if not self.labels:
+            return
+        # Geometric, a line being a label with probability labels
+        p = self.labels
+        while True:
+            gap = 0
+            while rnd.random() >= p:
+                gap += 1
+            yield gap
+
+    def lines(self, count):
+        '''
+        Yields count lines, in batches of lists of lines.
+        '''
+        rnd = self.rnd
+        gaps = self.label_gaps()
+        # Labels drawn at or after the end of the program are never
+        # declared
+        self.last_label = self.count_labels(count)
+        # (instruction index, label number) of the labels to come, drawn
+        # REACH instructions ahead
+        upcoming = deque()
+        # Of the labels declared, the last ones in reach
+        declared = deque()
+        drawn = 0
+        position = 0
+
+        def draw():
+            nonlocal drawn, position
+            while (self.labels and
+                   (not upcoming or upcoming[-1][0] < self.instructions +
+                    REACH)):
+                position += next(gaps)
+                upcoming.append((position, drawn))
+                drawn += 1
+
+        batch = []
+        written = 0
+        while written < count:
+            draw()
+            if upcoming and upcoming[0][0] == self.instructions:
+                number = upcoming.popleft()[1]
+                declared.append((self.instructions, number))
+                batch.append('L%d:\n' % number)
+                self.label_count += 1
+            else:
+                batch.append(self.instruction(rnd, upcoming, declared))
+                self.instructions += 1
+                while (declared and
+                       declared[0][0] < self.instructions - REACH):
+                    declared.popleft()
+            written += 1
+            if len(batch) == BATCH:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def target(self, rnd, upcoming, declared):
+        '''
+        returns: the label a branch at the current instruction goes to,
+        None if there is none in reach
+        '''
+        here = self.instructions
+        if rnd.random() < self.backward:
+            candidates, after = declared, False
+        else:
+            candidates, after = upcoming, True
+        if after:
+            # Labels declared after the last instruction are not in
+            # the program
+            reach = [n for at, n in candidates
+                     if at <= here + REACH and n < self.last_label]
+        else:
+            reach = [n for at, n in candidates]
+        if not reach:
+            return None
+        if after:
+            self.forward += 1
+        else:
+            self.backward_count += 1
+        # Mostly the nearest labels, as loops and if blocks
+        nearest = min(int(rnd.expovariate(0.5)), len(reach) - 1)
+        return reach[nearest] if after else reach[-1 - nearest]
+
+    def instruction(self, rnd, upcoming, declared):
+        fmt = rnd.choices(self.formats, self.weights)[0]
+        opcode = rnd.choice(FORMATS[fmt])
+        desc = mcc.INSTR_DESC[opcode]
+        operands = ['$%d' % rnd.randint(0, 31)
+                    for op in desc.operands if op != 'imm']
+        label = None
+        if fmt in (mcc.FMT_SB, mcc.FMT_UJ):
+            label = self.target(rnd, upcoming, declared)
+        if label is not None:
+            operands.append('L%d' % label)
+        elif fmt == mcc.FMT_SB:
+            operands.append(str(rnd.randint(-1024, 1023) * 4))
+        elif fmt == mcc.FMT_UJ:
+            operands.append(str(rnd.randint(-REACH, REACH) * 4))
+        elif fmt == mcc.FMT_U:
+            operands.append(str(rnd.randint(0, 2 ** 19 - 1)))
+        elif fmt == mcc.FMT_R:
+            pass
+        elif desc.funct7 is not None:
+            # Shift immediates, funct7 in the upper bits
+            operands.append(str(desc.funct7 << 5 | rnd.randint(0, 31)))
+        elif desc.aligned:
+            operands.append(str(rnd.randint(-512, 511) * 4))
+        else:
+            operands.append(str(rnd.randint(-2048, 2047)))
+        return '\t' + opcode + ' ' + ', '.join(operands) + '\n'
+
+    def write(self, fout, count):
+        '''
+        Writes a program of count lines to the text file fout.
+        '''
+        for batch in self.lines(count):
+            fout.writelines(batch)
+
+    def count_labels(self, count):
+        '''
+        returns: the number of labels of a program of count lines, drawn
+        as lines() does
+        '''
+        gaps = Generator(self.labels, seed=self.seed).label_gaps()
+        labels = 0
+        position = 0
+        while self.labels:
+            position += next(gaps)
+            # The line of the label, after position instructions and
+            # the labels before it
+            if position + labels >= count:
+                break
+            labels += 1
+        return labels
+
+
+def add_arguments(ap):
+    ap.add_argument('--labels', type=float, default=0.05,
+                    metavar="DENSITY",
+                    help="Share of the lines that are labels, 0.05 by" +
+                    " default.")
+    ap.add_argument('--backward', type=float, default=0.5,
+                    metavar="RATIO",
+                    help="Share of the branches and jumps going back to" +
+                    " a label, 0.5 by default.")
+    ap.add_argument('--mix', type=parse_mix,
+                    help="Weights of the instruction formats, such as" +
+                    " R=4,I=3,S=1,SB=1,U=1,UJ=1. By default every" +
+                    " instruction is as likely.")
+    ap.add_argument('--seed', type=int, default=0)
+
+
+def generator(args):
+    '''
+    returns: the Generator of the parsed arguments of add_arguments
+    '''
+    return Generator(args.labels, args.backward, args.mix, args.seed)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Synthetic RVI program" +
+                                 " generator.")
+    ap.add_argument('-n', '--lines', type=int, default=100000)
+    ap.add_argument('-o', '--outfile', default='-')
+    add_arguments(ap)
+    args = ap.parse_args()
+    gen = generator(args)
+    if args.outfile == '-':
+        gen.write(sys.stdout, args.lines)
+    else:
+        with open(args.outfile, 'w') as fout:
+            gen.write(fout, args.lines)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,389 @@
+#
+# @author:Don Dennis
+# aio.py
+#
+# asyncio interface of the assembler, for asynchronous test benches.
+#
+# An AsyncAssembler assembles files with parse_input, as rvi.py does,
+# in a pool of threads or processes, so that the event loop keeps
+# running while large programs are assembled. At most limit assemblies
+# run at once, the others waiting for their turn.
+#
+# stream() yields the output of an assembly in chunks while the program
+# is being assembled, so that a simulator can start loading the first
+# words before the last ones are encoded. The output is a named pipe,
+# which parse_input streams to as it does to the standard output, read
+# by the event loop. This works the same with threads and processes,
+# on systems with named pipes.
+#
+# Cancelling a task waiting for its turn drops its assembly, and a
+# running assembly is stopped at the next line parsed, in a thread as
+# in a process. A stream that is not read to its end is cancelled
+# likewise, the rest of its output being read and dropped. An assembly
+# keeps its turn until its worker is done with it, so that no more than
+# limit assemblies ever run at once, cancelled ones included.
+#
+# The worker processes must not inherit the pipes of the streams read
+# when they start, so they are started by a fork server (or spawned),
+# which a ProcessPoolExecutor given to AsyncAssembler must do too.
+#
+#   >>> async with AsyncAssembler('process', limit=4) as asm:
+#   ...     entry = await asm.assemble('prog.rvi', 'prog.x', hex=True)
+#   ...     async for chunk in asm.stream('prog.rvi', hex=True):
+#   ...         load(chunk)
+
+import asyncio
+import mmap
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from concurrent.futures import (Executor, ProcessPoolExecutor,
+                                ThreadPoolExecutor)
+from lib.assembler import AssemblyError, read_messages
+from lib.client import OPTIONS
+from lib.cprint import cprint as cp
+from lib import multifile
+
+# Options of an assembly, with their default values: those of rvi.py
+# for a single file, the messages being kept without color codes.
+DEFAULTS = dict(OPTIONS, no_color=True, emit=None, jobs=1)
+
+# Largest chunk yielded by stream()
+CHUNK_SIZE = 1 << 16
+
+# Start method of the worker processes
+if 'forkserver' in multiprocessing.get_all_start_methods():
+    START = 'forkserver'
+else:
+    START = 'spawn'
+
+
+def check_options(options):
+    '''
+    raises: TypeError if an option is not one of DEFAULTS
+    '''
+    for key in options:
+        if key not in DEFAULTS:
+            raise TypeError("unknown assembler option '" + key + "'")
+    return options
+
+
+class CancelFlag:
+    '''
+    Event stopping an assembly run in a worker process, which cannot be
+    handed a threading.Event. The flag is a one byte file, mapped into
+    memory by the worker, so that looking it up on every line costs as
+    little as looking up an Event.
+    '''
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix='rvi')
+        os.write(fd, b'\0')
+        os.close(fd)
+        self.map = None
+
+    def __getstate__(self):
+        return {'path': self.path, 'map': None}
+
+    def set(self):
+        with open(self.path, 'r+b') as fout:
+            fout.write(b'\1')
+
+    def open(self):
+        '''
+        Maps the flag in the worker.
+        '''
+        with open(self.path, 'rb') as fin:
+            self.map = mmap.mmap(fin.fileno(), 1, access=mmap.ACCESS_READ)
+
+    def is_set(self):
+        return self.map[0] != 0
+
+    def close(self):
+        self.map.close()
+        self.map = None
+
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def run(infile, outfile, args, cancel=None):
+    '''
+    Assembles infile into outfile in the calling thread or worker
+    process, stopping at the next line once cancel, an Event or a
+    CancelFlag, is set.
+
+    returns: the summary entry of the file (see multifile.py)
+    '''
+    if isinstance(cancel, CancelFlag):
+        cancel.open()
+    cp.cancel = cancel
+    try:
+        return multifile.assemble_file(infile, outfile, args)
+    finally:
+        cp.cancel = None
+        if isinstance(cancel, CancelFlag):
+            cancel.close()
+
+
+def result(entry):
+    '''
+    returns: the summary entry of an assembly, its messages turned
+    into Diagnostic (see assembler.py)
+
+    raises: AssemblyError if the assembly failed
+    '''
+    diagnostics = read_messages(entry['messages'])
+    if entry['status'] != 'ok':
+        raise AssemblyError(diagnostics)
+    return dict(entry, messages=diagnostics)
+
+
+async def discard(reader, transport, tmpdir):
+    '''
+    Reads the rest of an abandoned stream, so that its assembly is not
+    blocked writing to the pipe, then removes the pipe.
+    '''
+    try:
+        while await reader.read(CHUNK_SIZE):
+            pass
+    finally:
+        transport.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+class Assembly:
+    '''
+    An assembly submitted to the executor.
+
+    future: the asyncio future of its summary entry
+    task: the concurrent.futures future of the executor
+    cancel: the Event or CancelFlag stopping it
+    '''
+
+    def __init__(self, future, task, cancel):
+        self.future = future
+        self.task = task
+        self.cancel = cancel
+
+    def stop(self):
+        '''
+        Drops the assembly if it has not started, or stops it at the
+        next line. Its turn is given back once its worker is done.
+        '''
+        if not self.task.cancel():
+            self.cancel.set()
+
+    async def wait(self):
+        '''
+        returns: the summary entry of the assembly, stopping it if the
+        calling task is cancelled
+        '''
+        try:
+            return await asyncio.shield(self.future)
+        except asyncio.CancelledError:
+            self.stop()
+            raise
+
+
+class AsyncAssembler:
+    '''
+    Assembles files without blocking the event loop.
+
+    executor: 'thread', 'process' or a concurrent.futures Executor,
+        which close() then leaves running
+    workers: number of threads or processes, one per CPU by default
+    limit: largest number of assemblies running at once, workers by
+        default
+    options: default options of every assembly, see DEFAULTS
+    '''
+
+    def __init__(self, executor='thread', workers=None, limit=None,
+                 **options):
+        self.options = dict(DEFAULTS)
+        self.options.update(check_options(options))
+        workers = workers or os.cpu_count() or 1
+        self.owned = not isinstance(executor, Executor)
+        if executor == 'thread':
+            executor = ThreadPoolExecutor(workers)
+        elif executor == 'process':
+            executor = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context(START),
+                initializer=multifile.init_worker)
+        elif self.owned:
+            raise ValueError("unknown executor '" + str(executor) + "'")
+        self.executor = executor
+        # Events cannot be handed to other processes, which are given a
+        # CancelFlag instead
+        self.threads = not isinstance(executor, ProcessPoolExecutor)
+        self.limit = limit or workers
+        # Event loop -> Semaphore, a semaphore being bound to its loop
+        self.semaphores = weakref.WeakKeyDictionary()
+        # Streams being discarded
+        self.discarding = set()
+
+    def semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self.semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limit)
+            self.semaphores[loop] = semaphore
+        return semaphore
+
+    def arguments(self, options):
+        args = dict(self.options)
+        args.update(check_options(options))
+        return args
+
+    async def submit(self, infile, outfile, args):
+        '''
+        Waits for the turn of the assembly and submits it. The assembly
+        keeps its turn until its worker is done with it.
+
+        returns: the Assembly
+        '''
+        semaphore = self.semaphore()
+        await semaphore.acquire()
+        if self.threads:
+            cancel = threading.Event()
+        else:
+            cancel = CancelFlag()
+        try:
+            future = self.executor.submit(run, infile, outfile, args, cancel)
+        except BaseException:
+            semaphore.release()
+            if not self.threads:
+                cancel.remove()
+            raise
+        assembly = Assembly(asyncio.wrap_future(future), future, cancel)
+
+        def done(future):
+            semaphore.release()
+            if not self.threads:
+                cancel.remove()
+            if not future.cancelled():
+                # Retrieved, even if nobody waits for it any more
+                future.exception()
+
+        assembly.future.add_done_callback(done)
+        return assembly
+
+    async def assemble(self, infile, outfile=None, **options):
+        '''
+        Assembles infile into outfile and the outputs of the emit
+        option, like rvi.py. outfile defaults to infile with the
+        extension .b, or .x with hex.
+
+        returns: the summary entry of the file (see multifile.py), its
+        messages being a list of Diagnostic (see assembler.py)
+
+        raises: AssemblyError if the file cannot be assembled
+        '''
+        args = self.arguments(options)
+        if outfile is None:
+            outfile = multifile.output_name(
+                infile, None, '.x' if args['hex'] else '.b')
+        assembly = await self.submit(infile, outfile, args)
+        return result(await assembly.wait())
+
+    async def stream(self, infile, **options):
+        '''
+        Assembles infile, yielding its output (binary text, or hex text
+        with hex) as bytes while it is being written. The outputs of the
+        emit option need their file name. Stopping the iteration stops
+        the assembly as cancelling it would.
+
+        raises: AssemblyError, once the output is complete, if the file
+        cannot be assembled
+        '''
+        args = self.arguments(options)
+        loop = asyncio.get_running_loop()
+        tmpdir = tempfile.mkdtemp(prefix='rvi')
+        fifo = os.path.join(tmpdir, 'out')
+        os.mkfifo(fifo)
+        # The assembly waits for a reader to open the pipe, and the
+        # pipe reads as ended until the assembly opens it without
+        # a writer of our own, closed once the assembly is done.
+        fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+        writer = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+        reader = asyncio.StreamReader(limit=CHUNK_SIZE)
+        try:
+            transport, _ = await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader),
+                os.fdopen(fd, 'rb', 0))
+        except BaseException:
+            os.close(writer)
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+        assembly = None
+        done = False
+        try:
+            assembly = await self.submit(infile, fifo, args)
+            assembly.future.add_done_callback(lambda f: os.close(writer))
+            while True:
+                chunk = await reader.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            done = True
+        finally:
+            if done:
+                transport.close()
+                shutil.rmtree(tmpdir, ignore_errors=True)
+            else:
+                if assembly is None:
+                    os.close(writer)
+                else:
+                    assembly.stop()
+                task = loop.create_task(discard(reader, transport, tmpdir))
+                self.discarding.add(task)
+                task.add_done_callback(self.discarding.discard)
+        result(await assembly.wait())
+
+    async def close(self):
+        '''
+        Waits for the streams being discarded and shuts the executor
+        down if it was created by the AsyncAssembler.
+        '''
+        if self.discarding:
+            await asyncio.gather(*self.discarding, return_exceptions=True)
+        if self.owned:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.executor.shutdown)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+# AsyncAssembler of assemble() and stream(), created on first use
+_default = None
+
+
+def default_assembler():
+    global _default
+    if _default is None:
+        _default = AsyncAssembler()
+    return _default
+
+
+async def assemble(infile, outfile=None, **options):
+    '''
+    AsyncAssembler.assemble in a pool of threads shared by the callers.
+    '''
+    return await default_assembler().assemble(infile, outfile, **options)
+
+
+def stream(infile, **options):
+    '''
+    AsyncAssembler.stream in a pool of threads shared by the callers.
+    '''
+    return default_assembler().stream(infile, **options)
@@ -0,0 +1,188 @@
+#
+# @author:Don Dennis
+# assembler.py
+#
+# In-memory interface of the assembler, for programs embedding it.
+#
+# An Assembler assembles programs given as text and returns the encoded
+# words, the symbols table and the messages of the assembly, without
+# reading or writing files and without printing anything. A program
+# that cannot be assembled raises an AssemblyError holding the messages
+# instead of ending the process.
+#
+# Everything an assembly changes is kept per thread: the message
+# settings and counters (cprint.py), the lexer (tokenizer.py), the
+# parsers (parser.py, programparser.py) and the parse and encode caches
+# (memo.py), and the symbols table interning the labels (ir.py), which
+# is also started afresh for every assembly. The parser tables and the
+# instruction registry are shared. An Assembler can thus be used by
+# several threads at once, each assembly running on its own in the
+# thread calling it.
+#
+#   >>> from lib.assembler import Assembler
+#   >>> result = Assembler().assemble('L:\naddi $1, $0, 5\njal $0, L\n')
+#   >>> list(result.words), result.symbols
+#   ([5243027, 4292866159], {'L': 0})
+
+import io
+import re
+from collections import namedtuple
+from lib import emitter
+from lib import parser
+from lib.cprint import cprint as cp, Abort
+from lib.ir import symbol_names, symbols_scope
+from lib.reader import StreamSource
+
+# Options of an assembly, with their default values. They are the
+# options of rvi.py changing the assembled program and its messages.
+OPTIONS = {
+    'no_32': False,
+    'single_pass': False,
+    'whole_program': False,
+    'batch': False
+}
+
+# Options of the command line meaningless without files or console
+NO_CONSOLE = {
+    'echo': False,
+    'tokenize': False,
+    'echo_symbols': False,
+    'hex': False
+}
+
+'''
+A message of the assembler.
+
+severity: 'error', 'warning' or 'message'
+lineno: source line the message is about, None if not about a line
+message: the text of the message, without its line number
+'''
+Diagnostic = namedtuple('Diagnostic', ['severity', 'lineno', 'message'])
+
+'''
+An assembled program.
+
+words: MemoryImage of the encoded instructions (see memoryimage.py),
+    an array('I') holding the instruction at address A in words[A // 4],
+    with the symbols table and the source line of every instruction
+symbols: label name -> address
+diagnostics: the Diagnostic of each message, in the order reported
+'''
+Result = namedtuple('Result', ['words', 'symbols', 'diagnostics'])
+
+# Messages of the assembler, as 'Error:12: ...', 'Error: 12 : ...',
+# '32_Warning:12: ...' or 'Error: ...' when not about a line
+_LOCATED = re.compile(
+    r'(?:32_)?(?:Warning|Error)\s*:\s*(?:(\d+)\s*:\s*)?(.*)', re.S)
+# Color codes of the printed messages
+_COLOR = re.compile('\033\\[[0-9;]*m')
+
+
+def diagnostic(kind, text):
+    '''
+    returns: the Diagnostic of a message recorded by cprint.
+    '''
+    m = _LOCATED.match(text)
+    if m is None:
+        return Diagnostic(kind, None, text)
+    lineno = m.group(1)
+    return Diagnostic(kind, lineno and int(lineno), m.group(2))
+
+
+def read_messages(text):
+    '''
+    returns: the Diagnostic of each line of text, messages printed by
+    the assembler, their kind being told from their prefix.
+    '''
+    diagnostics = []
+    # Not splitlines, messages quote characters such as form feeds
+    lines = _COLOR.sub('', text).split('\n')
+    if not lines[-1]:
+        lines.pop()
+    for line in lines:
+        if line.startswith('Error'):
+            kind = 'error'
+        elif line.startswith(('Warning', '32_Warning')):
+            kind = 'warning'
+        else:
+            kind = 'message'
+        diagnostics.append(diagnostic(kind, line))
+    return diagnostics
+
+
+class AssemblyError(Exception):
+    '''
+    Raised when a program cannot be assembled. diagnostics holds the
+    messages reported until the assembly stopped.
+    '''
+
+    def __init__(self, diagnostics):
+        self.diagnostics = diagnostics
+        errors = [d for d in diagnostics if d.severity == 'error']
+        if not errors:
+            msg = "Assembly failed"
+        elif errors[0].lineno is None:
+            msg = errors[0].message
+        else:
+            msg = "Line " + str(errors[0].lineno) + ": " + errors[0].message
+        Exception.__init__(self, msg)
+
+
+def check_options(options):
+    '''
+    raises: TypeError if an option is not one of OPTIONS
+    '''
+    for key in options:
+        if key not in OPTIONS:
+            raise TypeError("unknown assembler option '" + key + "'")
+    return options
+
+
+class Assembler:
+    '''
+    Assembler of programs held in memory. The options given here are
+    the defaults of every assembly, see OPTIONS.
+    '''
+
+    def __init__(self, **options):
+        self.options = dict(OPTIONS)
+        self.options.update(check_options(options))
+
+    def assemble(self, source, **options):
+        '''
+        Assembles the program source, given as str or as UTF-8 bytes,
+        with these options overriding those of the Assembler.
+
+        returns: the Result
+
+        raises: AssemblyError if the program cannot be assembled
+        '''
+        kwargs = dict(self.options)
+        kwargs.update(check_options(options))
+        kwargs.update(NO_CONSOLE)
+        if not isinstance(source, str):
+            source = bytes(source).decode('utf-8')
+        fin = StreamSource(io.StringIO(source))
+        image = emitter.Image(lines=True)
+        diagnostics = []
+
+        # Record the messages of this thread instead of printing them
+        saved = (cp.diagnostics, cp.warn, cp.warn32, cp.fail, cp.warnings,
+                 cp.errors)
+        cp.diagnostics = diagnostics
+        cp.warn = True
+        cp.warn32 = not kwargs['no_32']
+        cp.fail = True
+        try:
+            with symbols_scope():
+                symbols_table = parser.assemble(fin, [], False, kwargs,
+                                                image)
+                symbols = symbol_names(symbols_table)
+        except Abort:
+            raise AssemblyError([diagnostic(*d) for d in diagnostics]) \
+                from None
+        finally:
+            (cp.diagnostics, cp.warn, cp.warn32, cp.fail, cp.warnings,
+             cp.errors) = saved
+        return Result(image.words, symbols,
+                      [diagnostic(*d) for d in diagnostics])
@@ -0,0 +1,369 @@
+#
+# @author:Don Dennis
+# batchdisassembler.py
+#
+# Disassembles whole programs with NumPy.
+#
+# The text inputs are converted to words as arrays: every line of a
+# memb or memh file has the same width, so a chunk of the file is
+# viewed as a matrix of characters, one row per word. The targets of
+# the branches and jumps are extracted from the words as array
+# expressions. The words of a chunk are decoded as arrays too: their
+# instruction is looked up in a table indexed by the opcode, funct3 and
+# funct7 bits, and the words of each instruction have their fields
+# extracted and their text gathered together, see Text below. The
+# branches get the names of their labels, and the labels are declared,
+# as array operations as well.
+#
+# NumPy is optional. Without it, the disassembler uses its scalar path.
+
+import numpy as np
+from lib import disassembler
+from lib.disassembler import DISPATCH, RELATIVE, RELATIVE_OPCODES
+from lib.machinecodeconst import MachineCodeConst
+
+mcc = MachineCodeConst()
+
+# Value of each hex digit character, 255 for the other characters
+HEX_DIGITS = np.full(256, 255, dtype=np.uint8)
+for i, c in enumerate(b'0123456789ABCDEF'):
+    HEX_DIGITS[c] = i
+for i, c in enumerate(b'abcdef'):
+    HEX_DIGITS[c] = 10 + i
+
+
+def sorted_unique(values):
+    '''
+    returns: the distinct values, sorted. Faster than np.unique on
+    large arrays of integers.
+    '''
+    ordered = np.sort(values)
+    if len(ordered) < 2:
+        return ordered
+    return ordered[np.concatenate(([True], ordered[1:] != ordered[:-1]))]
+
+
+def as_array(words):
+    '''
+    returns: the words as a uint32 array sharing their memory
+    '''
+    return np.frombuffer(words, dtype=np.uint32)
+
+
+def text_words(data, base):
+    '''
+    Converts the lines of data, memb text if base is 2 or memh text if
+    base is 16, each ending with a newline.
+
+    returns: the words as bytes in machine byte order, None if the lines
+    are not all of the width of the format, in which case they are left
+    to the scalar path.
+    '''
+    width = 33 if base == 2 else 9
+    if len(data) % width:
+        return None
+    rows = np.frombuffer(data, dtype=np.uint8).reshape(-1, width)
+    if (rows[:, -1] != 10).any():
+        return None
+    if base == 2:
+        bits = rows[:, :-1] - 48
+        if (bits > 1).any():
+            return None
+        packed = np.packbits(bits, axis=1)
+    else:
+        digits = HEX_DIGITS[rows[:, :-1]]
+        if (digits == 255).any():
+            return None
+        packed = digits[:, 0::2] << 4 | digits[:, 1::2]
+    return np.ascontiguousarray(packed).view('>u4').astype(np.uint32) \
+        .tobytes()
+
+
+def valid_funct3(opcode):
+    '''
+    returns: array of whether an instruction of the major opcode has
+    the funct3, indexed by funct3
+    '''
+    entry = DISPATCH[opcode]
+    if type(entry) is list:
+        return np.array([e is not None for e in entry])
+    return np.ones(8, dtype=bool)
+
+
+def branch_targets(words, size):
+    '''
+    returns: the sorted list of the 4 bytes aligned addresses, up to
+    size, the branches and jumps of words go to
+    '''
+    major = words & 0x7F
+    targets = []
+    for opcode in RELATIVE_OPCODES:
+        entry = DISPATCH[opcode]
+        if type(entry) is list:
+            entry = next(e for e in entry if e is not None)
+        index = np.flatnonzero(major == opcode)
+        index = index[valid_funct3(opcode)[words[index] >> 12 & 0x7]]
+        w = words[index].astype(np.int64)
+        if entry[1].fmt == mcc.FMT_SB:
+            imm = (w >> 31 << 12 | (w >> 7 & 0x1) << 11 |
+                   (w >> 25 & 0x3F) << 5 | (w >> 8 & 0xF) << 1)
+            imm -= (imm >> 12) << 13
+        else:
+            imm = (w >> 31 << 20 | (w >> 12 & 0xFF) << 12 |
+                   (w >> 20 & 0x1) << 11 | (w >> 21 & 0x3FF) << 1)
+            imm -= (imm >> 20) << 21
+        target = index * 4 + imm
+        targets.append(target[(target >= 0) & (target <= size) &
+                              (target & 3 == 0)])
+    if not targets:
+        return []
+    return sorted_unique(np.concatenate(targets)).tolist()
+
+
+'''
+Decoding
+--------
+The instruction of a word is looked up in DECODE, the index in
+INSTRUCTIONS of the instruction of each combination of major opcode,
+funct3 and funct7 (see decode_key), -1 for the words that are not
+instructions. It is built from the DISPATCH table of disassembler.py.
+'''
+INSTRUCTIONS = sorted(mcc.INSTR_DESC.items(), key=lambda item: item[0])
+INSTRUCTION_IDS = dict((mnemonic, i)
+                       for i, (mnemonic, _) in enumerate(INSTRUCTIONS))
+
+
+def build_decode(dispatch):
+    '''
+    returns: the DECODE table of the DISPATCH table dispatch
+    '''
+    # Indexed by funct7, funct3 and major opcode
+    table = np.full((128, 8, 128), -1, dtype=np.int16)
+    for opcode, entry in enumerate(dispatch):
+        if entry is None:
+            continue
+        if type(entry) is tuple:
+            table[:, :, opcode] = INSTRUCTION_IDS[entry[0]]
+            continue
+        for funct3, instr in enumerate(entry):
+            if instr is None:
+                continue
+            if type(instr) is tuple:
+                table[:, funct3, opcode] = INSTRUCTION_IDS[instr[0]]
+                continue
+            if None in instr:
+                table[:, funct3, opcode] = INSTRUCTION_IDS[instr[None][0]]
+            for funct7, (mnemonic, _) in instr.items():
+                if funct7 is not None:
+                    table[funct7, funct3, opcode] = INSTRUCTION_IDS[mnemonic]
+    return table.reshape(-1)
+
+
+DECODE = build_decode(DISPATCH)
+
+
+def decode_key(words):
+    '''
+    returns: the indices in DECODE of words, an int64 array
+    '''
+    return words & 0x7F | words >> 5 & 0x380 | words >> 15 & 0x1FC00
+
+
+def sign_extend(values, bits):
+    return values - (values >> (bits - 1) << bits)
+
+
+'''
+Fields of each format, as the functions of disassembler.FORMAT_FIELDS,
+of an int64 array of words.
+'''
+
+
+def fields_r(w):
+    return w >> 7 & 0x1F, w >> 15 & 0x1F, w >> 20 & 0x1F
+
+
+def fields_i(w):
+    return w >> 7 & 0x1F, w >> 15 & 0x1F, sign_extend(w >> 20, 12)
+
+
+def fields_s(w):
+    return (w >> 15 & 0x1F, w >> 20 & 0x1F,
+            sign_extend(w >> 25 << 5 | w >> 7 & 0x1F, 12))
+
+
+def fields_sb(w):
+    return (w >> 15 & 0x1F, w >> 20 & 0x1F,
+            sign_extend(w >> 31 << 12 | (w >> 7 & 0x1) << 11 |
+                        (w >> 25 & 0x3F) << 5 | (w >> 8 & 0xF) << 1, 13))
+
+
+def fields_u(w):
+    return w >> 7 & 0x1F, sign_extend(w >> 12, 20)
+
+
+def fields_uj(w):
+    return (w >> 7 & 0x1F,
+            sign_extend(w >> 31 << 20 | (w >> 12 & 0xFF) << 12 |
+                        (w >> 20 & 0x1) << 11 | (w >> 21 & 0x3FF) << 1, 21))
+
+
+FORMAT_FIELDS = {
+    mcc.FMT_R: fields_r,
+    mcc.FMT_I: fields_i,
+    mcc.FMT_S: fields_s,
+    mcc.FMT_SB: fields_sb,
+    mcc.FMT_U: fields_u,
+    mcc.FMT_UJ: fields_uj
+}
+
+
+'''
+Text
+----
+The line of an instruction is its head, the mnemonic and every operand
+but the last one, which are all registers, and its tail, the last
+operand and the newline. The heads of each instruction are kept in an
+array indexed by the registers they hold, and the tails are taken from
+arrays of the register names and of the numbers of 12 and 13 bit
+immediates, or converted for the others. The heads and tails of the
+instructions of a kind are thus gathered with one indexing each, and
+the text of a chunk is the join of its heads and tails, in program
+order, without building its lines one by one.
+'''
+
+
+def as_strings(values):
+    '''
+    returns: the object array of the strings of values
+    '''
+    strings = np.empty(len(values), dtype=object)
+    strings[:] = values
+    return strings
+
+
+REGISTERS = as_strings(['$%d\n' % r for r in range(32)])
+# Smallest immediate of NUMBERS, which holds the numbers of 13 bits
+NUMBERS_MIN = -1 << 12
+NUMBERS = as_strings(['%d\n' % i for i in range(NUMBERS_MIN, -NUMBERS_MIN)])
+
+# Instruction index -> its heads, built on first use
+_heads = {}
+
+
+def heads(k):
+    '''
+    returns: the heads of the instruction of index k, indexed by its
+    first register, or by 32 times its first plus its second
+    '''
+    table = _heads.get(k)
+    if table is None:
+        mnemonic, desc = INSTRUCTIONS[k]
+        prefix = '\t' + mnemonic + ' '
+        if len(desc.operands) == 2:
+            table = as_strings([prefix + '$%d, ' % r for r in range(32)])
+        else:
+            table = as_strings([prefix + '$%d, $%d, ' % (a, b)
+                                for a in range(32) for b in range(32)])
+        _heads[k] = table
+    return table
+
+
+def numbers(values):
+    '''
+    returns: the tails of the numbers of the int64 array values
+    '''
+    if len(values) and values.min() >= NUMBERS_MIN and \
+            values.max() < -NUMBERS_MIN:
+        return NUMBERS[values - NUMBERS_MIN]
+    return as_strings(list(map('%d\n'.__mod__, values.tolist())))
+
+
+class LineTable(disassembler.LineTable):
+    '''
+    Lines of the instructions of words, a uint32 array, as
+    disassembler.LineTable. The words of a chunk are grouped by
+    instruction, and the heads and tails of each group gathered as
+    arrays.
+    '''
+
+    def __init__(self, words, labels):
+        self.words = words
+        self.labels = labels
+        self.label = 0
+        # The labels, as arrays
+        self.addresses = np.array(labels.addresses, dtype=np.int64)
+        self.names = as_strings([name + '\n' for name in labels.names])
+        self.declarations = as_strings(labels.declarations)
+
+    def targets(self, targets, offsets):
+        '''
+        returns: the tails of the relative instructions going to
+        targets, their label or else their offset
+        '''
+        addresses = self.addresses
+        label = np.searchsorted(addresses, targets)
+        if len(addresses):
+            np.minimum(label, len(addresses) - 1, out=label)
+            found = addresses[label] == targets
+        else:
+            found = np.zeros(len(targets), dtype=bool)
+        if found.all():
+            return self.names[label]
+        tails = numbers(offsets)
+        tails[found] = self.names[label[found]]
+        return tails
+
+    def group(self, k, w, index):
+        '''
+        returns: (heads, tails) of the words w of the instruction of
+        index k, at the indices index of the program
+        '''
+        desc = INSTRUCTIONS[k][1]
+        fields = FORMAT_FIELDS[desc.fmt](w)
+        if len(fields) == 2:
+            head = heads(k)[fields[0]]
+        else:
+            head = heads(k)[fields[0] << 5 | fields[1]]
+        last = fields[-1]
+        if desc.fmt == mcc.FMT_R:
+            return head, REGISTERS[last]
+        if desc.fmt in RELATIVE:
+            return head, self.targets(index * 4 + last, last)
+        return head, numbers(last)
+
+    def text(self, start, stop, invalid):
+        words = self.words[start:stop].astype(np.int64)
+        kinds = DECODE[decode_key(words)]
+        # Heads and tails, interleaved
+        pieces = np.empty(2 * len(words), dtype=object)
+        heads = pieces[0::2]
+        tails = pieces[1::2]
+        # The words grouped by instruction, in program order in each
+        order = np.argsort(kinds, kind='stable')
+        ordered = kinds[order]
+        cuts = np.flatnonzero(ordered[1:] != ordered[:-1]) + 1
+        for group in np.split(order, cuts):
+            if not len(group):
+                continue
+            k = int(kinds[group[0]])
+            if k < 0:
+                invalid.add((start + int(group[0])) * 4, len(group))
+                heads[group] = ''
+                tails[group] = [disassembler.invalid_line(word) + '\n'
+                                for word in words[group].tolist()]
+            else:
+                heads[group], tails[group] = self.group(k, words[group],
+                                                        group + start)
+
+        addresses = self.addresses
+        first = self.label
+        last = int(np.searchsorted(addresses, stop * 4))
+        if last > first:
+            at = addresses[first:last] // 4 - start
+            heads[at] = self.declarations[first:last] + heads[at]
+        self.label = last
+        return ''.join(pieces.tolist())
+
+    def lines(self, start, stop, invalid):
+        return self.text(start, stop, invalid).split('\n')[:-1]
@@ -0,0 +1,264 @@
+#
+# @author:Don Dennis
+# batchencoder.py
+#
+# Encodes a whole parsed program at once with NumPy.
+#
+# The columns of the parsed Program (see ir.py) are viewed as arrays,
+# together with per instruction columns looked up from the opcode:
+# format and the base word of the instruction (opcode, funct3 and the
+# R type funct7). The immediate fields of every format are then shifted, masked and
+# scattered into place as array expressions, giving the program as a
+# single uint32 array.
+#
+# The checks the scalar path makes instruction by instruction in the
+# get_imm_* functions of the parser and in the op_* methods of the
+# machine code generator are vectorized as well. The affected line
+# numbers are collected and reported with the same messages and in
+# the same order as the scalar path reports them.
+#
+# NumPy is optional. Without it, parse_input falls back to the scalar
+# encoder.
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from lib.cprint import cprint as cp
+from lib.machinecodeconst import MachineCodeConst
+from lib.machinecodegen import mcg
+
+mcc = MachineCodeConst()
+
+# Format ids used in the format column
+FORMATS = (mcc.FMT_R, mcc.FMT_I, mcc.FMT_S, mcc.FMT_SB, mcc.FMT_U,
+           mcc.FMT_UJ)
+FORMAT_ID = dict((fmt, i) for i, fmt in enumerate(FORMATS))
+F_R, F_I, F_S, F_SB, F_U, F_UJ = range(len(FORMATS))
+
+'''
+Immediate range of each format as (min, max), indexed by format id,
+and the message of the overflow warning. Only immediates are checked,
+hence the R type range accepts anything.
+'''
+IMM_RANGE = (
+    (-2 ** 63, 2 ** 63 - 1),
+    (-0b100000000000, 0b011111111111),
+    (-0b100000000000, 0b011111111111),
+    (-0b1000000000000, 0b0111111111110),
+    (-0b10000000000000000000, 0b01111111111111111111),
+    (-0b100000000000000000000, 0b011111111111111111110)
+)
+IMM_OVERFLOW = ("Immediate is too big, will overflow.",
+                "Immediate is too big, will overflow.",
+                " Immediate is too big, will overflow.",
+                "Immediate is too big, will overflow.",
+                "Immediate is too big, will overflow.",
+                "Immediate is too big, will overflow.")
+IMM_UNALIGNED = ("Immediate not 2 bytes aligned. Last bit will" +
+                 "be dropped.")
+
+'''
+Warnings are sorted on (line number, kind), the kinds being numbered
+in the order the scalar path raises them for a single instruction:
+the immediate checks of the parser first, then those of the machine
+code generator.
+'''
+W_RANGE, W_UNALIGNED, W_MISALIGNED, W_SHIFT = range(4)
+
+
+def available():
+    return np is not None
+
+
+def opcode_table(value, dtype):
+    '''
+    returns: array of value(desc) indexed by opcode id
+    '''
+    return np.array([value(mcc.INSTR_DESC[opcode])
+                     for opcode in mcc.ALL_INSTR], dtype=dtype)
+
+
+if np is not None:
+    # Per opcode lookup tables
+    OPCODE_FMT = opcode_table(lambda d: FORMAT_ID[d.fmt], np.int8)
+    OPCODE_BASE = opcode_table(lambda d: d.base, np.uint32)
+    OPCODE_ALIGNED = opcode_table(lambda d: d.aligned, bool)
+    # Expected upper immediate bits of the shift immediates, -1 for
+    # the other instructions
+    OPCODE_SHIFT = opcode_table(
+        lambda d: d.funct7 if d.fmt == mcc.FMT_I and d.funct7 is not None
+        else -1, np.int64)
+
+
+def build_columns(program, symbols_table):
+    '''
+    Builds the column arrays of the instructions of the program,
+    replacing labels with their offsets. The program arrays are used
+    in place, only the immediates are copied.
+
+    returns: (columns, error), where error is the index of the first
+    instruction using an undefined label and the columns only hold the
+    instructions before it, or None.
+    '''
+    opcode = np.asarray(program.opcode)
+    label = np.asarray(program.label)
+    imm = np.array(program.imm, dtype=np.int64)
+    error = None
+
+    labelled = np.flatnonzero(label >= 0)
+    if len(labelled):
+        targets = np.full(int(label.max()) + 1, -1, dtype=np.int64)
+        for sid, address in symbols_table.items():
+            if sid < len(targets):
+                targets[sid] = address
+        target = targets[label[labelled]]
+        undefined = np.flatnonzero(target < 0)
+        if len(undefined):
+            error = int(labelled[undefined[0]])
+        imm[labelled] = target - 4 * labelled
+
+    n = len(opcode) if error is None else error
+    opcode = opcode[:n]
+    columns = {
+        'fmt': OPCODE_FMT[opcode],
+        'rd': np.maximum(np.asarray(program.rd)[:n], 0).astype(np.uint32),
+        'rs1': np.maximum(np.asarray(program.rs1)[:n], 0).astype(np.uint32),
+        'rs2': np.maximum(np.asarray(program.rs2)[:n], 0).astype(np.uint32),
+        'imm': imm[:n],
+        'base': OPCODE_BASE[opcode],
+        'aligned': OPCODE_ALIGNED[opcode],
+        'funct7': OPCODE_SHIFT[opcode],
+        'lineno': np.asarray(program.lineno)[:n],
+        'opcode': opcode
+    }
+    return columns, error
+
+
+def encode_columns(c):
+    '''
+    Encodes the instructions held in the columns.
+
+    returns: the instructions as a uint32 array
+    '''
+    fmt = c['fmt']
+    imm = c['imm']
+    field = np.zeros(len(fmt), dtype=np.int64)
+
+    sel = fmt == F_I
+    m = imm[sel] & 0xFFF
+    field[sel] = m << 20
+
+    sel = fmt == F_S
+    m = imm[sel] & 0xFFF
+    field[sel] = (m >> 5) << 25 | (m & 0x1F) << 7
+
+    sel = fmt == F_SB
+    m = imm[sel] & 0x1FFF
+    field[sel] = ((m >> 12 & 0x1) << 31 | (m >> 5 & 0x3F) << 25 |
+                  (m >> 1 & 0xF) << 8 | (m >> 11 & 0x1) << 7)
+
+    sel = fmt == F_U
+    m = imm[sel] & 0xFFFFF
+    field[sel] = m << 12
+
+    sel = fmt == F_UJ
+    m = imm[sel] & 0x1FFFFF
+    field[sel] = ((m >> 20 & 0x1) << 31 | (m >> 1 & 0x3FF) << 21 |
+                  (m >> 11 & 0x1) << 20 | (m >> 12 & 0xFF) << 12)
+
+    # S and SB have no rd, R and the register fields of the other
+    # formats are zero where the format has no such operand.
+    return (c['base'] | c['rd'] << 7 | c['rs1'] << 15 | c['rs2'] << 20 |
+            field.astype(np.uint32))
+
+
+def check_columns(c):
+    '''
+    Vectorized immediate checks.
+
+    returns: a list of (lineno, kind, message) sorted in the order the
+    scalar path reports them.
+    '''
+    fmt = c['fmt']
+    imm = c['imm']
+    lineno = c['lineno']
+    warnings = []
+
+    lo = np.array([r[0] for r in IMM_RANGE], dtype=np.int64)[fmt]
+    hi = np.array([r[1] for r in IMM_RANGE], dtype=np.int64)[fmt]
+    for i in np.flatnonzero((imm < lo) | (imm > hi)):
+        warnings.append((int(lineno[i]), W_RANGE,
+                         IMM_OVERFLOW[fmt[i]]))
+
+    branch = (fmt == F_SB) | (fmt == F_UJ)
+    for i in np.flatnonzero(branch & (imm & 1 == 1)):
+        warnings.append((int(lineno[i]), W_UNALIGNED, IMM_UNALIGNED))
+
+    # SB offsets are in multiples of two, bit 0 is not encoded
+    misaligned = np.where(fmt == F_SB, imm & 0b10, imm & 0b11) != 0
+    misaligned &= c['aligned']
+    for i in np.flatnonzero(misaligned):
+        warnings.append((int(lineno[i]), W_MISALIGNED, None))
+
+    funct7 = c['funct7']
+    shift = (funct7 >= 0) & ((imm & 0xFFF) >> 5 != funct7)
+    for i in np.flatnonzero(shift):
+        warnings.append((int(lineno[i]), W_SHIFT, int(funct7[i])))
+
+    warnings.sort(key=lambda w: (w[0], w[1]))
+    return warnings
+
+
+def report(warnings):
+    for lineno, kind, arg in warnings:
+        if kind == W_MISALIGNED:
+            mcg.warn_misaligned(lineno)
+        elif kind == W_SHIFT:
+            expected = '0' if arg == 0 else format(arg, '07b')
+            cp.cprint_warn("Warning:" + str(lineno) +
+                           ": Upper 7 bits of immediate should be " +
+                           expected)
+        else:
+            cp.cprint_warn("Warning:" + str(lineno) + ":" + arg)
+
+
+def write_program(image, columns, instrs, warnings, args):
+    '''
+    Adds the encoded program to the image and reports the warnings.
+    When the instructions are echoed, the warnings of each line are
+    reported right before it, as the scalar path does.
+    '''
+    if args['echo'] or args['tokenize']:
+        from lib.parser import write_instr
+        pos = 0
+        for lineno, opcode, instr in zip(columns['lineno'].tolist(),
+                                         columns['opcode'].tolist(),
+                                         instrs.tolist()):
+            end = pos
+            while end < len(warnings) and warnings[end][0] <= lineno:
+                end += 1
+            report(warnings[pos:end])
+            pos = end
+            write_instr(image, lineno, mcc.ALL_INSTR[opcode], instr, args)
+        report(warnings[pos:])
+        return
+    report(warnings)
+    image.extend(instrs.tolist())
+    if image.lines is not None:
+        image.lines.extend(columns['lineno'].tolist())
+
+
+def encode_program(program, image, symbols_table, args):
+    '''
+    Batch counterpart of parser.encode_statements. The Program must
+    have been parsed with warnings suppressed, the checks are made
+    here for the whole program.
+    '''
+    columns, error = build_columns(program, symbols_table)
+    write_program(image, columns, encode_columns(columns),
+                  check_columns(columns), args)
+    if error is not None:
+        from lib.parser import undefined_label
+        undefined_label(program.instr(error))
@@ -0,0 +1,292 @@
+#
+# @author:Don Dennis
+# cache.py
+#
+# On disk cache of assembled programs.
+#
+# An assembly is identified by a hash of everything its outputs and
+# messages depend on: the bytes of the source, the options changing
+# the outputs or the messages, the formats of the outputs, and the
+# code of the assembler itself. Once a source has been assembled, its
+# outputs and messages are stored in the cache under that hash, and
+# assembling it again with the same options only copies the outputs
+# and prints the messages, without parsing anything. Failed assemblies
+# are not cached.
+#
+# Layout of the cache directory:
+#
+#   entries/KEY/        one directory per assembly, holding
+#       messages        the messages printed while assembling
+#       0, 1, ...       the content of each output, in order
+#   tmp/                entries being written or removed
+#   stats.json          the counts of hits and misses and the bytes of
+#                       output the hits saved
+#   stats.lock          lock of stats.json
+#
+# Entries are written in tmp/ and renamed into entries/ once complete,
+# and removed by renaming them back into tmp/ first, so that the
+# processes sharing the cache only ever see complete entries. The
+# modification time of an entry is updated on every hit, and the least
+# recently used entries are removed when the cache grows over its size
+# limit. The counters of stats.json are updated by reading them, adding
+# the lookup and replacing the file, holding the lock so that no
+# lookup of a concurrent process is lost.
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+try:
+    import fcntl
+except ImportError:
+    # Without file locks, concurrent lookups may miss each other in
+    # the counters
+    fcntl = None
+from lib.client import OPTIONS
+from lib.cprint import cprint as cp
+
+# Default size limit of the cache in bytes
+DEFAULT_LIMIT = 256 * 1024 * 1024
+
+_CODE_HASH = None
+
+
+def code_hash():
+    '''
+    returns: hash of the modules of the assembler, standing for its
+    version.
+    '''
+    global _CODE_HASH
+    if _CODE_HASH is None:
+        h = hashlib.sha256()
+        lib = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(lib)):
+            if name.endswith('.py'):
+                with open(os.path.join(lib, name), 'rb') as fin:
+                    h.update(name.encode('utf-8') + b'\0' + fin.read())
+        _CODE_HASH = h.hexdigest()
+    return _CODE_HASH
+
+
+def cache_key(data, outputs, kwargs):
+    '''
+    returns: the key of the assembly of the source bytes data into
+    outputs, a list of (format, filename), with the options kwargs.
+    '''
+    options = dict((key, bool(kwargs.get(key))) for key in OPTIONS)
+    # Only the C header depends on the name of its file
+    formats = [(fmt, os.path.basename(filename) if fmt == 'c' else None)
+               for fmt, filename in outputs]
+    h = hashlib.sha256()
+    h.update(json.dumps([code_hash(), options, formats],
+                        sort_keys=True).encode('utf-8'))
+    h.update(b'\0')
+    h.update(data)
+    return h.hexdigest()
+
+
+class Cache:
+
+    def __init__(self, path, limit=DEFAULT_LIMIT):
+        self.path = path
+        self.limit = limit
+        self.entries = os.path.join(path, 'entries')
+        self.tmp = os.path.join(path, 'tmp')
+        self.counters = os.path.join(path, 'stats.json')
+        self.lock = os.path.join(path, 'stats.lock')
+        os.makedirs(self.entries, exist_ok=True)
+        os.makedirs(self.tmp, exist_ok=True)
+
+    def get(self, key, count):
+        '''
+        returns: (outputs, messages) of the entry key, outputs being
+        the content of its count outputs, or None if there is no such
+        entry.
+        '''
+        entry = os.path.join(self.entries, key)
+        try:
+            with open(os.path.join(entry, 'messages'), 'r') as fin:
+                messages = fin.read()
+            outputs = []
+            for i in range(count):
+                with open(os.path.join(entry, str(i)), 'rb') as fin:
+                    outputs.append(fin.read())
+            # Most recently used
+            os.utime(entry)
+        except OSError:
+            # Missing, or removed while being read
+            self.record(False)
+            return None
+        self.record(True, sum(len(output) for output in outputs))
+        return outputs, messages
+
+    def put(self, key, outputs, messages):
+        '''
+        Stores the outputs and messages of an assembly as entry key.
+        '''
+        entry = tempfile.mkdtemp(dir=self.tmp)
+        with open(os.path.join(entry, 'messages'), 'w') as fout:
+            fout.write(messages)
+        for i, output in enumerate(outputs):
+            with open(os.path.join(entry, str(i)), 'wb') as fout:
+                fout.write(output)
+        try:
+            os.rename(entry, os.path.join(self.entries, key))
+        except OSError:
+            # Stored by another process in the meantime
+            shutil.rmtree(entry, ignore_errors=True)
+            return
+        self.evict()
+
+    def scan(self):
+        '''
+        returns: list of (last use, size, key) of the entries
+        '''
+        entries = []
+        for entry in os.scandir(self.entries):
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.name))
+            except OSError:
+                # Removed in the meantime
+                continue
+        return entries
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the cache fits
+        in its size limit.
+        '''
+        entries = self.scan()
+        size = sum(entry[1] for entry in entries)
+        if size <= self.limit:
+            return
+        for _, entry_size, key in sorted(entries):
+            trash = tempfile.mkdtemp(dir=self.tmp)
+            try:
+                os.rename(os.path.join(self.entries, key),
+                          os.path.join(trash, key))
+                size -= entry_size
+            except OSError:
+                # Removed by another process
+                pass
+            shutil.rmtree(trash, ignore_errors=True)
+            if size <= self.limit:
+                break
+
+    def read_counters(self):
+        '''
+        returns: the counters of the lookups, zero if there are none
+        '''
+        counters = {'hits': 0, 'misses': 0, 'bytes_saved': 0}
+        try:
+            with open(self.counters, 'r') as fin:
+                counters.update(json.load(fin))
+        except (OSError, ValueError):
+            pass
+        return counters
+
+    def record(self, hit, saved=0):
+        '''
+        Counts a lookup, a hit saving saved bytes of output or a miss.
+        '''
+        try:
+            with open(self.lock, 'a') as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                counters = self.read_counters()
+                if hit:
+                    counters['hits'] += 1
+                    counters['bytes_saved'] += saved
+                else:
+                    counters['misses'] += 1
+                fd, tmp = tempfile.mkstemp(dir=self.tmp)
+                with os.fdopen(fd, 'w') as fout:
+                    json.dump(counters, fout)
+                os.replace(tmp, self.counters)
+        except OSError:
+            pass
+
+    def stats(self):
+        counters = self.read_counters()
+        hits = counters['hits']
+        misses = counters['misses']
+        entries = self.scan()
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+            'bytes_saved': counters['bytes_saved'],
+            'entries': len(entries),
+            'size': sum(entry[1] for entry in entries),
+            'limit': self.limit
+        }
+
+
+def open_cache(kwargs):
+    '''
+    returns: the cache of the --cache and --cache-size options, or None
+    if it cannot be used.
+    '''
+    limit = kwargs.get('cache_size')
+    limit = DEFAULT_LIMIT if limit is None else int(limit * 1024 * 1024)
+    try:
+        return Cache(kwargs['cache'], limit)
+    except OSError as e:
+        cp.cprint_warn("Warning: Could not open the cache, " + str(e))
+        return None
+
+
+def assemble(fin, outputs, fouts, kwargs):
+    '''
+    Assembles the mapped source fin into fouts, the opened outputs,
+    through the cache.
+    '''
+    from lib import emitter, parser
+    cache = open_cache(kwargs)
+    if cache is None:
+        parser.assemble(fin, fouts, False, kwargs)
+        return
+    key = cache_key(fin.data, outputs, kwargs)
+    hit = cache.get(key, len(fouts))
+    if hit is not None:
+        contents, messages = hit
+        if messages:
+            print(messages, end='', file=cp.out)
+        for (_, fout), content in zip(fouts, contents):
+            fout.write(content)
+        return
+
+    # Assemble into memory, to keep the outputs and messages
+    out = cp.out
+    cp.out = io.StringIO()
+    buffers = [(fmt, emitter.Buffer(fout.name)) for fmt, fout in fouts]
+    try:
+        parser.assemble(fin, buffers, False, kwargs)
+    finally:
+        messages = cp.out.getvalue()
+        cp.out = out
+        if messages:
+            print(messages, end='', file=out)
+    contents = [buf.getvalue() for _, buf in buffers]
+    for (_, fout), content in zip(fouts, contents):
+        fout.write(content)
+    try:
+        cache.put(key, contents, messages)
+    except OSError as e:
+        cp.cprint_warn("Warning: Could not store in the cache, " + str(e))
+
+
+def print_stats(kwargs):
+    '''
+    Prints the statistics of the cache as JSON.
+    '''
+    cache = open_cache(kwargs)
+    if cache is None:
+        return 1
+    json.dump(cache.stats(), sys.stdout, indent=2)
+    print()
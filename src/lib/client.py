@@ -0,0 +1,99 @@
+#
+# @author:Don Dennis
+# client.py
+#
+# Protocol between the assembler server (server.py) and its clients.
+#
+# A client connects to the Unix domain socket of the server and sends
+# requests, each getting one response. Requests and responses are JSON
+# objects, each sent as its length in UTF-8 bytes (4 bytes, big
+# endian) followed by the UTF-8 text. Binary outputs are base64
+# encoded.
+#
+# Requests:
+#
+#   {"op": "assemble", "source": TEXT, "options": {OPTION: VALUE},
+#    "outputs": [[FORMAT, FILE], ...]}
+#       Assembles the source with the command line options of rvi.py
+#       (without the file names). The response holds the exit status,
+#       the messages the assembler would print, and the content of each
+#       output, FILE only naming the output in the C header format.
+#
+#       {"status": 0 | 1, "messages": TEXT, "outputs": [BASE64, ...]}
+#
+#   {"op": "stats"}
+#       Statistics of the server: request counts and latencies (see
+#       server.py).
+#
+# An invalid request gets {"error": MESSAGE}.
+
+import json
+import socket
+import struct
+
+HEADER = struct.Struct('>I')
+# Largest message accepted
+MAX_MESSAGE = 1 << 30
+
+# Options of a request, with their default values
+OPTIONS = {
+    'hex': False,
+    'no_32': False,
+    'no_color': False,
+    'echo': False,
+    'tokenize': False,
+    'echo_symbols': False,
+    'single_pass': False,
+    'whole_program': False,
+    'batch': False
+}
+
+
+def recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def recv_message(sock):
+    '''
+    returns: the next message, or None if the connection is closed.
+
+    raises: ValueError if the message is not valid
+    '''
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    size, = HEADER.unpack(header)
+    if size > MAX_MESSAGE:
+        raise ValueError("message too large")
+    data = recv_exact(sock, size)
+    if data is None:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+def send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def request(path, message):
+    '''
+    Sends one request to the server listening on path.
+
+    returns: the response
+
+    raises: OSError if the server cannot be reached
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        send_message(sock, message)
+        response = recv_message(sock)
+    if response is None:
+        raise ConnectionError("connection closed by the server")
+    return response
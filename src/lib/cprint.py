@@ -3,9 +3,119 @@
 # cprint.py
 #
 # Color Print.
+#
+# The settings, counters and output stream are kept per thread, so that
+# programs assembled in different threads do not share them.
+#
+# The assemblies parsing their source once (single pass, whole program
+# and batch) issue their messages in another order than the two pass
+# assembly, which prints the messages of its first pass, then those of
+# every line in turn. Their messages are held in an Ordered while they
+# run and printed in the order of the two pass assembly once they end,
+# so that the messages do not depend on the way a program is assembled.
+
+import re
+import threading
+
+# Line of a warning, 'Warning:12:' or '32_Warning:12:'
+_WARNING_LINE = re.compile(r'(?:32_)?Warning\s*:\s*(\d+)')
+# Line of an error, 'Error:12:' or 'Error: 12 :'
+_ERROR_LINE = re.compile(r'Error\s*:\s*(\d+)')
+
+
+class Abort(SystemExit):
+    '''
+    Raised to stop assembling once an error has been reported. Being a
+    SystemExit, it ends the command line tools with its status code
+    like exit() would, without closing the standard input.
+    '''
+    pass
+
+
+class Ordered:
+    '''
+    Messages held back while a program is assembled, to be printed in
+    the order of the two pass assembly. Its first pass prints the
+    messages of the lexer, the errors of the parser and the symbols
+    table. Its second pass, only run if the first one went through,
+    prints line after line the messages of the lexer and the errors of
+    the parser again, the warnings and the echo of the instruction,
+    stopping at its first error.
 
+    first: the messages of the first pass, as (at, color, message,
+        kind), at being the line of the message, None if not about a
+        line, and color None for the plain messages of cprint()
+    second: the messages of the second pass, as (lineno, order, color,
+        message, kind), order being the order they were issued in
+    line: the line of the messages issued, None if they are messages
+        of the first pass or warnings, which are located by their text
+    stop: the (lineno, order) of the error stopping the second pass,
+        None if it was not stopped
+    end: the line of the error stopping the first pass, None if not
+        known, the first pass being stopped by the last error
+    aborted: whether the assembly stopped on an error
+    '''
 
-class CPrint:
+    def __init__(self):
+        self.first = []
+        self.second = []
+        self.line = None
+        self.stop = None
+        self.end = None
+        self.aborted = False
+
+    def add(self, color, msg, kind, line=None, at=None):
+        '''
+        Holds a message back, issued in the second pass at line, or in
+        the first pass at the line at. Without either, the line is that
+        of the Ordered, or told from the text of warnings and errors.
+        '''
+        if line is None and at is None:
+            line = self.line
+            if line is not None and kind == 'error' and self.stop is None:
+                self.stop = (line, len(self.second))
+        if line is None and at is None and kind == 'warning':
+            m = _WARNING_LINE.match(msg)
+            line = m and int(m.group(1))
+        if line is not None:
+            self.second.append((line, len(self.second), color, msg, kind))
+            return
+        if at is None and kind == 'error':
+            m = _ERROR_LINE.match(msg)
+            at = m and int(m.group(1))
+        self.first.append((at, color, msg, kind))
+
+    def again(self, start, line):
+        '''
+        Issues the errors of the first pass from its message start on
+        again in the second pass at line, as the two pass assembly does
+        when it parses the line again.
+        '''
+        for _, color, msg, kind in self.first[start:]:
+            if kind == 'error':
+                self.add(color, msg, kind, line)
+
+    def messages(self):
+        '''
+        Yields the (color, message, kind) of the messages in the order
+        of the two pass assembly, up to the error stopping it.
+        '''
+        if self.aborted and self.stop is None:
+            # Stopped in the first pass, which the assemblies parsing
+            # the whole program first may have gone on with
+            for at, color, msg, kind in self.first:
+                if self.end is None or at is None or at <= self.end:
+                    yield color, msg, kind
+            return
+        for message in self.first:
+            yield message[1:]
+        for message in sorted(self.second):
+            yield message[2:]
+            if message[:2] == self.stop:
+                return
+
+
+class CPrint(threading.local):
     HEADER = '\033[95m'
     OKBLUE = '\033[94m'
     OKGREEN = '\033[92m'
@@ -18,17 +128,53 @@ class CPrint:
     no_color = False
     warn = True
     fail = True
+    # Stream the messages are printed to, None for stdout
+    out = None
+    # Number of warnings and errors printed
+    warnings = 0
+    errors = 0
+    # Number of warnings and errors issued, printed or not
+    issued = 0
+    # List the messages are recorded in as (kind, message) instead of
+    # being printed, kind being 'message', 'warning' or 'error'
+    diagnostics = None
+    # Event stopping the assembly of this thread once set (see aio.py)
+    cancel = None
+    # Counters of the assembly of this thread (see stats.py), None when
+    # not collected
+    stats = None
+    # Ordered the messages are held in instead of being printed, None
+    # to print them
+    ordered = None
 
-    def cprint_cus(self, bc, msg):
+    def cprint_cus(self, bc, msg, kind='message'):
+        if self.ordered is not None:
+            self.ordered.add(bc, msg, kind)
+            return
+        if kind == 'warning':
+            self.warnings += 1
+        elif kind == 'error':
+            self.errors += 1
+        if self.stats is not None and kind != 'message':
+            self.stats.message(kind, msg)
+        if self.diagnostics is not None:
+            self.diagnostics.append((kind, msg))
+            return
         s = bc
         e = self.ENDC
         if self.no_color:
             s = ''
             e = ''
-        print(s + msg + e)
+        print(s + msg + e, file=self.out)
 
     def cprint(self, msg):
-        print(msg)
+        if self.ordered is not None:
+            self.ordered.add(None, msg, 'message')
+            return
+        if self.diagnostics is not None:
+            self.diagnostics.append(('message', msg))
+            return
+        print(msg, file=self.out)
 
     def cprint_msg(self, msg):
         self.cprint_cus(self.OKGREEN, msg)
@@ -40,16 +186,31 @@ class CPrint:
         self.cprint_cus(self.OKBLUE, msg)
 
     def cprint_warn(self, msg):
+        self.issued += 1
         if self.warn:
-            self.cprint_cus(self.WARNING, msg)
+            self.cprint_cus(self.WARNING, msg, 'warning')
 
     def cprint_fail(self, msg):
+        self.issued += 1
         if self.fail:
-            self.cprint_cus(self.BOLD + self.FAIL, msg)
+            self.cprint_cus(self.BOLD + self.FAIL, msg, 'error')
 
     def cprint_warn_32(self, msg):
         if self.warn32:
             self.cprint_warn(msg)
+        else:
+            self.issued += 1
+
+
+    def release(self, ordered):
+        '''
+        Prints the messages held in ordered, see Ordered.messages().
+        '''
+        for color, msg, kind in ordered.messages():
+            if color is None:
+                self.cprint(msg)
+            else:
+                self.cprint_cus(color, msg, kind)
 
 
 cprint = CPrint()
@@ -0,0 +1,525 @@
+#
+# @author:Don Dennis
+# disassembler.py
+#
+# Disassembler of assembled programs.
+#
+# The words written by the assembler (memb, memh or bin, see
+# emitter.py) are turned back into source lines that assemble into the
+# same words. Decoding is driven by tables built from the instruction
+# registry (INSTR_DESC in machinecodeconst.py): a 128 entry table
+# indexed by the major opcode, the low 7 bits of the word, holding for
+# each opcode the instruction, or a table indexed by funct3 whose
+# entries are an instruction or a table indexed by funct7.
+#
+# The targets of the branches and jumps (SB and UJ formats) inside the
+# program are given labels, named after their address (L_1C for
+# address 0x1c) unless the MemoryImage has symbols, and the branches
+# refer to them by name. Words that are not instructions of the
+# registry are written as comments.
+#
+# The words are read in chunks into a MemoryImage, four bytes per word,
+# and the text is written in chunks as it is produced. Every distinct
+# word is only decoded once. With batch, the input text is converted,
+# the labels found and the words decoded with NumPy, the text of a
+# chunk being built by instruction rather than by word.
+#
+#   >>> image = read_words(open('prog.b', 'rb'))
+#   >>> for chunk in text_chunks(image):
+#   ...     out.write(chunk)
+
+import re
+import sys
+from lib.cprint import cprint as cp
+from lib.machinecodeconst import MachineCodeConst
+from lib.memoryimage import MemoryImage
+
+mcc = MachineCodeConst()
+
+# Input formats, as in emitter.py
+FORMATS = ('memb', 'memh', 'bin')
+
+# Bytes read from the input at once
+CHUNK_SIZE = 1 << 20
+# Largest number of lines written at once
+CHUNK_LINES = 1 << 16
+
+_MEMB = re.compile(rb'[01]{32}\r?(?:\n|$)')
+_MEMH = re.compile(rb'[0-9A-Fa-f]{8}\r?(?:\n|$)')
+
+
+'''
+Decoding tables
+---------------
+DISPATCH holds, for each of the 128 major opcodes, None if no
+instruction has it, the (mnemonic, descriptor) of the instruction if
+only one has, or else a table of 8 entries indexed by funct3. Each of
+these is None, an instruction, or a dict indexed by funct7 when several
+instructions share the funct3. For the shift immediates funct7 is only
+expected in the upper bits of the immediate, so the dict also has an
+entry for None, the instruction encoded with funct7 0, taking any other
+upper bits as the assembler would encode them.
+'''
+
+
+def build_dispatch(instr_desc):
+    '''
+    returns: the DISPATCH table of the instruction registry instr_desc
+    '''
+    by_opcode = {}
+    for mnemonic, desc in instr_desc.items():
+        by_opcode.setdefault(desc.opcode, []).append((mnemonic, desc))
+    dispatch = [None] * 128
+    for opcode, instrs in by_opcode.items():
+        if len(instrs) == 1 and instrs[0][1].funct3 is None:
+            dispatch[opcode] = instrs[0]
+            continue
+        table = [None] * 8
+        for funct3 in range(8):
+            group = [(m, d) for m, d in instrs if d.funct3 == funct3]
+            if not group:
+                continue
+            if len(group) == 1 and group[0][1].fmt != mcc.FMT_R:
+                table[funct3] = group[0]
+                continue
+            funct7 = dict((d.funct7, (m, d)) for m, d in group)
+            if group[0][1].fmt != mcc.FMT_R and 0 in funct7:
+                funct7[None] = funct7[0]
+            table[funct3] = funct7
+        dispatch[opcode] = table
+    return dispatch
+
+
+DISPATCH = build_dispatch(mcc.INSTR_DESC)
+
+
+def sign_extend(value, bits):
+    return value - (1 << bits) if value >> (bits - 1) else value
+
+
+'''
+Fields of each format, in the operand order of the format
+(FORMAT_OPERANDS in machinecodeconst.py), the immediate being the value
+the assembler takes in the source.
+'''
+
+
+def fields_r(word):
+    return word >> 7 & 0x1F, word >> 15 & 0x1F, word >> 20 & 0x1F
+
+
+def fields_i(word):
+    return word >> 7 & 0x1F, word >> 15 & 0x1F, sign_extend(word >> 20, 12)
+
+
+def fields_s(word):
+    return (word >> 15 & 0x1F, word >> 20 & 0x1F,
+            sign_extend(word >> 25 << 5 | word >> 7 & 0x1F, 12))
+
+
+def fields_sb(word):
+    return (word >> 15 & 0x1F, word >> 20 & 0x1F,
+            sign_extend(word >> 31 << 12 | (word >> 7 & 0x1) << 11 |
+                        (word >> 25 & 0x3F) << 5 | (word >> 8 & 0xF) << 1,
+                        13))
+
+
+def fields_u(word):
+    return word >> 7 & 0x1F, sign_extend(word >> 12, 20)
+
+
+def fields_uj(word):
+    return (word >> 7 & 0x1F,
+            sign_extend(word >> 31 << 20 | (word >> 12 & 0xFF) << 12 |
+                        (word >> 20 & 0x1) << 11 | (word >> 21 & 0x3FF) << 1,
+                        21))
+
+
+FORMAT_FIELDS = {
+    mcc.FMT_R: fields_r,
+    mcc.FMT_I: fields_i,
+    mcc.FMT_S: fields_s,
+    mcc.FMT_SB: fields_sb,
+    mcc.FMT_U: fields_u,
+    mcc.FMT_UJ: fields_uj
+}
+
+# Formats whose immediate is an offset from the instruction, given
+# as a label when the target is in the program
+RELATIVE = frozenset([mcc.FMT_SB, mcc.FMT_UJ])
+# Major opcodes of these formats
+RELATIVE_OPCODES = frozenset(d.opcode for d in mcc.INSTR_DESC.values()
+                             if d.fmt in RELATIVE)
+
+
+def line_template(mnemonic, desc):
+    '''
+    returns: the line of the instruction with a %d in place of each
+    operand, the relative immediate left out.
+    '''
+    operands = ['%d' if name == 'imm' else '$%d' for name in desc.operands]
+    if desc.fmt in RELATIVE:
+        return '\t' + mnemonic + ' ' + ', '.join(operands[:-1]) + ', '
+    return '\t' + mnemonic + ' ' + ', '.join(operands)
+
+
+TEMPLATES = dict((mnemonic, line_template(mnemonic, desc))
+                 for mnemonic, desc in mcc.INSTR_DESC.items())
+
+
+def lookup(word):
+    '''
+    returns: (mnemonic, descriptor) of the instruction of word, None
+    if it is not an instruction of the registry.
+    '''
+    entry = DISPATCH[word & 0x7F]
+    if type(entry) is list:
+        entry = entry[word >> 12 & 0x7]
+        if type(entry) is dict:
+            funct7 = entry.get(word >> 25)
+            entry = entry.get(None) if funct7 is None else funct7
+    return entry
+
+
+def decode(word):
+    '''
+    Decodes the instruction word.
+
+    returns: (prefix, offset), the line of the instruction being prefix
+    followed by the target of offset, the relative immediate, or the
+    whole line (offset None) if it has no relative immediate. None if
+    word is not an instruction.
+    '''
+    entry = lookup(word)
+    if entry is None:
+        return None
+    mnemonic, desc = entry
+    values = FORMAT_FIELDS[desc.fmt](word)
+    if desc.fmt in RELATIVE:
+        return TEMPLATES[mnemonic] % values[:-1], values[-1]
+    return TEMPLATES[mnemonic] % values, None
+
+
+def invalid_line(word):
+    return '\t# 0x%08X' % word
+
+
+'''
+Labels
+------
+'''
+
+
+class Labels:
+    '''
+    The labels of a program, at the targets of its branches and at the
+    addresses of its symbols, as lists sorted by address.
+
+    addresses: the address of each label
+    names: the name the branches to the address refer to
+    declarations: the declaration lines of the labels at the address
+    '''
+
+    def __init__(self, targets, symbols=None):
+        '''
+        targets: the sorted list of the branch targets to be labelled
+        '''
+        # address -> [name, declarations] of the symbols
+        declared = {}
+        for name, address in sorted((symbols or {}).items(),
+                                    key=lambda s: s[1]):
+            if address in declared:
+                declared[address][1] += name + ':\n'
+            else:
+                declared[address] = [name, name + ':\n']
+        if declared:
+            targets = [a for a in targets if a not in declared]
+        names = ['L_%X' % a for a in targets]
+        declarations = [n + ':\n' for n in names]
+        if declared:
+            labels = sorted(list(zip(targets, names, declarations)) +
+                            [(a, n, d) for a, (n, d) in declared.items()])
+            targets = [label[0] for label in labels]
+            names = [label[1] for label in labels]
+            declarations = [label[2] for label in labels]
+        self.addresses = targets
+        self.names = names
+        self.declarations = declarations
+
+
+def branch_targets(words, size):
+    '''
+    returns: the sorted list of the 4 bytes aligned addresses, up to
+    size, the branches and jumps of words go to
+    '''
+    targets = set()
+    relative = RELATIVE_OPCODES
+    # word -> offset of its target, None if not an instruction
+    offsets = {}
+    for i, word in enumerate(words):
+        if word & 0x7F in relative:
+            if word not in offsets:
+                decoded = decode(word)
+                offsets[word] = None if decoded is None else decoded[1]
+            offset = offsets[word]
+            if offset is not None:
+                targets.add(i * 4 + offset)
+    return sorted(a for a in targets if 0 <= a <= size and not a & 3)
+
+
+'''
+Disassembling
+-------------
+'''
+
+
+class Invalid:
+    '''
+    Counter of the words that are not instructions.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.first = None
+
+    def add(self, address, count=1):
+        if self.first is None:
+            self.first = address
+        self.count += count
+
+    def report(self):
+        if self.count:
+            cp.cprint_warn("Warning: " + str(self.count) + " words are not" +
+                           " instructions, the first at address " +
+                           hex(self.first) + ". They are written as" +
+                           " comments.")
+
+
+def word_line(word):
+    '''
+    returns: the line of the instruction word, or (prefix, offset) if
+    its immediate is relative (see decode)
+    '''
+    decoded = decode(word)
+    if decoded is None:
+        return invalid_line(word)
+    if decoded[1] is None:
+        return decoded[0]
+    return decoded
+
+
+class LineTable:
+    '''
+    Lines of the instructions of words, given the Labels of the program.
+    Every distinct word is decoded once, into its word_line.
+    '''
+
+    def __init__(self, words, labels):
+        self.words = words
+        self.labels = labels
+        # word -> word_line
+        self.cache = {}
+        # target address -> label name
+        self.names = dict(zip(labels.addresses, labels.names))
+        # Index of the next label to declare
+        self.label = 0
+
+    def lines(self, start, stop, invalid):
+        '''
+        returns: the lines of the instructions words[start:stop], the
+        declarations of the labels at their addresses included, the
+        ranges being asked for in order.
+        '''
+        words = self.words
+        cache = self.cache
+        get = cache.get
+        names = self.names
+        lines = []
+        append = lines.append
+        for i in range(start, stop):
+            word = words[i]
+            line = get(word)
+            if line is None:
+                line = cache[word] = word_line(word)
+            if type(line) is tuple:
+                prefix, offset = line
+                name = names.get(i * 4 + offset)
+                line = prefix + (str(offset) if name is None else name)
+            elif line[1] == '#':
+                invalid.add(i * 4)
+            append(line)
+        addresses = self.labels.addresses
+        declarations = self.labels.declarations
+        k = self.label
+        while k < len(addresses) and addresses[k] < stop * 4:
+            i = (addresses[k] >> 2) - start
+            lines[i] = declarations[k] + lines[i]
+            k += 1
+        self.label = k
+        return lines
+
+    def text(self, start, stop, invalid):
+        '''
+        returns: the text of the lines of words[start:stop], as lines()
+        '''
+        return '\n'.join(self.lines(start, stop, invalid)) + '\n'
+
+    def end(self):
+        '''
+        returns: the declarations of the labels at the end of the
+        program
+        '''
+        return ''.join(self.labels.declarations[self.label:])
+
+
+def text_chunks(words, batch=False):
+    '''
+    Disassembles words, a MemoryImage, its symbols naming the labels at
+    their address. With batch, NumPy is used if it is installed.
+
+    Yields: the text in chunks of at most CHUNK_LINES lines
+    '''
+    size = len(words) * 4
+    symbols = getattr(words, 'symbols', None)
+    if batch:
+        from lib import batchencoder
+        batch = batchencoder.available()
+    if batch:
+        # Imported here, NumPy takes long to load
+        from lib import batchdisassembler
+        words = batchdisassembler.as_array(words)
+        labels = Labels(batchdisassembler.branch_targets(words, size),
+                        symbols)
+        table = batchdisassembler.LineTable(words, labels)
+    else:
+        labels = Labels(branch_targets(words, size), symbols)
+        table = LineTable(words, labels)
+    invalid = Invalid()
+    for first in range(0, len(words), CHUNK_LINES):
+        last = min(first + CHUNK_LINES, len(words))
+        yield table.text(first, last, invalid)
+    end = table.end()
+    if end:
+        yield end
+    invalid.report()
+
+
+'''
+Input
+-----
+'''
+
+
+def detect_format(head):
+    '''
+    returns: the format of the words starting with the bytes head
+    '''
+    if _MEMB.match(head):
+        return 'memb'
+    if _MEMH.match(head):
+        return 'memh'
+    return 'bin'
+
+
+def read_words(fin, fmt=None, batch=False):
+    '''
+    Reads the words of the binary file fin, in the format fmt, guessed
+    from the first line if None.
+
+    returns: the MemoryImage of the words
+
+    raises: ValueError if the input is not in the format
+    '''
+    words = MemoryImage()
+    head = fin.read(CHUNK_SIZE)
+    if fmt is None:
+        fmt = detect_format(head[:34])
+    if batch:
+        from lib import batchencoder
+        batch = batchencoder.available()
+    if fmt == 'bin':
+        rest = b''
+        chunk = head
+        while chunk:
+            data = rest + chunk
+            end = len(data) & ~3
+            words.frombytes(data[:end])
+            rest = data[end:]
+            chunk = fin.read(CHUNK_SIZE)
+        if rest:
+            raise ValueError("the size of the input is not a multiple" +
+                             " of 4 bytes")
+        if sys.byteorder != 'little':
+            words.byteswap()
+        return words
+
+    base = 2 if fmt == 'memb' else 16
+    digits = 32 if fmt == 'memb' else 8
+    if batch:
+        from lib.batchdisassembler import text_words
+    rest = b''
+    chunk = head
+    while chunk or rest:
+        data = rest + chunk
+        if chunk:
+            end = data.rfind(b'\n') + 1
+            data, rest = data[:end], data[end:]
+        else:
+            rest = b''
+        if batch:
+            values = text_words(data, base)
+            if values is not None:
+                words.frombytes(values)
+                chunk = fin.read(CHUNK_SIZE)
+                continue
+        for token in data.split():
+            try:
+                if len(token) != digits:
+                    raise ValueError()
+                words.append(int(token, base))
+            except ValueError:
+                raise ValueError("'" + token.decode('ascii', 'replace') +
+                                 "' is not a " + fmt + " word") from None
+        chunk = fin.read(CHUNK_SIZE)
+    return words
+
+
+def disassemble(infile, outfile='-', fmt=None, batch=False):
+    '''
+    Disassembles the file infile into outfile, - being the standard
+    input and output.
+
+    returns: the exit status
+    '''
+    try:
+        fin = sys.stdin.buffer if infile == '-' else open(infile, 'rb')
+    except IOError:
+        cp.cprint_fail("Error: File does not seem to exist or" +
+                       " you do not have the required permissions.")
+        return 1
+    try:
+        words = read_words(fin, fmt, batch)
+    except ValueError as e:
+        cp.cprint_fail("Error: Invalid input: " + str(e) + ".")
+        return 1
+    finally:
+        if fin is not sys.stdin.buffer:
+            fin.close()
+
+    if outfile == '-':
+        fout = sys.stdout
+    else:
+        try:
+            fout = open(outfile, 'w')
+        except IOError:
+            cp.cprint_fail("Error: Could not create '" + outfile +
+                           "' for output")
+            return 1
+    try:
+        for chunk in text_chunks(words, batch):
+            fout.write(chunk)
+    finally:
+        if fout is sys.stdout:
+            fout.flush()
+        else:
+            fout.close()
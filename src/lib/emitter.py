@@ -0,0 +1,332 @@
+#
+# @author:Don Dennis
+# emitter.py
+#
+# Output formats of the assembled program.
+#
+# The encoded instructions are collected into an Image while the
+# program is assembled. Once the program is complete, the image is
+# turned into the bytes of every requested output format, each file
+# being written with a single write. The formats are
+#
+#   memb    binary text, one instruction per line (Verilog $readmemb)
+#   memh    hex text, one instruction per line (Verilog $readmemh)
+#   bin     raw little endian binary
+#   ihex    Intel HEX
+#   c       C header with the program as an uint32_t array
+#   elf     ELF32 RISC-V executable with the symbol table
+#
+# memb and memh are the formats of the regular output file.
+
+import io
+import os
+import re
+import struct
+import sys
+from array import array
+from lib.memoryimage import MemoryImage
+
+'''
+The image of the assembled program, program address 0 being the
+first word. The words are kept in a MemoryImage (see memoryimage.py).
+If lines, the source line of every instruction is recorded as well,
+in lines, by the assembler.
+'''
+
+
+class Image:
+
+    def __init__(self, lines=False):
+        self.words = MemoryImage()
+        if lines:
+            self.words.lines = array('I')
+        self.lines = self.words.lines
+
+    def __len__(self):
+        return len(self.words)
+
+    def append(self, word):
+        self.words.append(word)
+
+    def extend(self, words):
+        self.words.extend(words)
+
+    def frombytes(self, data):
+        '''
+        Adds words given as bytes in machine byte order.
+        '''
+        self.words.frombytes(data)
+
+    def tobytes(self):
+        '''
+        returns: the image as a bytearray of little endian words
+        '''
+        words = self.words
+        if sys.byteorder != 'little':
+            words = array('I', words)
+            words.byteswap()
+        return bytearray(words.tobytes())
+
+
+class Stream:
+    '''
+    Sink writing every word to a text output as soon as it is added,
+    used when streaming. If image is given, the words are added to it
+    as well, for the outputs that can only be written once the program
+    is complete.
+    '''
+
+    def __init__(self, fout, fmt, image=None):
+        self.fout = fout
+        self.format = STREAM_FORMATS[fmt]
+        self.image = image
+        self.lines = None if image is None else image.lines
+
+    def append(self, word):
+        self.fout.write(self.format(word))
+        if self.image is not None:
+            self.image.append(word)
+
+    def extend(self, words):
+        for word in words:
+            self.append(word)
+
+
+class Buffer(io.BytesIO):
+    '''
+    An output kept in memory, name being the file name it stands for.
+    '''
+
+    def __init__(self, name):
+        io.BytesIO.__init__(self)
+        self.name = name
+
+
+# Formats that can be written one word at a time
+STREAM_FORMATS = {
+    'memb': lambda word: (format(word, '032b') + '\n').encode('ascii'),
+    'memh': lambda word: ('%08X\n' % word).encode('ascii'),
+    'bin': lambda word: struct.pack('<I', word)
+}
+
+
+def emit_memb(image, symbols, name):
+    return ''.join([format(word, '032b') + '\n'
+                    for word in image.words]).encode('ascii')
+
+
+def emit_memh(image, symbols, name):
+    return ''.join(['%08X\n' % word for word in image.words]).encode('ascii')
+
+
+def emit_bin(image, symbols, name):
+    return image.tobytes()
+
+
+def ihex_record(rtype, address, data):
+    record = bytearray(struct.pack('>BHB', len(data), address, rtype))
+    record += data
+    record.append(-sum(record) & 0xFF)
+    return ':' + record.hex().upper() + '\n'
+
+
+def emit_ihex(image, symbols, name):
+    '''
+    Intel HEX with 16 byte data records. An extended linear address
+    record precedes the data of every 64K segment past the first.
+    '''
+    data = image.tobytes()
+    records = []
+    for address in range(0, len(data), 16):
+        if address and address & 0xFFFF == 0:
+            records.append(ihex_record(0x04, 0,
+                                       struct.pack('>H', address >> 16)))
+        records.append(ihex_record(0x00, address & 0xFFFF,
+                                   data[address:address + 16]))
+    records.append(ihex_record(0x01, 0, b''))
+    return ''.join(records).encode('ascii')
+
+
+def c_identifier(name):
+    name = re.sub(r'[^a-zA-Z0-9_]', '_', name)
+    if not name or name[0].isdigit():
+        name = '_' + name
+    return name
+
+
+def emit_c(image, symbols, name):
+    '''
+    C header defining the program as a `const uint32_t` array named
+    after the output file, its length, and the address of every label.
+    '''
+    ident = c_identifier(name).lower()
+    macro = ident.upper()
+    lines = ['/* Generated by RVI */',
+             '#ifndef %s_H' % macro,
+             '#define %s_H' % macro,
+             '',
+             '#include <stdint.h>',
+             '',
+             '#define %s_LEN %d' % (macro, len(image))]
+    for label, address in symbols.items():
+        lines.append('#define %s_%s 0x%08X' %
+                     (macro, c_identifier(label).upper(), address))
+    lines.append('')
+    lines.append('static const uint32_t %s[%d] = {' %
+                 (ident, max(len(image), 1)))
+    words = image.words
+    for i in range(0, len(words), 6):
+        lines.append('    ' + ', '.join(['0x%08X' % word
+                                         for word in words[i:i + 6]]) + ',')
+    lines.append('};')
+    lines.append('')
+    lines.append('#endif')
+    lines.append('')
+    return '\n'.join(lines).encode('ascii')
+
+
+'''
+ELF32
+-----
+A minimal little endian RISC-V executable: the program is a single
+loadable segment at address 0, which is also the entry point. The
+sections are .text, .symtab (one local symbol per label), .strtab and
+.shstrtab.
+'''
+EM_RISCV = 243
+ELF_HEADER = struct.Struct('<16sHHIIIIIHHHHHH')
+PROGRAM_HEADER = struct.Struct('<IIIIIIII')
+SECTION_HEADER = struct.Struct('<IIIIIIIIII')
+SYMBOL = struct.Struct('<IIIBBH')
+
+
+def string_table(names):
+    '''
+    returns: (table, offsets), offsets holding the offset of each name
+    '''
+    table = bytearray(b'\0')
+    offsets = []
+    for name in names:
+        offsets.append(len(table))
+        table += name.encode('utf-8') + b'\0'
+    return table, offsets
+
+
+def align4(data):
+    data += b'\0' * (-len(data) & 3)
+
+
+def emit_elf(image, symbols, name):
+    text = image.tobytes()
+    labels = list(symbols.items())
+    strtab, name_offsets = string_table([label for label, _ in labels])
+    shstrtab, sh_names = string_table(['.text', '.symtab', '.strtab',
+                                       '.shstrtab'])
+
+    # Symbol 0 is the undefined symbol, then the section symbol of
+    # .text, then the labels (STB_LOCAL, STT_NOTYPE) defined in .text.
+    symtab = bytearray(SYMBOL.size)
+    symtab += SYMBOL.pack(0, 0, 0, 0x03, 0, 1)
+    for (label, address), offset in zip(labels, name_offsets):
+        symtab += SYMBOL.pack(offset, address, 0, 0x00, 0, 1)
+
+    out = bytearray(ELF_HEADER.size + PROGRAM_HEADER.size)
+    text_offset = len(out)
+    out += text
+    align4(out)
+    symtab_offset = len(out)
+    out += symtab
+    strtab_offset = len(out)
+    out += strtab
+    shstrtab_offset = len(out)
+    out += shstrtab
+    align4(out)
+    sh_offset = len(out)
+
+    sections = [
+        (0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+        # .text: SHT_PROGBITS, SHF_ALLOC | SHF_EXECINSTR
+        (sh_names[0], 1, 0x6, 0, text_offset, len(text), 0, 0, 4, 0),
+        # .symtab: SHT_SYMTAB, linked to .strtab, all symbols local
+        (sh_names[1], 2, 0, 0, symtab_offset, len(symtab), 3,
+         len(symtab) // SYMBOL.size, 4, SYMBOL.size),
+        # .strtab and .shstrtab: SHT_STRTAB
+        (sh_names[2], 3, 0, 0, strtab_offset, len(strtab), 0, 0, 1, 0),
+        (sh_names[3], 3, 0, 0, shstrtab_offset, len(shstrtab), 0, 0, 1, 0)
+    ]
+    for section in sections:
+        out += SECTION_HEADER.pack(*section)
+
+    ident = b'\x7fELF' + bytes([1, 1, 1])
+    # ET_EXEC, entry point 0, one program header, 4: .shstrtab
+    out[0:ELF_HEADER.size] = ELF_HEADER.pack(
+        ident, 2, EM_RISCV, 1, 0, ELF_HEADER.size, sh_offset, 0,
+        ELF_HEADER.size, PROGRAM_HEADER.size, 1, SECTION_HEADER.size,
+        len(sections), 4)
+    # PT_LOAD of .text at address 0, readable and executable
+    out[ELF_HEADER.size:text_offset] = PROGRAM_HEADER.pack(
+        1, text_offset, 0, 0, len(text), len(text), 0x5, 4)
+    return out
+
+
+# Output format -> (emitter, default file extension)
+FORMATS = {
+    'memb': (emit_memb, '.memb'),
+    'memh': (emit_memh, '.memh'),
+    'bin': (emit_bin, '.bin'),
+    'ihex': (emit_ihex, '.hex'),
+    'c': (emit_c, '.h'),
+    'elf': (emit_elf, '.elf')
+}
+
+
+def parse_emit(spec, outfile):
+    '''
+    Parses a FORMAT[:FILE] output specification. Without a file name,
+    the output is written next to outfile with the extension of the
+    format, or next to a.b if outfile is the standard output.
+
+    returns: (format, filename), or None if the format is unknown.
+    '''
+    fmt, _, filename = spec.partition(':')
+    if fmt not in FORMATS:
+        return None
+    if not filename:
+        if outfile == '-':
+            outfile = 'a.b'
+        filename = os.path.splitext(outfile)[0] + FORMATS[fmt][1]
+    return fmt, filename
+
+
+def outputs(outfile, hex, specs):
+    '''
+    returns: the list of (format, filename) of the outputs, outfile
+    in memh if hex or else memb, then the outputs of the --emit
+    specifications specs.
+
+    raises: ValueError holding the format if a format is unknown
+    '''
+    files = [('memh' if hex else 'memb', outfile)]
+    for spec in specs or ():
+        output = parse_emit(spec, outfile)
+        if output is None:
+            raise ValueError(spec.partition(':')[0])
+        files.append(output)
+    return files
+
+
+def unknown_format(fmt):
+    '''
+    returns: the error message of an unknown output format
+    '''
+    return ("Error: Unknown output format '" + fmt +
+            "'. Supported formats: " + ', '.join(sorted(FORMATS)) + ".")
+
+
+def emit(image, fmt, symbols, fout):
+    '''
+    Writes the image in the given format to the binary file fout.
+    symbols maps the label names to their addresses.
+    '''
+    name = os.path.splitext(os.path.basename(fout.name))[0]
+    fout.write(FORMATS[fmt][0](image, symbols, name))
@@ -0,0 +1,508 @@
+#
+# @author:Don Dennis
+# incremental.py
+#
+# Incremental reassembly.
+#
+# The source is split into blocks, a new block starting at every
+# label declaration and every BLOCK_LINES lines after it. After an
+# assembly, a state file keeps, for every block, the hash of its
+# source and its parsed instructions and labels (as Program columns),
+# together with the symbols table and the encoded words.
+#
+# When the source is assembled again, the blocks whose hash is found in
+# the state are not parsed: their records are taken from the state,
+# shifted to their new line numbers and addresses. Only the changed
+# blocks are parsed. The symbols table is then rebuilt from the labels
+# of all blocks, and the encoded words of the unchanged blocks are
+# reused, except for
+#
+#   - the instructions referring to a label whose offset has changed,
+#     which is the case of every label after an edit changing the
+#     instruction count, and
+#   - the instructions that printed messages when they were encoded,
+#
+# which are encoded again. The messages and outputs are the same as
+# those of a clean build.
+#
+# The state file is written next to the output file, with the
+# extension .rvs, unless another file is given.
+
+import hashlib
+import io
+import json
+import os
+import re
+from array import array
+from bisect import bisect_right
+from lib import emitter
+from lib import parser
+from lib import stats
+from lib.cprint import cprint as cp
+from lib.ir import Program, Label, symbol_id, symbol_name
+from lib.reader import SourcePiece
+from lib.machinecodegen import mcg
+from lib.machinecodeconst import MachineCodeConst
+
+mcc = MachineCodeConst()
+
+# Largest number of lines of a block without labels
+BLOCK_LINES = 256
+
+MAGIC = b'RVI-STATE 1\n'
+
+# A line that looks like a label declaration
+_LABEL_LINE = re.compile(rb'(?m)^[ \t\r]*[a-zA-Z_][a-zA-Z_0-9]*[ \t\r]*:')
+
+# Columns of the state, in file order
+PROGRAM_COLUMNS = ('opcode', 'rd', 'rs1', 'rs2', 'imm', 'label', 'lineno',
+                   'label_id', 'label_index', 'label_lineno')
+
+
+class Block:
+    '''
+    A block of source lines.
+
+    first: number of the line before the block, the block spanning
+        lines first + 1 to first + lines
+    start, end: byte offsets of the block in the source
+    instr, labels: index of its first instruction and label
+    count, label_count: number of instructions and labels
+    old: the same block in the state, or None if it has changed
+    '''
+
+    def __init__(self, digest, first, lines, start=None, end=None):
+        self.digest = digest
+        self.first = first
+        self.lines = lines
+        self.start = start
+        self.end = end
+        self.instr = 0
+        self.labels = 0
+        self.count = 0
+        self.label_count = 0
+        self.old = None
+
+
+def split_blocks(source):
+    '''
+    returns: the blocks of the mapped source
+    '''
+    data = source.data
+    index = source.index
+    nlines = len(index) - 1
+    # Lines starting a block, from 0
+    cuts = set(bisect_right(index, m.start()) - 1
+               for m in _LABEL_LINE.finditer(data))
+    cuts.add(0)
+    cuts = sorted(cuts)
+    cuts.append(nlines)
+    blocks = []
+    for first, last in zip(cuts, cuts[1:]):
+        for line in range(first, last, BLOCK_LINES):
+            end = min(line + BLOCK_LINES, last)
+            start_byte = index[line]
+            end_byte = index[end]
+            digest = hashlib.blake2b(data[start_byte:end_byte],
+                                     digest_size=16).hexdigest()
+            blocks.append(Block(digest, line, end - line, start_byte,
+                                end_byte))
+    return blocks
+
+
+'''
+State
+-----
+The state file holds MAGIC, a line of JSON and the arrays, in the order
+the JSON lists them:
+
+    key: the options and assembler code the state is valid for
+    blocks: [digest, first, lines, instr, labels, count, label_count]
+        of every block
+    names: label names, the label columns holding indices in names
+    symbols: the symbols table, by label name
+    arrays: [name, typecode, length] of the arrays: the Program
+        columns, the encoded words and the noisy flags (1 for the
+        instructions that printed a message when encoded).
+'''
+
+
+class State:
+
+    def __init__(self, key, blocks, program, names, symbols, words, noisy):
+        self.key = key
+        self.blocks = blocks
+        self.program = program
+        self.names = names
+        self.symbols = symbols
+        self.words = words
+        self.noisy = noisy
+
+
+def state_key(kwargs):
+    from lib.cache import code_hash
+    # The messages of the encoder only depend on the 32 bit warnings
+    return [code_hash(), bool(kwargs.get('no_32'))]
+
+
+def load_state(path, key):
+    '''
+    returns: the State saved in path, or None if there is none valid
+    for key.
+    '''
+    try:
+        with open(path, 'rb') as fin:
+            if fin.readline() != MAGIC:
+                return None
+            header = json.loads(fin.readline().decode('utf-8'))
+            if header['key'] != key:
+                return None
+            arrays = {}
+            for name, typecode, length in header['arrays']:
+                values = array(typecode)
+                values.fromfile(fin, length)
+                arrays[name] = values
+    except (OSError, ValueError, KeyError, EOFError):
+        return None
+
+    program = Program()
+    for name in PROGRAM_COLUMNS:
+        setattr(program, name, arrays[name])
+    # Label ids of this process
+    ids = [symbol_id(name) for name in header['names']]
+    if ids != list(range(len(ids))):
+        program.label = array('i', [ids[i] if i >= 0 else -1
+                                    for i in program.label])
+        program.label_id = array('i', [ids[i] for i in program.label_id])
+    blocks = []
+    for digest, first, lines, instr, labels, count, label_count in \
+            header['blocks']:
+        block = Block(digest, first, lines)
+        block.instr = instr
+        block.labels = labels
+        block.count = count
+        block.label_count = label_count
+        blocks.append(block)
+    symbols = dict((symbol_id(name), address)
+                   for name, address in header['symbols'].items())
+    return State(key, blocks, program, header['names'], symbols,
+                 arrays['words'], arrays['noisy'])
+
+
+def save_state(path, key, blocks, program, symbols_table, words, noisy):
+    # Label ids of the state
+    ids = {}
+    names = []
+
+    def local(sid):
+        if sid not in ids:
+            ids[sid] = len(names)
+            names.append(symbol_name(sid))
+        return ids[sid]
+
+    columns = dict((name, getattr(program, name))
+                   for name in PROGRAM_COLUMNS)
+    columns['label'] = array('i', [local(sid) if sid >= 0 else -1
+                                   for sid in program.label])
+    columns['label_id'] = array('i', [local(sid)
+                                      for sid in program.label_id])
+    columns['words'] = words
+    columns['noisy'] = noisy
+    header = {
+        'key': key,
+        'blocks': [[b.digest, b.first, b.lines, b.instr, b.labels,
+                    b.count, b.label_count] for b in blocks],
+        'names': names,
+        'symbols': dict((symbol_name(sid), address)
+                        for sid, address in symbols_table.items()),
+        'arrays': [[name, values.typecode, len(values)]
+                   for name, values in columns.items()]
+    }
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fout:
+        fout.write(MAGIC)
+        fout.write(json.dumps(header).encode('utf-8') + b'\n')
+        for values in columns.values():
+            values.tofile(fout)
+    os.replace(tmp, path)
+
+
+def state_path(kwargs):
+    path = kwargs.get('incremental')
+    if path:
+        return path
+    outfile = kwargs['outfile']
+    if outfile == '-':
+        outfile = 'a.b'
+    return os.path.splitext(outfile)[0] + '.rvs'
+
+
+'''
+Assembling
+----------
+'''
+
+
+class Fallback(Exception):
+    '''
+    Raised when a changed block cannot be parsed without messages, in
+    which case the program is assembled the regular way.
+    '''
+
+
+def parse_block(source, block, program):
+    '''
+    Parses a changed block into the program, with the instruction
+    warnings suppressed as in the first pass.
+
+    returns: whether the parser printed messages
+    '''
+    out = cp.out
+    cp.out = io.StringIO()
+    prev_warn = cp.warn
+    prev_warn32 = cp.warn32
+    cp.warn = False
+    cp.warn32 = False
+    try:
+        program.extend(parser.parse_lines(
+            SourcePiece(source, block.start, block.end, block.first)))
+    except SystemExit:
+        # A syntax error, reported as the first pass would
+        print(cp.out.getvalue(), end='', file=out)
+        raise
+    finally:
+        messages = cp.out.getvalue()
+        cp.out = out
+        cp.warn = prev_warn
+        cp.warn32 = prev_warn32
+    return bool(messages)
+
+
+def copy_block(state, block, program):
+    '''
+    Adds the records of an unchanged block, taken from the state, to
+    the program.
+    '''
+    old = block.old
+    old_program = state.program
+    shift = block.first - old.first
+    a = old.instr
+    b = a + old.count
+    for name in ('opcode', 'rd', 'rs1', 'rs2', 'imm', 'label'):
+        getattr(program, name).extend(getattr(old_program, name)[a:b])
+    if shift:
+        program.lineno.extend(line + shift
+                              for line in old_program.lineno[a:b])
+    else:
+        program.lineno.extend(old_program.lineno[a:b])
+    a = old.labels
+    b = a + old.label_count
+    program.label_id.extend(old_program.label_id[a:b])
+    program.label_index.extend(index - old.instr + block.instr
+                               for index in old_program.label_index[a:b])
+    program.label_lineno.extend(line + shift
+                                for line in old_program.label_lineno[a:b])
+
+
+def resolve_block(program, block, symbols_table):
+    '''
+    Adds the labels of a block to the symbols table.
+    '''
+    for i in range(block.labels, block.labels + block.label_count):
+        label = program.label_id[i]
+        if label in symbols_table:
+            parser.redeclared_label(Label(label, program.label_lineno[i]))
+        symbols_table[label] = 4 * program.label_index[i]
+
+
+def encode_instr(instr, address, symbols_table):
+    '''
+    Encodes an instruction as the second pass does, replaying the
+    immediate warnings of the parser first.
+
+    returns: (word, noisy), noisy being 1 if messages were printed
+    '''
+    printed = cp.warnings + cp.errors
+    desc = mcc.INSTR_DESC[instr.opcode]
+    if instr.label is None:
+        if instr.imm is not None:
+            parser.IMM_FORMATS[desc.fmt](instr.imm, instr.lineno)
+    else:
+        if instr.label not in symbols_table:
+            parser.undefined_label(instr)
+        instr = parser.encode_offset(instr, address,
+                                     symbols_table[instr.label])
+    word = mcg.encode(instr)
+    return word, int(cp.warnings + cp.errors != printed)
+
+
+def encode_block(state, block, program, symbols_table, image, noisy, args):
+    '''
+    Encodes the instructions of a block into the image, reusing the
+    words of the state for an unchanged block.
+    '''
+    old = block.old
+    echo = args['echo'] or args['tokenize']
+    first = block.instr
+    if old is None or echo:
+        for i in range(first, first + block.count):
+            instr = program.instr(i)
+            if old is not None and instr.label is None and \
+                    not state.noisy[old.instr + i - first]:
+                word = state.words[old.instr + i - first]
+                flag = 0
+            else:
+                word, flag = encode_instr(instr, 4 * i, symbols_table)
+            parser.write_instr(image, instr.lineno, instr.opcode, word,
+                               args)
+            noisy.append(flag)
+        return
+
+    old_label = state.program.label
+    old_noisy = state.noisy
+    words = state.words
+    shift = first - old.instr
+    pos = old.instr
+    end = old.instr + old.count
+    for o in range(old.instr, end):
+        label = old_label[o]
+        if label < 0 and not old_noisy[o]:
+            continue
+        # Copy the words before this one
+        image.extend(words[pos:o])
+        noisy.extend(old_noisy[pos:o])
+        pos = o + 1
+        i = o + shift
+        if not old_noisy[o] and label in symbols_table and \
+                label in state.symbols and \
+                symbols_table[label] - 4 * i == state.symbols[label] - 4 * o:
+            # Same offset to the label
+            image.append(words[o])
+            noisy.append(0)
+            continue
+        word, flag = encode_instr(program.instr(i), 4 * i, symbols_table)
+        image.append(word)
+        noisy.append(flag)
+    image.extend(words[pos:end])
+    noisy.extend(old_noisy[pos:end])
+
+
+def match_blocks(blocks, state):
+    '''
+    Sets the old block of each block found unchanged in the state.
+    '''
+    if state is None:
+        return
+    unchanged = {}
+    for old in state.blocks:
+        unchanged.setdefault(old.digest, []).append(old)
+    for block in blocks:
+        olds = unchanged.get(block.digest)
+        if olds:
+            block.old = olds.pop(0)
+
+
+def parse_blocks(fin, blocks, state, fallback=True):
+    '''
+    Pass 1: parses the changed blocks and resolves the labels.
+
+    returns: (program, symbols_table)
+
+    raises: Fallback if fallback and a changed block prints messages
+    when parsed. Otherwise the digest of such a block is dropped, so
+    that it is never found unchanged: its messages are only printed
+    when it is parsed.
+    '''
+    program = Program()
+    symbols_table = {}
+    for block in blocks:
+        block.instr = len(program)
+        block.labels = len(program.label_id)
+        if block.old is None:
+            with stats.phase('parse'):
+                if parse_block(fin, block, program):
+                    if fallback:
+                        raise Fallback
+                    block.digest = None
+        else:
+            copy_block(state, block, program)
+        block.count = len(program) - block.instr
+        block.label_count = len(program.label_id) - block.labels
+        resolve_block(program, block, symbols_table)
+    return program, symbols_table
+
+
+def encode_blocks(state, blocks, program, symbols_table, args):
+    '''
+    Pass 2: encodes the changed instructions.
+
+    returns: (image, noisy)
+    '''
+    image = emitter.Image()
+    noisy = array('B')
+    for block in blocks:
+        encode_block(state, block, program, symbols_table, image, noisy,
+                     args)
+    return image, noisy
+
+
+def rebuild_state(fin, blocks, state, kwargs):
+    '''
+    Builds the state of the source fin after it has been assembled the
+    regular way, its messages being discarded.
+
+    returns: (program, symbols_table, image, noisy)
+    '''
+    saved = (cp.out, cp.warnings, cp.errors, cp.issued)
+    cp.out = io.StringIO()
+    try:
+        program, symbols_table = parse_blocks(fin, blocks, state, False)
+        image, noisy = encode_blocks(
+            state, blocks, program, symbols_table,
+            dict(kwargs, echo=False, tokenize=False))
+    finally:
+        cp.out, cp.warnings, cp.errors, cp.issued = saved
+    return program, symbols_table, image, noisy
+
+
+def assemble(fin, fouts, kwargs):
+    '''
+    Assembles the mapped source fin into fouts, the opened outputs,
+    reusing what it can from the previous assembly, and saves the state
+    of this assembly.
+    '''
+    path = state_path(kwargs)
+    key = state_key(kwargs)
+    state = load_state(path, key)
+    with stats.phase('read'):
+        blocks = split_blocks(fin)
+    match_blocks(blocks, state)
+
+    try:
+        with stats.span('pass_one'), stats.phase('labels'):
+            program, symbols_table = parse_blocks(fin, blocks, state)
+    except Fallback:
+        # The messages of the parser are those of a clean build only
+        # when every line is parsed in both passes
+        parser.assemble(fin, fouts, False, kwargs)
+        program, symbols_table, image, noisy = rebuild_state(
+            fin, blocks, state, kwargs)
+    else:
+        if kwargs['echo_symbols']:
+            parser.echo_symbols(symbols_table)
+        with stats.span('pass_two'), stats.phase('encode'):
+            image, noisy = encode_blocks(state, blocks, program,
+                                         symbols_table, kwargs)
+        symbols = parser.symbol_names(symbols_table)
+        image.words.symbols = symbols
+        with stats.phase('write'):
+            for fmt, fout in fouts:
+                emitter.emit(image, fmt, symbols, fout)
+        if cp.stats is not None:
+            cp.stats.count(image, symbols_table, len(fin))
+    try:
+        save_state(path, key, blocks, program, symbols_table, image.words,
+                   noisy)
+    except OSError as e:
+        cp.cprint_warn("Warning: Could not save the incremental state, " +
+                       str(e))
@@ -0,0 +1,241 @@
+#
+# @author:Don Dennis
+# ir.py
+#
+# Intermediate representation of the parsed program.
+#
+# Each source line is parsed into one record: an Instr for an
+# instruction, a Label for a label declaration, or EMPTY for blank and
+# comment lines. Registers and immediates are held as ints and labels
+# as symbol ids, so that nothing has to be parsed again after the
+# parser.
+#
+# Whole programs are kept in a Program, which stores the records as
+# columns of machine typed arrays. The memory used per instruction is
+# small and constant, whatever the instruction.
+
+import contextlib
+import threading
+from array import array
+from collections import namedtuple
+from lib.machinecodeconst import MachineCodeConst
+
+mcc = MachineCodeConst()
+
+'''
+An instruction.
+
+opcode: the mnemonic
+rd, rs1, rs2: register indices, None if the instruction has no such
+    operand
+imm: the immediate as written, None if the instruction has none or
+    refers to a label instead
+label: symbol id of the label the instruction refers to, or None
+lineno: source line number
+'''
+Instr = namedtuple('Instr', ['opcode', 'rd', 'rs1', 'rs2', 'imm', 'label',
+                             'lineno'])
+
+'''
+A label declaration, label being its symbol id.
+'''
+Label = namedtuple('Label', ['label', 'lineno'])
+
+# Record of a line holding neither an instruction nor a label
+EMPTY = ()
+
+'''
+Symbols
+-------
+Label names are interned into symbol ids, the index of the name in the
+symbols table. Every use of a label in an assembly refers to the same
+id. Each thread has a table of its own, which is started afresh for
+every assembly by symbols_scope(), so that a long running process does
+not keep the names of all the programs it assembled. Symbol ids are
+thus only meaningful within the assembly that interned them.
+'''
+
+
+class Symbols(threading.local):
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+
+_symbols = Symbols()
+
+
+def symbol_id(name):
+    ids = _symbols.ids
+    sid = ids.get(name)
+    if sid is None:
+        sid = ids[name] = len(ids)
+        _symbols.names.append(name)
+    return sid
+
+
+def symbol_name(sid):
+    return _symbols.names[sid]
+
+
+def symbol_names(symbols_table):
+    '''
+    returns: the symbols table keyed by label name instead of id.
+    '''
+    names = _symbols.names
+    return dict((names[sid], address)
+                for sid, address in symbols_table.items())
+
+
+@contextlib.contextmanager
+def symbols_scope():
+    '''
+    Interns the labels of the calling thread into a new, empty symbols
+    table within the context, the previous one being restored after it.
+    '''
+    saved = (_symbols.names, _symbols.ids)
+    _symbols.names = []
+    _symbols.ids = {}
+    try:
+        yield
+    finally:
+        _symbols.names, _symbols.ids = saved
+
+
+# Opcode ids, the position of the opcode in ALL_INSTR
+OPCODE_IDS = dict((opcode, i) for i, opcode in enumerate(mcc.ALL_INSTR))
+
+# Immediates are stored as 64 bit integers
+IMM_MIN = -2 ** 63
+IMM_MAX = 2 ** 63 - 1
+
+
+def clamp_imm(imm):
+    '''
+    Fits an immediate into 64 bits. Immediates that far out are out of
+    range for every format anyway, so only their low bits, which are
+    the ones encoded, are kept.
+    '''
+    if IMM_MIN <= imm <= IMM_MAX:
+        return imm
+    return (imm & 0x1FFFFF) | 2 ** 62
+
+
+class Program:
+    '''
+    A parsed program as a struct of arrays.
+
+    The instructions are stored in program order, one entry per
+    instruction in each of the columns:
+
+    opcode: opcode id (OPCODE_IDS)
+    rd, rs1, rs2: register index, -1 if absent
+    imm: immediate, 0 if absent
+    label: symbol id of the referred label, -1 if none
+    lineno: source line number
+
+    Label declarations are stored in program order in the label_*
+    columns, label_index being the index of the instruction that
+    follows the label (that is the address of the label divided by 4).
+    '''
+
+    def __init__(self, records=()):
+        self.opcode = array('B')
+        self.rd = array('b')
+        self.rs1 = array('b')
+        self.rs2 = array('b')
+        self.imm = array('q')
+        self.label = array('i')
+        self.lineno = array('i')
+        self.label_id = array('i')
+        self.label_index = array('i')
+        self.label_lineno = array('i')
+        self.extend(records)
+
+    def __len__(self):
+        return len(self.opcode)
+
+    def append(self, record):
+        if isinstance(record, Instr):
+            self.opcode.append(OPCODE_IDS[record.opcode])
+            self.rd.append(-1 if record.rd is None else record.rd)
+            self.rs1.append(-1 if record.rs1 is None else record.rs1)
+            self.rs2.append(-1 if record.rs2 is None else record.rs2)
+            self.imm.append(0 if record.imm is None else
+                            clamp_imm(record.imm))
+            self.label.append(-1 if record.label is None else record.label)
+            self.lineno.append(record.lineno)
+        elif isinstance(record, Label):
+            self.label_id.append(record.label)
+            self.label_index.append(len(self.opcode))
+            self.label_lineno.append(record.lineno)
+
+    def extend(self, records):
+        # Same as append, with the column methods bound once
+        opcode = self.opcode.append
+        rd = self.rd.append
+        rs1 = self.rs1.append
+        rs2 = self.rs2.append
+        imm = self.imm.append
+        label = self.label.append
+        lineno = self.lineno.append
+        for record in records:
+            if type(record) is not Instr:
+                self.append(record)
+                continue
+            o, d, s1, s2, i, lab, line = record
+            opcode(OPCODE_IDS[o])
+            rd(-1 if d is None else d)
+            rs1(-1 if s1 is None else s1)
+            rs2(-1 if s2 is None else s2)
+            imm(0 if i is None else
+                i if IMM_MIN <= i <= IMM_MAX else clamp_imm(i))
+            label(-1 if lab is None else lab)
+            lineno(line)
+
+    def instr(self, i):
+        '''
+        returns: the i-th instruction as an Instr.
+        '''
+        return make_instr(self.opcode[i], self.rd[i], self.rs1[i],
+                          self.rs2[i], self.imm[i], self.label[i],
+                          self.lineno[i])
+
+    def __iter__(self):
+        '''
+        Yields the records in program order.
+        '''
+        labels = zip(self.label_id, self.label_index, self.label_lineno)
+        label = next(labels, None)
+        columns = zip(self.opcode, self.rd, self.rs1, self.rs2, self.imm,
+                      self.label, self.lineno)
+        for i, column in enumerate(columns):
+            while label is not None and label[1] == i:
+                yield Label(label[0], label[2])
+                label = next(labels, None)
+            yield make_instr(*column)
+        while label is not None:
+            yield Label(label[0], label[2])
+            label = next(labels, None)
+
+
+# Opcode of each opcode id and whether it takes an immediate
+OPCODES = tuple(mcc.ALL_INSTR)
+HAS_IMM = tuple('imm' in mcc.INSTR_DESC[opcode].operands
+                for opcode in mcc.ALL_INSTR)
+
+
+def make_instr(opcode, rd, rs1, rs2, imm, label, lineno):
+    '''
+    Builds an Instr from the values of its Program columns.
+    '''
+    if label < 0:
+        label = None
+        if not HAS_IMM[opcode]:
+            imm = None
+    else:
+        imm = None
+    return Instr(OPCODES[opcode], None if rd < 0 else rd,
+                 None if rs1 < 0 else rs1, None if rs2 < 0 else rs2,
+                 imm, label, lineno)
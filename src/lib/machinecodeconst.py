@@ -6,6 +6,63 @@
 # machine instructions
 
 
+from collections import namedtuple
+
+'''
+Descriptor of a single instruction.
+
+fmt: instruction format, one of the MachineCodeConst.FMT_* values
+opcode: opcode
+funct3, funct7: function fields, None if not used
+operands: names of the fields the source operands are assigned to,
+    in source order. Registers are 'rd', 'rs1', 'rs2' and the
+    immediate is 'imm'.
+shapes: operand kinds accepted in the source, one character per
+    operand: 'r' register, 'i' immediate and 'l' label.
+aligned: the immediate is an address offset, which a 32 bit core
+    expects to be 4 bytes aligned.
+base: the instruction word with every field that does not depend on
+    the operands (opcode, funct3 and funct7) already in place.
+'''
+InstrDesc = namedtuple('InstrDesc', ['fmt', 'opcode', 'funct3', 'funct7',
+                                     'operands', 'shapes', 'aligned', 'base'])
+
+# Source operand layout of each instruction format
+FORMAT_OPERANDS = {
+    'R': ('rd', 'rs1', 'rs2'),
+    'I': ('rd', 'rs1', 'imm'),
+    'S': ('rs1', 'rs2', 'imm'),
+    'SB': ('rs1', 'rs2', 'imm'),
+    'U': ('rd', 'imm'),
+    'UJ': ('rd', 'imm')
+}
+
+
+def instr_desc(fmt, opcode, funct3=None, funct7=None, aligned=False,
+               label=False):
+    '''
+    Builds the descriptor of an instruction. If label is set, a label
+    can be given in place of the immediate.
+    '''
+    operands = FORMAT_OPERANDS[fmt]
+    shape = ''.join('i' if op == 'imm' else 'r' for op in operands)
+    shapes = {shape}
+    if label:
+        shapes.add(shape[:-1] + 'l')
+    base = opcode
+    if funct3 is not None:
+        base |= funct3 << 12
+    if funct7 is not None and fmt == 'R':
+        base |= funct7 << 25
+    return InstrDesc(fmt, opcode, funct3, funct7, operands,
+                     frozenset(shapes), aligned, base)
+
+
+def instr_of_format(instr_desc, fmt):
+    return frozenset(instr for instr, desc in instr_desc.items()
+                     if desc.fmt == fmt)
+
+
 class MachineCodeConst:
     # Definition of opcodes used in assembly language instructions
     INSTR_LUI = 'lui'
@@ -46,129 +103,97 @@ class MachineCodeConst:
     INSTR_OR = 'or'
     INSTR_AND = 'and'
 
-    # All reserved opcodes
-    ALL_INSTR = [INSTR_LUI, INSTR_AUIPC, INSTR_JAL,
-                 INSTR_JALR, INSTR_BEQ, INSTR_BNE, INSTR_BLT,
-                 INSTR_BGE, INSTR_BLTU, INSTR_BGEU, INSTR_LB,
-                 INSTR_LH, INSTR_LW, INSTR_LBU, INSTR_LHU,
-                 INSTR_SB, INSTR_SH, INSTR_SW, INSTR_ADDI,
-                 INSTR_SLTI, INSTR_SLTIU, INSTR_XORI,
-                 INSTR_ORI, INSTR_ANDI, INSTR_SLLI,
-                 INSTR_SRLI, INSTR_SRAI, INSTR_ADD,
-                 INSTR_SUB, INSTR_SLL, INSTR_SLT,
-                 INSTR_SLTU, INSTR_XOR, INSTR_SRL,
-                 INSTR_SRA, INSTR_OR, INSTR_AND
-                 ]
-    # All instruction in a type
-    INSTR_TYPE_U = [INSTR_LUI, INSTR_AUIPC]
-    INSTR_TYPE_UJ = [INSTR_JAL]
-    INSTR_TYPE_S = [INSTR_SW, INSTR_SB, INSTR_SH]
-    INSTR_TYPE_SB = [INSTR_BEQ, INSTR_BNE, INSTR_BLT,
-                     INSTR_BLTU, INSTR_BGE, INSTR_BGEU]
-    INSTR_TYPE_I = [INSTR_ADDI, INSTR_SLTI, INSTR_SLTIU,
-                    INSTR_ORI, INSTR_XORI, INSTR_ANDI,
-                    INSTR_SLLI, INSTR_SRLI, INSTR_SRAI,
-                    INSTR_JALR, INSTR_LW, INSTR_LB,
-                    INSTR_LH, INSTR_LBU, INSTR_LHU]
-    INSTR_TYPE_R = [INSTR_ADD, INSTR_SUB, INSTR_SLL,
-                    INSTR_SLT, INSTR_SLTU, INSTR_XOR,
-                    INSTR_SRL, INSTR_SRA, INSTR_OR, INSTR_AND]
+    # Instruction formats
+    FMT_R = 'R'
+    FMT_I = 'I'
+    FMT_S = 'S'
+    FMT_SB = 'SB'
+    FMT_U = 'U'
+    FMT_UJ = 'UJ'
 
     # Binary Opcodes
-    BOP_LUI = '0110111'
-    BOP_AUIPC = '0010111'
-    BOP_JAL = '1101111'
-    BOP_JALR = '1100111'
-    BOP_BRANCH = '1100011'
-    BOP_LOAD = '0000011'
-    BOP_STORE = '0100011'
-    BOP_ARITHI = '0010011'
-    BOP_ARITH = '0110011'
+    BOP_LUI = 0b0110111
+    BOP_AUIPC = 0b0010111
+    BOP_JAL = 0b1101111
+    BOP_JALR = 0b1100111
+    BOP_BRANCH = 0b1100011
+    BOP_LOAD = 0b0000011
+    BOP_STORE = 0b0100011
+    BOP_ARITHI = 0b0010011
+    BOP_ARITH = 0b0110011
     # Not supported
     # [FENCE, FENCE.I]
-    BOP_MISCMEM = '0001111'
+    BOP_MISCMEM = 0b0001111
     # [ ECALL, EBREAK, CSRRW, CSRRS, cSRRC, CSRRWI, CSRRSI, CSRRCI]
-    BOP_SYSTEM = '1110011'
-
-    # The instruction in each distinct binary opcode
-    INSTR_BOP_LUI = [INSTR_LUI]
-    INSTR_BOP_AUIPC = [INSTR_AUIPC]
-    INSTR_BOP_JAL = [INSTR_JAL]
-    INSTR_BOP_JALR = [INSTR_JALR]
-    INSTR_BOP_BRANCH = [INSTR_BEQ, INSTR_BNE, INSTR_BLT,
-                        INSTR_BLTU, INSTR_BGE, INSTR_BGEU]
-    INSTR_BOP_LOAD = [INSTR_LW, INSTR_LB,
-                      INSTR_LH, INSTR_LBU, INSTR_LHU]
-    INSTR_BOP_STORE = [INSTR_SW, INSTR_SB, INSTR_SH]
-    INSTR_BOP_ARITHI = [INSTR_ADDI, INSTR_SLTI, INSTR_SLTIU,
-                        INSTR_ORI, INSTR_XORI, INSTR_ANDI,
-                        INSTR_SLLI, INSTR_SRLI, INSTR_SRAI]
-    INSTR_BOP_ARITH = [INSTR_ADD, INSTR_SUB, INSTR_SLL,
-                       INSTR_SLT, INSTR_SLTU, INSTR_XOR,
-                       INSTR_SRL, INSTR_SRA, INSTR_OR, INSTR_AND]
-
-    # FUNCT for each instruction type
-    FUNCT3_ARITHI = {
-        INSTR_ADDI: '000',
-        INSTR_SLTI: '010',
-        INSTR_SLTIU: '011',
-        INSTR_ORI: '110',
-        INSTR_XORI: '100',
-        INSTR_ANDI: '111',
-        INSTR_SLLI: '001',
-        INSTR_SRLI: '101',
-        INSTR_SRAI: '101'
-    }
-
-    FUNCT3_JALR = {
-        INSTR_JALR: '000'
-    }
+    BOP_SYSTEM = 0b1110011
 
-    FUNCT3_LOAD = {
-        INSTR_LB: '000',
-        INSTR_LH: '001',
-        INSTR_LW: '010',
-        INSTR_LBU: '100',
-        INSTR_LHU: '101'
-    }
-
-    FUNCT3_ARITH = {
-        INSTR_ADD: '000',
-        INSTR_SUB: '000',
-        INSTR_SLL: '001',
-        INSTR_SLT: '010',
-        INSTR_SLTU: '011',
-        INSTR_XOR: '100',
-        INSTR_SRL: '101',
-        INSTR_SRA: '101',
-        INSTR_OR: '110',
-        INSTR_AND: '111'
-    }
+    '''
+    Instruction registry
+    --------------------
+    Every supported instruction is described by exactly one entry
+    mapping its mnemonic to a descriptor (see instr_desc) holding its
+    format, binary opcode, funct3 and funct7 and its operand layout.
+    Dispatch and validation in the lexer, the parser and the machine
+    code generator are all a lookup in this table, and the per type
+    instruction lists below are generated from it. Adding an
+    instruction only requires adding its entry here.
 
-    FUNCT7_ARITH = {
-        INSTR_ADD: '0000000',
-        INSTR_SUB: '0100000',
-        INSTR_SLL: '0000000',
-        INSTR_SLT: '0000000',
-        INSTR_SLTU: '0000000',
-        INSTR_XOR: '0000000',
-        INSTR_SRL: '0000000',
-        INSTR_SRA: '0100000',
-        INSTR_OR: '0000000',
-        INSTR_AND: '0000000'
+    For the shift immediates SLLI, SRLI and SRAI funct7 is the value
+    the upper 7 bits of the immediate are expected to hold.
+    '''
+    INSTR_DESC = {
+        INSTR_LUI: instr_desc(FMT_U, BOP_LUI),
+        INSTR_AUIPC: instr_desc(FMT_U, BOP_AUIPC),
+        INSTR_JAL: instr_desc(FMT_UJ, BOP_JAL, label=True),
+        INSTR_JALR: instr_desc(FMT_I, BOP_JALR, 0b000,
+                               aligned=True, label=True),
+        INSTR_BEQ: instr_desc(FMT_SB, BOP_BRANCH, 0b000,
+                              aligned=True, label=True),
+        INSTR_BNE: instr_desc(FMT_SB, BOP_BRANCH, 0b001,
+                              aligned=True, label=True),
+        INSTR_BLT: instr_desc(FMT_SB, BOP_BRANCH, 0b100,
+                              aligned=True, label=True),
+        INSTR_BGE: instr_desc(FMT_SB, BOP_BRANCH, 0b101,
+                              aligned=True, label=True),
+        INSTR_BLTU: instr_desc(FMT_SB, BOP_BRANCH, 0b110,
+                               aligned=True, label=True),
+        INSTR_BGEU: instr_desc(FMT_SB, BOP_BRANCH, 0b111,
+                               aligned=True, label=True),
+        INSTR_LB: instr_desc(FMT_I, BOP_LOAD, 0b000, aligned=True),
+        INSTR_LH: instr_desc(FMT_I, BOP_LOAD, 0b001, aligned=True),
+        INSTR_LW: instr_desc(FMT_I, BOP_LOAD, 0b010, aligned=True),
+        INSTR_LBU: instr_desc(FMT_I, BOP_LOAD, 0b100, aligned=True),
+        INSTR_LHU: instr_desc(FMT_I, BOP_LOAD, 0b101, aligned=True),
+        INSTR_SB: instr_desc(FMT_S, BOP_STORE, 0b000, aligned=True),
+        INSTR_SH: instr_desc(FMT_S, BOP_STORE, 0b001, aligned=True),
+        INSTR_SW: instr_desc(FMT_S, BOP_STORE, 0b010, aligned=True),
+        INSTR_ADDI: instr_desc(FMT_I, BOP_ARITHI, 0b000),
+        INSTR_SLTI: instr_desc(FMT_I, BOP_ARITHI, 0b010),
+        INSTR_SLTIU: instr_desc(FMT_I, BOP_ARITHI, 0b011),
+        INSTR_XORI: instr_desc(FMT_I, BOP_ARITHI, 0b100),
+        INSTR_ORI: instr_desc(FMT_I, BOP_ARITHI, 0b110),
+        INSTR_ANDI: instr_desc(FMT_I, BOP_ARITHI, 0b111),
+        INSTR_SLLI: instr_desc(FMT_I, BOP_ARITHI, 0b001, 0b0000000),
+        INSTR_SRLI: instr_desc(FMT_I, BOP_ARITHI, 0b101, 0b0000000),
+        INSTR_SRAI: instr_desc(FMT_I, BOP_ARITHI, 0b101, 0b0100000),
+        INSTR_ADD: instr_desc(FMT_R, BOP_ARITH, 0b000, 0b0000000),
+        INSTR_SUB: instr_desc(FMT_R, BOP_ARITH, 0b000, 0b0100000),
+        INSTR_SLL: instr_desc(FMT_R, BOP_ARITH, 0b001, 0b0000000),
+        INSTR_SLT: instr_desc(FMT_R, BOP_ARITH, 0b010, 0b0000000),
+        INSTR_SLTU: instr_desc(FMT_R, BOP_ARITH, 0b011, 0b0000000),
+        INSTR_XOR: instr_desc(FMT_R, BOP_ARITH, 0b100, 0b0000000),
+        INSTR_SRL: instr_desc(FMT_R, BOP_ARITH, 0b101, 0b0000000),
+        INSTR_SRA: instr_desc(FMT_R, BOP_ARITH, 0b101, 0b0100000),
+        INSTR_OR: instr_desc(FMT_R, BOP_ARITH, 0b110, 0b0000000),
+        INSTR_AND: instr_desc(FMT_R, BOP_ARITH, 0b111, 0b0000000)
     }
 
-    FUNCT3_STORE = {
-        INSTR_SB: '000',
-        INSTR_SH: '001',
-        INSTR_SW: '010'
-    }
-
-    FUNCT3_BRANCH = {
-        INSTR_BEQ: '000',
-        INSTR_BNE: '001',
-        INSTR_BLT: '100',
-        INSTR_BGE: '101',
-        INSTR_BLTU: '110',
-        INSTR_BGEU: '111'
-    }
+    # All reserved opcodes
+    ALL_INSTR = list(INSTR_DESC)
+    # All instruction in a type
+    INSTR_TYPE_U = instr_of_format(INSTR_DESC, FMT_U)
+    INSTR_TYPE_UJ = instr_of_format(INSTR_DESC, FMT_UJ)
+    INSTR_TYPE_S = instr_of_format(INSTR_DESC, FMT_S)
+    INSTR_TYPE_SB = instr_of_format(INSTR_DESC, FMT_SB)
+    INSTR_TYPE_I = instr_of_format(INSTR_DESC, FMT_I)
+    INSTR_TYPE_R = instr_of_format(INSTR_DESC, FMT_R)
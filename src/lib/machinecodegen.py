@@ -5,440 +5,191 @@
 # Conver the tokenized assembly instruction to
 # corresponding machine code
 
-from lib.cprint import cprint as cp
+from lib.cprint import cprint as cp, Abort
 from lib.machinecodeconst import MachineCodeConst
+from lib.memo import Memo
 
 
 class MachineCodeGenerator:
     CONST = MachineCodeConst()
 
+    '''
+    Bit fields of each instruction format as (name, msb, lsb), from the
+    most significant field to the least significant one. Only used to
+    split an encoded instruction back into its fields for display.
+    '''
+    FORMAT_FIELDS = {
+        CONST.FMT_R: (('funct7', 31, 25), ('rs2', 24, 20), ('rs1', 19, 15),
+                      ('funct3', 14, 12), ('rd', 11, 7), ('opcode', 6, 0)),
+        CONST.FMT_I: (('imm', 31, 20), ('rs1', 19, 15), ('funct3', 14, 12),
+                      ('rd', 11, 7), ('opcode', 6, 0)),
+        CONST.FMT_S: (('imm_11_5', 31, 25), ('rs2', 24, 20), ('rs1', 19, 15),
+                      ('funct3', 14, 12), ('imm_4_0', 11, 7),
+                      ('opcode', 6, 0)),
+        CONST.FMT_SB: (('imm_12_10_5', 31, 25), ('rs2', 24, 20),
+                       ('rs1', 19, 15), ('funct3', 14, 12),
+                       ('imm_4_1_11', 11, 7), ('opcode', 6, 0)),
+        CONST.FMT_U: (('imm', 31, 12), ('rd', 11, 7), ('opcode', 6, 0)),
+        CONST.FMT_UJ: (('imm', 31, 12), ('rd', 11, 7), ('opcode', 6, 0))
+    }
+
     def __init__(self):
         '''
         Class that implements the machine code generation part
         for RV32I subset.
-        '''
-        pass
 
-    def get_bin_register(self, r):
-        '''
-        converts the register in format
-        r'[0-9][0-9]?' to its equivalent
-        binary
-        '''
-        r = r[1:]
-        try:
-            r = int(r)
-        except:
-            cp.cprint_fail("Internal Error: get_bin_register:" +
-                          " Register could not be parsed")
-        assert(r >= 0)
-        assert(r < 32)
-        rbin = format(r, '05b')
-        return rbin
+        Instructions are encoded as integers: the immediate is
+        truncated to the width of its format, the fields depending on
+        the operands are shifted into place and ORed into the base word
+        of the instruction descriptor. Conversion to text is left to
+        the output.
 
-    def op_lui(self, tokens):
-        '''
-        imm[31:12] rd opcode
+        Words encoded without messages are cached on the operands of
+        the instructions (see memo.py).
         '''
-        bin_opcode = None
-        bin_rd = None
-        rd = None
-        imm = None
-
-        try:
-            bin_opcode = self.CONST.BOP_LUI
-            rd = tokens['rd']
-            bin_rd = self.get_bin_register(rd)
-            imm = tokens['imm']
-        except:
-            cp.cprint_fail("Internal Error: LUI: could not parse" +
-                           "tokens in " + str(tokens['lineno']))
-            exit()
-
-        bin_str = imm + bin_rd + bin_opcode
-        assert(len(bin_str) == 32)
+        self.memo = Memo('encode')
 
-        tok_dict = {
-            'opcode': bin_opcode,
-            'rd': bin_rd,
-            'imm': imm
-        }
-        return bin_str, tok_dict
+    def warn_misaligned(self, lineno):
+        cp.cprint_warn_32("32_Warning:" + str(lineno) +
+                          ": Missaligned address." +
+                          " Address should be 4 bytes aligned.")
 
-    def op_auipc(self, tokens):
+    def op_r(self, desc, instr):
         '''
-        imm[31:12] rd opcode
+        funct7  rs2 rs1 funct3  rd  opcode
         '''
-        bin_opcode = None
-        bin_rd = None
-        rd = None
-        imm = None
-
-        try:
-            bin_opcode = self.CONST.BOP_AUIPC
-            rd = tokens['rd']
-            bin_rd = self.get_bin_register(rd)
-            imm = tokens['imm']
-        except:
-            cp.cprint_fail("Internal Error: AUIPC: could not parse" +
-                           "tokens in " + str(tokens['lineno']))
-            exit()
-
-        bin_str = imm + bin_rd + bin_opcode
-        assert(len(bin_str) == 32)
-
-        tok_dict = {
-            'opcode': bin_opcode,
-            'rd': bin_rd,
-            'imm': imm
-        }
-        return bin_str, tok_dict
+        return (desc.base | instr.rs2 << 20 | instr.rs1 << 15 |
+                instr.rd << 7)
 
-    def op_jal(self, tokens):
+    def op_i(self, desc, instr):
         '''
-        imm[20] imm[10:1] imm[11] imm[19:12] rd opcode
-        immediate is already shuffled in tokens
-        '''
-        bin_opcode = None
-        bin_rd = None
-        rd = None
-        imm = None
-
-        try:
-            bin_opcode = self.CONST.BOP_JAL
-            rd = tokens['rd']
-            bin_rd = self.get_bin_register(rd)
-            imm = tokens['imm']
-        except:
-            cp.cprint_fail("Internal Error: AUIPC: could not parse" +
-                           "tokens in " + str(tokens['lineno']))
-            exit()
-
-        bin_str = imm + bin_rd + bin_opcode
-        assert(len(bin_str) == 32)
-
-        tok_dict = {
-            'opcode': bin_opcode,
-            'rd': bin_rd,
-            'imm': imm
-        }
-        return bin_str, tok_dict
+        imm[11:0]   rs1 funct3   rd  opcode
 
-    def op_jalr(self, tokens):
-        opcode = tokens['opcode']
-        '''
-        imm[11:0] rs1 funct3 rd opcode
+        For SLLI, SRLI and SRAI the upper 7 bits of the immediate
+        should hold the funct7 of the instruction: 0000000 for SLLI and
+        SRLI and 0100000 for SRAI.
         '''
-        opcode = tokens['opcode']
-        bin_opcode = None
-        funct = None
-        rs1 = None
-        bin_rs1 = None
-        bin_rd = None
-        rd = None
-        imm = None
+        imm = instr.imm & 0xFFF
+        if desc.aligned and imm & 0b11:
+            self.warn_misaligned(instr.lineno)
 
-        try:
-            funct = self.CONST.FUNCT3_JALR[opcode]
-            bin_opcode = self.CONST.BOP_JALR
-            rs1 = tokens['rs1']
-            bin_rs1 = self.get_bin_register(rs1)
-            rd = tokens['rd']
-            bin_rd = self.get_bin_register(rd)
-            imm = tokens['imm']
-        except:
-            cp.cprint_fail("Internal Error: JALR: could not parse" +
-                           "tokens in " + str(tokens['lineno']))
-            exit()
-
-        bin_str = imm + bin_rs1 + funct + bin_rd + bin_opcode
-        assert(len(bin_str) == 32)
+        if desc.funct7 is not None and imm >> 5 != desc.funct7:
+            expected = '0' if desc.funct7 == 0 else format(desc.funct7, '07b')
+            cp.cprint_warn("Warning:" + str(instr.lineno) +
+                           ": Upper 7 bits of immediate should be " +
+                           expected)
 
-        if imm[-2:] != '00':
-            cp.cprint_warn_32("32_Warning:" + str(tokens['lineno']) +
-                              ": Missaligned address." +
-                              " Address should be 4 bytes aligned.")
+        return desc.base | imm << 20 | instr.rs1 << 15 | instr.rd << 7
 
-        tok_dict = {
-            'opcode': bin_opcode,
-            'funct': funct,
-            'rs1': bin_rs1,
-            'rd': bin_rd,
-            'imm': imm
-        }
-        return bin_str, tok_dict
-
-    def op_branch(self, tokens):
+    def op_s(self, desc, instr):
         '''
-        imm[12|10:5] rs2 rs1 funct3 imm[4:1|11] opcode
-        immediates returned in tokens as touple (imm_12_10_5, imm_4_1_11)
+        imm[11:5] rs2 rs1 funct3 imm[4:0] opcode
         '''
-        opcode = tokens['opcode']
-        imm_12_10_5 = None
-        imm_4_1_11 = None
-        funct3 = None
-        rs1 = None
-        rs2 = None
-        bin_rs1 = None
-        bin_rs2 = None
-        try:
-            funct3 = self.CONST.FUNCT3_BRANCH[opcode]
-            bin_opcode = self.CONST.BOP_BRANCH
-            rs1 = tokens['rs1']
-            bin_rs1 = self.get_bin_register(rs1)
-            rs2 = tokens['rs2']
-            bin_rs2 = self.get_bin_register(rs2)
-            imm_12_10_5, imm_4_1_11 = tokens['imm']
-        except:
-            cp.cprint_fail("Internal Error: BRANCH: could not parse" +
-                           " tokens in " + str(tokens['lineno']))
-            exit()
-
-        bin_str = imm_12_10_5 + bin_rs2 + bin_rs1 + funct3
-        bin_str += imm_4_1_11 + bin_opcode
-        if imm_4_1_11[-2] != '0':
-            cp.cprint_warn_32("32_Warning:" + str(tokens['lineno']) +
-                              ": Missaligned address." +
-                              " Address should be 4 bytes aligned.")
-        assert(len(bin_str) == 32)
-        tok_dict = {
-            'opcode': bin_opcode,
-            'funct': funct3,
-            'rs1': bin_rs1,
-            'rs2': bin_rs2,
-            'imm_12_10_5': imm_12_10_5,
-            'imm_4_1_11': imm_4_1_11
-        }
+        imm = instr.imm & 0xFFF
+        if desc.aligned and imm & 0b11:
+            self.warn_misaligned(instr.lineno)
 
-        return bin_str, tok_dict
+        return (desc.base | (imm >> 5) << 25 | instr.rs2 << 20 |
+                instr.rs1 << 15 | (imm & 0x1F) << 7)
 
-    def op_load(self, tokens):
-        opcode = tokens['opcode']
+    def op_sb(self, desc, instr):
         '''
-        imm[11:0] rs1 funct3 rd opcode
+        imm[12|10:5] rs2 rs1 funct3 imm[4:1|11] opcode
         '''
-        opcode = tokens['opcode']
-        bin_opcode = None
-        funct3 = None
-        rs1 = None
-        bin_rs1 = None
-        bin_rd = None
-        rd = None
-        imm = None
-
-        try:
-            funct3 = self.CONST.FUNCT3_LOAD[opcode]
-            bin_opcode = self.CONST.BOP_LOAD
-            rs1 = tokens['rs1']
-            bin_rs1 = self.get_bin_register(rs1)
-            rd = tokens['rd']
-            bin_rd = self.get_bin_register(rd)
-            imm = tokens['imm']
-        except:
-            cp.cprint_fail("Internal Error: LOAD: could not parse" +
-                           "tokens in " + str(tokens['lineno']))
-            exit()
-
-        bin_str = imm + bin_rs1 + funct3 + bin_rd + bin_opcode
-        assert(len(bin_str) == 32)
+        imm = instr.imm & 0x1FFF
+        if desc.aligned and imm & 0b10:
+            self.warn_misaligned(instr.lineno)
 
-        if imm[-2:] != '00':
-            cp.cprint_warn_32("32_Warning:" + str(tokens['lineno']) +
-                              ": Missaligned address." +
-                              " Address should be 4 bytes aligned.")
+        return (desc.base | (imm >> 12 & 0x1) << 31 |
+                (imm >> 5 & 0x3F) << 25 | instr.rs2 << 20 |
+                instr.rs1 << 15 | (imm >> 1 & 0xF) << 8 | (imm >> 11 & 0x1) << 7)
 
-        tok_dict = {
-            'opcode': bin_opcode,
-            'funct': funct3,
-            'rs1': bin_rs1,
-            'rd': bin_rd,
-            'imm': imm
-        }
-        return bin_str, tok_dict
-
-    def op_store(self, tokens):
+    def op_u(self, desc, instr):
         '''
-        imm[11:5] rs2 rs1 funct3 imm[4:0] opcode
-        immediates returned in tokens as touple (imm_11_5, imm_4_0)
+        imm[31:12] rd opcode
         '''
-        opcode = tokens['opcode']
-        imm_11_5 = None
-        imm_4_0 = None
-        funct3 = None
-        rs1 = None
-        bin_rs1 = None
-        bin_rs2 = None
-        rs2 = None
-        try:
-            funct3 = self.CONST.FUNCT3_STORE[opcode]
-            bin_opcode = self.CONST.BOP_STORE
-            rs1 = tokens['rs1']
-            bin_rs1 = self.get_bin_register(rs1)
-            rs2 = tokens['rs2']
-            bin_rs2 = self.get_bin_register(rs2)
-            imm_11_5, imm_4_0 = tokens['imm']
-        except:
-            cp.cprint_fail("Internal Error: STORE: could not parse" +
-                           " tokens in " + str(tokens['lineno']))
-            exit()
+        return desc.base | (instr.imm & 0xFFFFF) << 12 | instr.rd << 7
 
-        bin_str = imm_11_5 + bin_rs2 + bin_rs1 + funct3 + imm_4_0 + bin_opcode
-        assert(len(bin_str) == 32)
-
-        if imm_4_0[-2:] != '00':
-            cp.cprint_warn_32("32_Warning:" + str(tokens['lineno']) +
-                              ": Missaligned address." +
-                              " Address should be 4 bytes aligned.")
-
-        tok_dict = {
-            'opcode': bin_opcode,
-            'funct': funct3,
-            'rs1': bin_rs1,
-            'rs2': bin_rs2,
-            'imm_11_5': imm_11_5,
-            'imm_4_0': imm_4_0
-        }
-
-        return bin_str, tok_dict
-
-    def op_arithi(self, tokens):
+    def op_uj(self, desc, instr):
         '''
-        imm[11:0]   rs1 funct3   rd  opcode
-
-        The immediate for SLLI and SRLI needs to have the upper
-        7 bets set to 0 and for SRAI, it needs to be set to
-        0100000
+        imm[20] imm[10:1] imm[11] imm[19:12] rd opcode
         '''
-        opcode = tokens['opcode']
-        bin_opcode = None
-        funct3 = None
-        rs1 = None
-        bin_rs1 = None
-        bin_rd = None
-        rd = None
-        imm = None
-
+        imm = instr.imm & 0x1FFFFF
+        return (desc.base | (imm >> 20 & 0x1) << 31 |
+                (imm >> 1 & 0x3FF) << 21 | (imm >> 11 & 0x1) << 20 |
+                (imm >> 12 & 0xFF) << 12 | instr.rd << 7)
+
+    # Machine code generation of each instruction format
+    FORMAT_OPS = {
+        CONST.FMT_R: op_r,
+        CONST.FMT_I: op_i,
+        CONST.FMT_S: op_s,
+        CONST.FMT_SB: op_sb,
+        CONST.FMT_U: op_u,
+        CONST.FMT_UJ: op_uj
+    }
+
+    def encode(self, instr):
+        '''
+        The driver function for converting instructions to machine code.
+        Takes the Instr built by the parser and returns the instruction
+        as an integer, or None if the opcode is not implemented.
+        '''
+        cache = self.memo.entries
+        if cache is None:
+            return self.encode_instr(instr)
+        key = instr[:6]
+        word = cache.get(key)
+        if word is not None:
+            cache.move_to_end(key)
+            self.memo.hits += 1
+            return word
+        self.memo.misses += 1
+        issued = cp.issued
+        word = self.encode_instr(instr)
+        if word is not None and cp.issued == issued:
+            self.memo.store(key, word)
+        return word
+
+    def encode_instr(self, instr):
+        desc = self.CONST.INSTR_DESC.get(instr.opcode)
+        if desc is None:
+            cp.cprint_fail("Error:" + str(instr.lineno) +
+                           ": Opcode: '%s' not implemented" % instr.opcode)
+            return None
         try:
-            funct3 = self.CONST.FUNCT3_ARITHI[opcode]
-            bin_opcode = self.CONST.BOP_ARITHI
-            rs1 = tokens['rs1']
-            bin_rs1 = self.get_bin_register(rs1)
-            rd = tokens['rd']
-            bin_rd = self.get_bin_register(rd)
-            imm = tokens['imm']
-        except:
-            cp.cprint_fail("Internal Error: ARITHI: could not parse" +
-                           "tokens in " + str(tokens['lineno']))
-            exit()
-
-        bin_str = imm + bin_rs1 + funct3 + bin_rd + bin_opcode
-        assert(len(bin_str) == 32)
-
-        if opcode in (self.CONST.INSTR_SLLI,
-                      self.CONST.INSTR_SRLI):
-            if imm[0:7] != '0000000':
-                cp.cprint_warn("Warning:" + str(tokens['lineno']) +
-                               ": Upper 7 bits of immediate should be 0")
-
-        if opcode in (self.CONST.INSTR_SRAI):
-            if imm[0:7] != '0100000':
-                cp.cprint_warn("Warning:" + str(tokens['lineno']) +
-                               ": Upper 7 bits of immediate should be " +
-                               "01000000")
+            return self.FORMAT_OPS[desc.fmt](self, desc, instr)
+        except TypeError:
+            # An operand of the format is missing
+            cp.cprint_fail("Internal Error: " + desc.fmt +
+                           ": could not parse tokens in " +
+                           str(instr.lineno))
+            raise Abort()
 
-        tok_dict = {
-            'opcode': bin_opcode,
-            'funct3': funct3,
-            'rs1': bin_rs1,
-            'rd': bin_rd,
-            'imm': imm
-        }
-        return bin_str, tok_dict
-
-    def op_arith(self, tokens):
+    def get_fields(self, opcode, instr):
         '''
-        funct7  rs2 rs1 funct3  rd  opcode
+        Splits the encoded instruction into its fields in binary,
+        used to echo tokenized instructions for debugging.
         '''
-        opcode = tokens['opcode']
-        bin_opcode = None
-        funct3 = None
-        funct7 = None
-        rs1 = None
-        rs2 = None
-        rd = None
-        bin_rs1 = None
-        bin_rs2 = None
-        bin_rd = None
-
-        try:
-            funct3 = self.CONST.FUNCT3_ARITH[opcode]
-            funct7 = self.CONST.FUNCT7_ARITH[opcode]
-            bin_opcode = self.CONST.BOP_ARITH
-            rs1 = tokens['rs1']
-            rs2 = tokens['rs2']
-            rd = tokens['rd']
-            bin_rs1 = self.get_bin_register(rs1)
-            bin_rs2 = self.get_bin_register(rs2)
-            bin_rd = self.get_bin_register(rd)
-        except:
-            cp.cprint_fail("Internal Error: ARITH: could not parse" +
-                           "tokens in " + str(tokens['lineno']))
-            exit()
+        desc = self.CONST.INSTR_DESC[opcode]
+        tok_dict = {}
+        for name, msb, lsb in self.FORMAT_FIELDS[desc.fmt]:
+            width = msb - lsb + 1
+            tok_dict[name] = format(instr >> lsb & ((1 << width) - 1),
+                                    '0%db' % width)
+        return tok_dict
 
-        bin_str = funct7 + bin_rs2 + bin_rs1 + funct3 + bin_rd + bin_opcode
-        assert(len(bin_str) == 32)
-
-        tok_dict = {
-            'opcode': bin_opcode,
-            'funct3': funct3,
-            'funct7': funct7,
-            'rs1': bin_rs1,
-            'rd': bin_rd,
-            'rs2': bin_rs2
-        }
-        return bin_str, tok_dict
-
-    def convert_to_binary(self, tokens):
+    def convert_to_binary(self, instr):
         '''
-        The driver function for converting tokens to machine code.
-        Takes the tokens parsed by the lexer and returns the
-        binary equivalent.
-
         Returns a touple (instr, dict),
         where instr is the binary string of the instruction
         and the dict is the tokens converted individually
         '''
-        try:
-            opcode = tokens['opcode']
-        except KeyError:
-            print("Internal Error: Key not found (opcode)")
+        word = self.encode(instr)
+        if word is None:
             return None
-
-        if opcode in self.CONST.INSTR_BOP_LUI:
-            return self.op_lui(tokens)
-        elif opcode in self.CONST.INSTR_BOP_AUIPC:
-            return self.op_auipc(tokens)
-        elif opcode in self.CONST.INSTR_BOP_JAL:
-            return self.op_jal(tokens)
-        elif opcode in self.CONST.INSTR_BOP_JALR:
-            return self.op_jalr(tokens)
-        elif opcode in self.CONST.INSTR_BOP_BRANCH:
-            return self.op_branch(tokens)
-        elif opcode in self.CONST.INSTR_BOP_LOAD:
-            return self.op_load(tokens)
-        elif opcode in self.CONST.INSTR_BOP_STORE:
-            return self.op_store(tokens)
-        elif opcode in self.CONST.INSTR_BOP_ARITHI:
-            return self.op_arithi(tokens)
-        elif opcode in self.CONST.INSTR_BOP_ARITH:
-            return self.op_arith(tokens)
-        else:
-            cp.cprint_fail("Error:" + str(tokens['lineno']) +
-                           ": Opcode: '%s' not implemented" % opcode)
-            return None
-
-        print("Internal Error: Control should not reach here!")
-        return None
+        return (format(word, '032b'),
+                self.get_fields(instr.opcode, word))
 
 
 mcg = MachineCodeGenerator()
@@ -0,0 +1,113 @@
+#
+# @author:Don Dennis
+# memo.py
+#
+# Memoization of line parsing and instruction encoding.
+#
+# Programs repeat the same lines over and over (calls to the same
+# routine, stack pushes and pops, unrolled loops). The parsed record of
+# a line only depends on its text and the encoded word of an
+# instruction only on its operands, so both are kept in bounded least
+# recently used caches and looked up before parsing or encoding.
+#
+# A hit never hides a message. A line is parsed as usual on a miss,
+# and its record is cached along with whether its immediate printed
+# warnings, which are printed again on every hit. Instructions whose
+# encoding prints messages are not cached. Line numbers are not part
+# of the cached results, a parsed record being cached as the tuple of
+# its fields but the line number. Cached results are tuples and ints,
+# which cannot be modified, so they can be shared between lines.
+#
+# The caches are looked up in the innermost loops of the assembler,
+# which use the entries of a Memo directly rather than through method
+# calls.
+
+import json
+import threading
+from collections import OrderedDict
+from lib.cprint import cprint as cp
+
+# Number of entries of each cache. Both are disabled by default: the
+# parse cache only pays off on programs repeating many of their lines,
+# and slows down those that do not, and encoding an instruction costs
+# about as much as looking it up.
+SIZES = {
+    'parse': 0,
+    'encode': 0
+}
+
+# Name -> Memo
+MEMOS = {}
+
+
+class Memo(threading.local):
+    '''
+    Bounded least recently used cache. entries maps each key to its
+    value, from the least to the most recently used, and is None when
+    the cache is disabled. Each thread has caches of its own.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.resize(SIZES[name])
+        MEMOS[name] = self
+
+    def resize(self, size):
+        '''
+        Sets the capacity of the cache, 0 disabling it. The cache is
+        emptied.
+        '''
+        self.capacity = size
+        self.entries = OrderedDict() if size > 0 else None
+        self.hits = 0
+        self.misses = 0
+
+    def store(self, key, value):
+        '''
+        Caches value under key, dropping the least recently used entry
+        if the cache is full.
+        '''
+        entries = self.entries
+        entries[key] = value
+        if len(entries) > self.capacity:
+            entries.popitem(last=False)
+
+    def stats(self):
+        if self.entries is None:
+            return None
+        lookups = self.hits + self.misses
+        return {
+            'capacity': self.capacity,
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None
+        }
+
+
+def configure(parse_size=None, encode_size=None):
+    '''
+    Sets the capacity of the caches, None keeping the default and 0
+    disabling the cache.
+    '''
+    if parse_size is not None:
+        SIZES['parse'] = parse_size
+    if encode_size is not None:
+        SIZES['encode'] = encode_size
+    for name, memo in MEMOS.items():
+        memo.resize(SIZES[name])
+
+
+def stats():
+    '''
+    returns: the capacity, size, hits and misses of each cache, None
+    for a disabled cache.
+    '''
+    return dict((name, memo.stats()) for name, memo in MEMOS.items())
+
+
+def print_stats():
+    '''
+    Prints the statistics of the caches as JSON.
+    '''
+    print(json.dumps(stats(), indent=2, sort_keys=True), file=cp.out)
@@ -0,0 +1,137 @@
+#
+# @author:Don Dennis
+# memoryimage.py
+#
+# Memory image of an assembled program.
+#
+# The encoded words of a program are kept in a MemoryImage, which is an
+# array('I'), and so a single contiguous buffer: it can be given to
+# memoryview, NumPy (as a uint32 array sharing its memory) or the
+# memory of a simulator without copying it. The words are in the byte
+# order of the machine, as in any array('I'); Image.tobytes gives
+# them as little endian bytes.
+#
+# Indices are word indices, as for any array. The methods taking an
+# address (word, set_word, view, line) take the byte address of the
+# instruction, program address 0 being the first word.
+#
+# The image also holds the symbols table of the program and, when the
+# assembly records them, the source line of every instruction.
+#
+#   >>> image = Assembler().assemble(source).words
+#   >>> image.word(image.symbols['LOOP'])
+#   >>> image.line(0x40), image.address(12)
+#   >>> memory[0:image.size] = image.view().cast('B')
+#   >>> image.numpy()
+
+from array import array
+from bisect import bisect_left
+
+
+def word_index(address):
+    '''
+    returns: the index of the word at address
+
+    raises: ValueError if the address is negative or not 4 bytes
+    aligned
+    '''
+    if address < 0 or address & 3:
+        raise ValueError("Invalid address " + hex(address) +
+                         ", addresses should be 4 bytes aligned.")
+    return address >> 2
+
+
+def restore(data, symbols, lines):
+    '''
+    returns: the MemoryImage of the words data, in machine byte order
+    '''
+    image = MemoryImage()
+    image.frombytes(data)
+    image.symbols = symbols
+    image.lines = lines
+    return image
+
+
+class MemoryImage(array):
+    '''
+    The words of a program.
+
+    symbols: label name -> address
+    lines: array('I') of the source line of every instruction, in
+        program order, None if the lines were not recorded
+    '''
+
+    def __new__(cls, words=()):
+        return array.__new__(cls, 'I', words)
+
+    def __init__(self, words=()):
+        self.symbols = {}
+        self.lines = None
+
+    def __reduce_ex__(self, protocol):
+        return (restore, (self.tobytes(), self.symbols, self.lines))
+
+    @property
+    def size(self):
+        '''
+        Size of the image in bytes, the address following the last
+        instruction.
+        '''
+        return len(self) * self.itemsize
+
+    def word(self, address):
+        '''
+        returns: the word at address
+
+        raises: IndexError if there is no instruction at address
+        '''
+        return self[word_index(address)]
+
+    def set_word(self, address, word):
+        '''
+        Replaces the word at address.
+        '''
+        self[word_index(address)] = word
+
+    def view(self, start=0, stop=None):
+        '''
+        returns: a memoryview of the words from address start up to
+        address stop, the end of the image if None. The view shares
+        the memory of the image, which cannot grow while it is alive.
+        '''
+        stop = len(self) if stop is None else word_index(stop)
+        return memoryview(self)[word_index(start):stop]
+
+    def numpy(self):
+        '''
+        returns: the words as a NumPy uint32 array sharing the memory of
+        the image, which cannot grow while it is alive.
+
+        raises: ImportError if NumPy is not installed
+        '''
+        # Imported here, NumPy takes long to load
+        import numpy as np
+        return np.frombuffer(self, dtype=np.uint32)
+
+    def line(self, address):
+        '''
+        returns: the source line of the instruction at address, None if
+        the lines were not recorded.
+
+        raises: IndexError if there is no instruction at address
+        '''
+        if self.lines is None:
+            return None
+        return self.lines[word_index(address)]
+
+    def address(self, lineno):
+        '''
+        returns: the address of the instruction on the source line
+        lineno, None if there is none or the lines were not recorded.
+        '''
+        if self.lines is None:
+            return None
+        i = bisect_left(self.lines, lineno)
+        if i < len(self.lines) and self.lines[i] == lineno:
+            return i * self.itemsize
+        return None
@@ -0,0 +1,265 @@
+#
+# @author:Don Dennis
+# multifile.py
+#
+# Assembles many input files in one run.
+#
+# The input files are given on the command line, as glob patterns, or
+# listed in a manifest file. Each file is assembled by parse_input as
+# it would be on its own, in this process or, with -j N, in a pool of
+# N processes that load the parser once and then take files one after
+# the other. A file that fails does not stop the others: its error is
+# recorded and the next file is assembled.
+#
+# The outputs go next to the inputs or, with -d, under the output
+# directory at their path relative to the directory holding all the
+# inputs. Two inputs having the same output stop the run before any is
+# assembled. The outputs of a file that fails are removed.
+#
+# The messages of each file are printed together, in the order of the
+# input files. The run ends with a JSON summary holding the status,
+# messages, warning and error counts and time of every file.
+
+import glob
+import io
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from lib.cprint import cprint as cp
+from lib import emitter, parser
+
+# Files handed to a worker at once
+FILES_PER_TASK = 16
+
+# Color codes, removed from the messages of the summary
+_COLOR = re.compile('\033\\[[0-9;]*m')
+
+
+def read_manifest(path):
+    '''
+    returns: the file names listed in the manifest path, one per line,
+    blank lines and lines starting with # being ignored. - reads the
+    manifest from the standard input.
+    '''
+    if path == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, 'r') as fin:
+            lines = fin.read().splitlines()
+    return [line.strip() for line in lines
+            if line.strip() and not line.strip().startswith('#')]
+
+
+def expand(patterns):
+    '''
+    returns: the file names matching the patterns, in order. A
+    pattern matching nothing is kept as it is, to be reported when
+    it is assembled.
+    '''
+    infiles = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+            if matches:
+                infiles.extend(matches)
+                continue
+        infiles.append(pattern)
+    return infiles
+
+
+def output_name(infile, outdir, ext, root=None):
+    '''
+    returns: the output file of infile, next to it or, if outdir is
+    given, under outdir at its path relative to the directory root,
+    the current directory if None.
+    '''
+    base = os.path.splitext(infile)[0] + ext
+    if outdir is None:
+        return base
+    base = os.path.relpath(os.path.abspath(base), root or os.curdir)
+    return os.path.join(outdir, base)
+
+
+def output_names(infiles, outdir, ext):
+    '''
+    returns: the output files of infiles, see output_name, the outputs
+    under outdir being at their path relative to the directory holding
+    all the infiles
+
+    raises: ValueError naming the two input files if they have the same
+    output file
+    '''
+    root = None
+    if outdir is not None and infiles:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(infile))
+                                   for infile in infiles])
+    outfiles = [output_name(infile, outdir, ext, root) for infile in infiles]
+    # output file -> the first input file written to it
+    seen = {}
+    for infile, outfile in zip(infiles, outfiles):
+        key = os.path.normcase(os.path.abspath(outfile))
+        if key in seen:
+            raise ValueError("'" + seen[key] + "' and '" + infile +
+                             "' would both be written to '" + outfile + "'")
+        seen[key] = infile
+    return outfiles
+
+
+def written(outfile, args):
+    '''
+    returns: filename -> os.stat result, None if missing, of the outputs
+    the assembly of args writes to outfile and next to it
+    '''
+    try:
+        outputs = emitter.outputs(outfile, args['hex'], args.get('emit'))
+    except ValueError:
+        return {}
+    files = {}
+    for fmt, filename in outputs:
+        if filename != '-':
+            try:
+                files[filename] = os.stat(filename)
+            except OSError:
+                files[filename] = None
+    return files
+
+
+def remove_partial(before):
+    '''
+    Removes the outputs of a failed assembly, those of before, see
+    written(), created or rewritten since.
+    '''
+    for filename, stat in before.items():
+        try:
+            now = os.stat(filename)
+        except OSError:
+            continue
+        if stat is None or (now.st_mtime_ns, now.st_size, now.st_ino) != \
+                (stat.st_mtime_ns, stat.st_size, stat.st_ino):
+            os.unlink(filename)
+
+
+def assemble_file(infile, outfile, args):
+    '''
+    Assembles one file, its messages going to a buffer.
+
+    returns: the summary entry of the file
+    '''
+    cp.out = io.StringIO()
+    cp.warnings = 0
+    cp.errors = 0
+    # The error paths may leave the warnings turned off
+    warn = cp.warn
+    warn32 = cp.warn32
+    start = time.perf_counter()
+    before = written(outfile, args)
+    try:
+        if os.path.dirname(outfile):
+            os.makedirs(os.path.dirname(outfile), exist_ok=True)
+        status = parser.parse_input(infile, **dict(args, outfile=outfile))
+    except SystemExit as e:
+        # The error has been reported, exit(0) and exit() being
+        # successes
+        status = 1 if e.code and not isinstance(e.code, int) else e.code
+    except OSError as e:
+        cp.cprint_fail("Error: " + str(e))
+        status = 1
+    if status:
+        # Not to be taken for the program
+        remove_partial(before)
+    cp.warn = warn
+    cp.warn32 = warn32
+    return {
+        'file': infile,
+        'output': outfile,
+        'status': 'failed' if status else 'ok',
+        'warnings': cp.warnings,
+        'errors': cp.errors,
+        'seconds': round(time.perf_counter() - start, 6),
+        'messages': cp.out.getvalue()
+    }
+
+
+def init_worker():
+    parser.get_parser()
+
+
+def assemble_files(files, args):
+    '''
+    Assembles a list of (infile, outfile) in this process.
+    '''
+    return [assemble_file(infile, outfile, args)
+            for infile, outfile in files]
+
+
+def assemble_many(infiles, **kwargs):
+    '''
+    Assembles every file of infiles and writes the summary.
+
+    returns: 1 if a file failed, None otherwise.
+    '''
+    ext = '.x' if kwargs['hex'] else '.b'
+    try:
+        outfiles = output_names(infiles, kwargs.get('outdir'), ext)
+    except ValueError as e:
+        exit("Error: " + str(e))
+    files = list(zip(infiles, outfiles))
+    summary_file = kwargs.get('summary') or '-'
+    # Keep the standard output for the summary
+    out = sys.stderr if summary_file == '-' else cp.out
+    jobs = kwargs.get('jobs') or 1
+    # The files are assembled one by one, each in a single process
+    args = dict(kwargs, jobs=1)
+
+    start = time.perf_counter()
+    if jobs > 1 and len(files) > 1:
+        tasks = [files[i:i + FILES_PER_TASK]
+                 for i in range(0, len(files), FILES_PER_TASK)]
+        with ProcessPoolExecutor(jobs, initializer=init_worker) as pool:
+            done = pool.map(assemble_files, tasks, [args] * len(tasks))
+            entries = report(
+                (entry for entries in done for entry in entries), out)
+    else:
+        entries = report((assemble_file(infile, outfile, args)
+                          for infile, outfile in files), out)
+    cp.out = out
+
+    failed = sum(entry['status'] != 'ok' for entry in entries)
+    summary = {
+        'files': entries,
+        'total': {
+            'files': len(entries),
+            'failed': failed,
+            'warnings': sum(entry['warnings'] for entry in entries),
+            'errors': sum(entry['errors'] for entry in entries),
+            'seconds': round(time.perf_counter() - start, 6)
+        }
+    }
+    text = json.dumps(summary, indent=2) + '\n'
+    if summary_file == '-':
+        sys.stdout.write(text)
+        sys.stdout.flush()
+    else:
+        with open(summary_file, 'w') as fout:
+            fout.write(text)
+    if failed:
+        return 1
+
+
+def report(entries, out):
+    '''
+    Prints the messages of each file as it is assembled.
+
+    returns: the summary entries, the messages as a list of lines
+    without color codes.
+    '''
+    done = []
+    for entry in entries:
+        if entry['messages']:
+            print(entry['messages'], end='', file=out)
+        entry['messages'] = _COLOR.sub('', entry['messages']).splitlines()
+        done.append(entry)
+    return done
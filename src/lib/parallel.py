@@ -0,0 +1,210 @@
+#
+# @author:Don Dennis
+# parallel.py
+#
+# Assembles a single source file across several processes.
+#
+# The mapped source is split into line aligned pieces, which go
+# through the two passes in a process pool:
+#
+#   1. Every piece is parsed in parallel, giving its instruction count
+#      and the labels it declares, addressed from the start of the
+#      piece (the work of parse_pass_one).
+#   2. The counts are summed up in order into the address of each
+#      piece, which turns the labels of the pieces into the global
+#      symbols table.
+#   3. Every piece is encoded in parallel against that table (the work
+#      of parse_pass_two) and the encoded pieces are added to the image
+#      in order.
+#
+# Each worker writes its messages to a buffer that is returned with its
+# results, and the buffers are printed in program order, so the
+# output, the messages and the errors are the same as those of the
+# serial passes.
+
+import io
+from concurrent.futures import ProcessPoolExecutor
+from lib import emitter
+from lib.cprint import cprint as cp, Abort
+from lib.ir import Label, symbol_id, symbol_names, symbols_scope
+from lib.reader import MappedSource, SourcePiece
+from lib import parser
+
+# Pieces per worker, to even out the load
+PIECES_PER_JOB = 4
+# Smallest piece worth handing to a worker, in bytes
+MIN_PIECE_SIZE = 1 << 18
+
+'''
+Worker side
+-----------
+A worker maps the source file once and keeps it for all its pieces.
+'''
+source = None
+
+
+def init_worker(path, no_color, warn32):
+    global source
+    cp.no_color = no_color
+    cp.warn32 = warn32
+    source = MappedSource(path)
+    parser.get_parser()
+
+
+def capture():
+    '''
+    Sends the messages of the current piece to a buffer.
+    '''
+    cp.out = io.StringIO()
+    return cp.out
+
+
+def scan_piece(start, end, lineno):
+    '''
+    Pass one on a piece.
+
+    returns: (count, labels, messages, failed), count being the number
+    of instructions, labels a list of (name, address, lineno, mark) for
+    each label declared in the piece, mark being the length of the
+    messages at the point of the declaration. failed is True if the
+    piece has a syntax error, in which case only the labels before it
+    are listed.
+    '''
+    out = capture()
+    # Suppress instruction warnings, as in resolve_labels
+    prev_warn = cp.warn
+    prev_warn32 = cp.warn32
+    cp.warn = False
+    cp.warn32 = False
+    address = 0
+    labels = []
+    failed = False
+    try:
+        # The labels are returned by name, their ids being those of the
+        # symbols table of this piece
+        with symbols_scope():
+            for result in parser.parse_lines(
+                    SourcePiece(source, start, end, lineno)):
+                if isinstance(result, Label):
+                    labels.append((parser.symbol_name(result.label),
+                                   address, result.lineno, out.tell()))
+                else:
+                    address += 4
+    except SystemExit:
+        failed = True
+    cp.warn = prev_warn
+    cp.warn32 = prev_warn32
+    return address // 4, labels, out.getvalue(), failed
+
+
+def encode_piece(start, end, lineno, address, symbols, args):
+    '''
+    Pass two on a piece, address being the address of its first
+    instruction and symbols the symbols table by label name.
+
+    returns: (words, messages, failed), words being the encoded
+    instructions as bytes and failed True if the piece could not be
+    encoded completely.
+    '''
+    out = capture()
+    image = emitter.Image()
+    failed = False
+    try:
+        with symbols_scope():
+            symbols_table = dict((symbol_id(name), target)
+                                 for name, target in symbols.items())
+            parser.encode_statements(
+                parser.parse_lines(SourcePiece(source, start, end, lineno)),
+                image, symbols_table, args, address)
+    except SystemExit:
+        failed = True
+    return image.words.tobytes(), out.getvalue(), failed
+
+
+'''
+Main process side
+-----------------
+'''
+
+
+def split(fin, jobs):
+    '''
+    returns: the pieces (see MappedSource.split) fin is assembled in,
+    or None if fin is not worth or cannot be split.
+    '''
+    if jobs < 2 or not isinstance(fin, MappedSource):
+        return None
+    count = min(jobs * PIECES_PER_JOB, len(fin.data) // MIN_PIECE_SIZE)
+    if count < 2:
+        return None
+    return fin.split(count)
+
+
+def relay(messages):
+    if messages:
+        print(messages, end='', file=cp.out)
+
+
+def assemble(fin, pieces, image, args):
+    '''
+    Assembles the mapped source fin, split into pieces, into the image
+    with a pool of args['jobs'] processes.
+
+    returns: the symbols table
+    '''
+    pool = ProcessPoolExecutor(args['jobs'], initializer=init_worker,
+                               initargs=(fin.path, cp.no_color, cp.warn32))
+    try:
+        symbols_table, addresses = resolve_pieces(pool, pieces, args)
+        encode_pieces(pool, pieces, addresses, image, symbols_table, args)
+    except SystemExit:
+        # Do not wait for the pieces after the error
+        pool.shutdown(cancel_futures=True)
+        raise
+    pool.shutdown()
+    return symbols_table
+
+
+def resolve_pieces(pool, pieces, args):
+    '''
+    Pass 1: Address resolution of labels
+
+    returns: (symbols_table, addresses), addresses holding the address
+    of the first instruction of each piece.
+    '''
+    scans = [pool.submit(scan_piece, *piece) for piece in pieces]
+    symbols_table = {}
+    addresses = []
+    address = 0
+    for scan in scans:
+        count, labels, messages, failed = scan.result()
+        addresses.append(address)
+        for name, offset, lineno, mark in labels:
+            label = symbol_id(name)
+            if label in symbols_table:
+                relay(messages[:mark])
+                parser.redeclared_label(Label(label, lineno))
+            symbols_table[label] = address + offset
+        relay(messages)
+        if failed:
+            raise Abort(1)
+        address += 4 * count
+    if args['echo_symbols']:
+        parser.echo_symbols(symbols_table)
+    return symbols_table, addresses
+
+
+def encode_pieces(pool, pieces, addresses, image, symbols_table, args):
+    '''
+    Pass 2: Mapping instructions to binary coding
+    '''
+    symbols = symbol_names(symbols_table)
+    encodes = [pool.submit(encode_piece, start, end, lineno, address,
+                           symbols, args)
+               for (start, end, lineno), address in zip(pieces, addresses)]
+    for encode in encodes:
+        words, messages, failed = encode.result()
+        image.frombytes(words)
+        relay(messages)
+        if failed:
+            raise Abort(1)
@@ -4,15 +4,28 @@
 #
 # Parser for a simple assembler for subset of RV32I
 
+import contextlib
+import copy
+import io
 import ply.yacc as yacc
 import sys
+import threading
+from collections import deque
 # This is required by design
+import re
 from lib.tokenizer import tokens
+from lib.tokenizer import OPCODES
+from lib.tokenizer import get_lexer
 from lib.tokenizer import reset_lineno
 from lib.machinecodegen import mcg
-from lib.cprint import cprint as cp
+from lib import emitter
+from lib import memo
+from lib import stats
+from lib.reader import open_source, is_pipe, MappedSource, StreamSource
+from lib.cprint import cprint as cp, Abort, Ordered
 from lib.machinecodeconst import MachineCodeConst
-from pprint import pprint
+from lib.ir import Instr, Label, EMPTY, symbol_id, symbol_name, symbol_names
+from lib.ir import Program, symbols_scope
 
 mcc = MachineCodeConst()
 '''
@@ -31,171 +44,71 @@ need to recursively define the program interms of statements
 
 def p_program_statement(p):
     'program : statement'
-    p[0] = {
-        'type': 'non_label',
-        'tokens': p[1]
-    }
+    p[0] = p[1]
 
 
 def p_program_label(p):
     'program : LABEL COLUMN NEWLINE'
-    dict = {
-        'label': p[1],
-        'lineno': p.lineno(1)
-    }
-    p[0] = {
-        'type': 'label',
-        'tokens': dict
-    }
+    p[0] = Label(symbol_id(p[1]), p.lineno(1))
 
 
-def p_statement_R(p):
-    'statement : OPCODE register COMMA register COMMA register NEWLINE'
-    if p[1] not in mcc.INSTR_TYPE_R:
+'''
+The statement rules only differ in the kinds of operands they accept.
+Which instructions take which operands is looked up in the instruction
+registry (MachineCodeConst.INSTR_DESC) by build_statement, the shape
+being one character per operand: 'r' register, 'i' immediate and
+'l' label.
+'''
+
+
+def make_statement(p, shape, operands):
+    instr = build_statement(p[1], shape, operands, p.lineno(1))
+    if instr is None:
         cp.cprint_fail("Error:" + str(p.lineno(1)) +
                        ": Incorrect opcode or arguments")
         raise SyntaxError
-    p[0] = {
-        'opcode': p[1],
-        'rd': p[2],
-        'rs1': p[4],
-        'rs2': p[6],
-        'lineno': p.lineno(1)
-    }
+    return instr
+
+
+def p_statement_R(p):
+    'statement : OPCODE register COMMA register COMMA register NEWLINE'
+    p[0] = make_statement(p, 'rrr', (p[2], p[4], p[6]))
 
 
 def p_statement_I_S_SB(p):
     'statement : OPCODE register COMMA register COMMA IMMEDIATE NEWLINE'
-    if (p[1] not in mcc.INSTR_TYPE_I) and (p[1] not in mcc.INSTR_TYPE_S)and (p[1] not in mcc.INSTR_TYPE_SB):
-        cp.cprint_fail("Error:" + str(p.lineno(1)) +
-                       ": Incorrect opcode or arguments")
-        raise SyntaxError
-    elif p[1] in mcc.INSTR_TYPE_I:
-        ret, imm, msg = get_imm_I(p[6], p.lineno(6))
-        if not ret:
-            cp.cprint_fail("Error:" + str(p.lineno(6)) + ":" + msg)
-            raise SyntaxError
-
-        p[0] = {
-            'opcode': p[1],
-            'rd': p[2],
-            'rs1': p[4],
-            'imm': imm,
-            'lineno': p.lineno(1)
-        }
-    elif p[1] in mcc.INSTR_TYPE_S:
-        ret, imm, msg = get_imm_S(p[6], p.lineno(6))
-        if not ret:
-            cp.cprint_fail("Error:" + str(p.lineno(1)) + ":" + msg)
-            raise SyntaxError
-        p[0] = {
-            'opcode': p[1],
-            'rs1': p[2],
-            'rs2': p[4],
-            'imm': imm,
-            'lineno': p.lineno(1)
-        }
-    else:  # SB (BRANCH)
-        ret, imm, msg = get_imm_SB(p[6], p.lineno(6))
-        if not ret:
-            cp.cprint_fail("Error:" + str(p.lineno(1)) + ":" + msg)
-            raise SyntaxError
-        p[0] = {
-            'opcode': p[1],
-            'rs1': p[2],
-            'rs2': p[4],
-            'imm': imm,
-            'lineno': p.lineno(1)
-        }
+    p[0] = make_statement(p, 'rri', (p[2], p[4], p[6]))
 
 
 def p_statement_U_UJ(p):
     'statement : OPCODE register COMMA IMMEDIATE NEWLINE'
-
-    if (p[1] not in mcc.INSTR_TYPE_U) and (p[1] not in mcc.INSTR_TYPE_UJ):
-        cp.cprint_fail("Error:" + str(p.lineno(1)) +
-                       ": Incorrect opcode or arguments")
-        raise SyntaxError
-    elif p[1] in mcc.INSTR_TYPE_U:
-        ret, imm, msg = get_imm_U(p[4], p.lineno(4))
-        if not ret:
-            cp.cprint_fail("Error:" + str(p.lineno(1)) + ":" + msg)
-            raise SyntaxError
-        p[0] = {
-            'opcode': p[1],
-            'rd': p[2],
-            'imm': imm,
-            'lineno': p.lineno(1)
-        }
-    else:  # UJ Type
-        ret, imm, msg = get_imm_UJ(p[4], p.lineno(4))
-        if not ret:
-            cp.cprint_fail("Error:" + str(p.lineno(1)) + ":" + msg)
-            raise SyntaxError
-        p[0] = {
-            'opcode': p[1],
-            'rd': p[2],
-            'imm': imm,
-            'lineno': p.lineno(1)
-        }
+    p[0] = make_statement(p, 'ri', (p[2], p[4]))
 
 
 def p_statement_UJ_LABEL(p):
     'statement : OPCODE register COMMA LABEL NEWLINE'
-
-    if (p[1] not in mcc.INSTR_TYPE_UJ):
-        cp.cprint_fail("Error:" + str(p.lineno(1)) +
-                       ": Incorrect opcode or arguments")
-        raise SyntaxError
-    else:  # UJ Type
-        p[0] = {
-            'opcode': p[1],
-            'rd': p[2],
-            'label': p[4],
-            'lineno': p.lineno(1)
-        }
+    p[0] = make_statement(p, 'rl', (p[2], p[4]))
 
 
 def p_statement_SB__JALR_LABEL(p):
     'statement : OPCODE register COMMA register COMMA LABEL NEWLINE'
     # Branch and JALR
-    if (p[1] not in mcc.INSTR_TYPE_SB) and (p[1] != mcc.INSTR_JALR):
-        cp.cprint_fail("Error:" + str(p.lineno(1)) +
-                       ": Incorrect opcode or arguments")
-        raise SyntaxError
-    if p[1] in mcc.INSTR_TYPE_SB:
-        p[0] = {
-            'opcode': p[1],
-            'rs1': p[2],
-            'rs2': p[4],
-            'label': p[6],
-            'lineno': p.lineno(1)
-        }
-    elif p[1] == mcc.INSTR_JALR:
-        p[0] = {
-            'opcode': p[1],
-            'rd': p[2],
-            'rs1': p[4],
-            'label': p[6],
-            'lineno': p.lineno(1)
-        }
+    p[0] = make_statement(p, 'rrl', (p[2], p[4], p[6]))
 
 
 def p_register(p):
     'register : REGISTER'
-    r = p[1]
-    r = r[1:]
-    r = int(r)
+    r = int(p[1][1:])
     if (r < 0) or (r > 31):
         cp.cprint_fail("Error:" + str(p.lineno(1)) +
                        ":Invalid register index.")
         raise SyntaxError
-    p[0] = p[1]
+    p[0] = r
 
 
 def p_statement_none(p):
     'statement : NEWLINE'
-    p[0] = None
+    p[0] = EMPTY
 
 
 def get_imm_I(imm10, lineno):
@@ -226,6 +139,9 @@ def get_imm_I(imm10, lineno):
 
     Since I am generating a assembler for a 32 bit architecture, a warning
     is generated for misaligned loads in the binary generation phase.
+
+    The immediate is returned as written; the machine code generator
+    truncates it to its two's complement encoding.
     '''
     IMM_MAX = 0b011111111111
     IMM_MIN = -0b100000000000
@@ -233,13 +149,7 @@ def get_imm_I(imm10, lineno):
     if (imm10 > IMM_MAX) or (imm10 < IMM_MIN):
         cp.cprint_warn("Warning:" + str(lineno) + ":" +
                        "Immediate is too big, will overflow.")
-    # Conver to 2's complement binary
-    imm2 = format(imm10 if imm10 >= 0 else (1 << 12) + imm10, '012b')
-    imm2 = imm2[-12:]
-    # Convert immediate back to base 10 from base 2
-    # p[0] = int(imm2, 2)
-    assert(len(imm2) == 12)
-    return True, imm2, p_statement_none
+    return True, imm10, None
 
 
 def get_imm_U(imm10, lineno):
@@ -258,15 +168,9 @@ def get_imm_U(imm10, lineno):
     IMM_MIN = -0b10000000000000000000
 
     if (imm10 > IMM_MAX) or (imm10 < IMM_MIN):
-        cp.cprint_warn("Warning:" + str(p.lineno(1)) + ":" +
+        cp.cprint_warn("Warning:" + str(lineno) + ":" +
                        "Immediate is too big, will overflow.")
-    # Conver to 2's complement binary
-    imm2 = format(imm10 if imm10 >= 0 else (1 << 20) + imm10, '020b')
-    imm2 = imm2[-20:]
-    # Convert immediate back to base 10 from base 2
-    # p[0] = int(imm2, 2)
-    assert(len(imm2) == 20)
-    return True, imm2, None
+    return True, imm10, None
 
 
 def get_imm_UJ(imm10, lineno):
@@ -280,14 +184,14 @@ def get_imm_UJ(imm10, lineno):
     Hence its last bit has to be zero. We do not encode this
     last bit in the instruction and the CPU assumes the last
     bit to be zero.
-    The immediate is reshuffled and looks like the following.
+    The immediate is reshuffled by the machine code generator
+    and looks like the following.
 
     imm[20] imm[10:1] imm[11] imm[19:12]
     Note that imm[0] is not encoded.
 
     From the parsers point of view, we accept an (21 bit) immediate
     check if its a multiple of 2 (report and error)
-    and then shuffle it as required
     '''
     # Effectively we are addressing 21 bits
     IMM_MAX = 0b011111111111111111110
@@ -296,21 +200,11 @@ def get_imm_UJ(imm10, lineno):
     if (imm10 > IMM_MAX) or (imm10 < IMM_MIN):
         cp.cprint_warn("Warning:" + str(lineno) + ":" +
                        "Immediate is too big, will overflow.")
-    # Conver to 2's complement binary
-    imm2 = format(imm10 if imm10 >= 0 else (1 << 21) + imm10, '021b')
-    if imm2[-1:] != '0':
+    if imm10 & 1:
         cp.cprint_warn("Warning:" + str(lineno) + ":" +
                        "Immediate not 2 bytes aligned. Last bit will" +
                        "be dropped.")
-    imm2 = imm2[0:-1]
-    assert(len(imm2) == 20)
-    # Shuffling the immediate
-    # imm[20] imm[10:1] imm[11] imm[19:12]
-    # Indexing in reverse order
-    # imm[20] in is imm2[0] = imm2[-20] of imm string
-    shf_imm = imm2[0] + imm2[10:20] + imm2[9] + imm2[1:9]
-    assert(len(shf_imm) == 20)
-    return True, shf_imm, None
+    return True, imm10, None
 
 
 def get_imm_S(imm10, lineno):
@@ -331,8 +225,8 @@ def get_imm_S(imm10, lineno):
 
     Also, in S type, the immediate is split into two parts - one part
     holding bits [11:5] in the immediate ordering(MSB-LSB from left to right)
-    and the other part holding bits [4:0].
-    We split the immediate into two portions hence.
+    and the other part holding bits [4:0]. The machine code generator
+    does the split.
     '''
     IMM_MAX = 0b011111111111
     IMM_MIN = -0b100000000000
@@ -340,20 +234,7 @@ def get_imm_S(imm10, lineno):
     if (imm10 > IMM_MAX) or (imm10 < IMM_MIN):
         cp.cprint_warn("Warning:" + str(lineno) + ":" +
                        " Immediate is too big, will overflow.")
-    # Convert to 2's complement binary
-    imm2 = format(imm10 if imm10 >= 0 else (1 << 12) + imm10, '012b')
-    if imm2[-1] != 0:
-        cp.cprint_warn("Warning:" + str(lineno) + ":" +
-                       "Immediate not 2 bytes aligned. Last bit will" +
-                       "be dropped.")
-    imm2 = imm2[0:12]
-    # Convert immediate back to base 10 from base 2
-    # p[0] = int(imm2, 2)
-    assert(len(imm2) == 12)
-    imm_11_5 = imm2[:7]
-    imm_4_0 = imm2[7:]
-    assert(len(imm_11_5) + len(imm_4_0) == 12)
-    return True, (imm_11_5, imm_4_0), p_statement_none
+    return True, imm10, None
 
 
 def get_imm_SB(imm10, lineno):
@@ -375,20 +256,50 @@ def get_imm_SB(imm10, lineno):
     if (imm10 > IMM_MAX) or (imm10 < IMM_MIN):
         cp.cprint_warn("Warning:" + str(lineno) + ":" +
                        "Immediate is too big, will overflow.")
-    # Convert to 2's complement binary
-    imm2 = format(imm10 if imm10 >= 0 else (1 << 13) + imm10, '013b')
-    if imm2[-1] != '0':
+    if imm10 & 1:
         cp.cprint_warn("Warning:" + str(lineno) + ":" +
                        "Immediate not 2 bytes aligned. Last bit will" +
                        "be dropped.")
-    imm2 = imm2[0:12]
-    # Convert immediate back to base 10 from base 2
-    # p[0] = int(imm2, 2)
-    assert(len(imm2) == 12)
-    imm_12_10_5 = imm2[-12] + imm2[-10:-4]
-    imm_4_1_11 = imm2[-4:] + imm2[-11]
-    assert(len(imm_12_10_5) + len(imm_4_1_11) == 12)
-    return True, (imm_12_10_5, imm_4_1_11), None
+    return True, imm10, None
+
+# Immediate conversion of each instruction format
+IMM_FORMATS = {
+    mcc.FMT_I: get_imm_I,
+    mcc.FMT_S: get_imm_S,
+    mcc.FMT_SB: get_imm_SB,
+    mcc.FMT_U: get_imm_U,
+    mcc.FMT_UJ: get_imm_UJ
+}
+
+
+def build_statement(opcode, shape, operands, lineno):
+    '''
+    Builds an instruction from its source operands, registers being
+    given as indices, assigning them to fields as described by the
+    instruction registry.
+
+    returns: the Instr, or None if the opcode does not take operands
+    of this shape.
+    '''
+    desc = mcc.INSTR_DESC.get(opcode)
+    if desc is None or shape not in desc.shapes:
+        return None
+    fields = {'rd': None, 'rs1': None, 'rs2': None, 'imm': None,
+              'label': None}
+    for name, kind, value in zip(desc.operands, shape, operands):
+        if kind == 'r':
+            fields[name] = value
+        elif kind == 'l':
+            fields['label'] = symbol_id(value)
+        else:
+            ret, imm, msg = IMM_FORMATS[desc.fmt](value, lineno)
+            if not ret:
+                cp.cprint_fail("Error:" + str(lineno) + ":" + msg)
+                raise SyntaxError
+            fields['imm'] = imm
+    return Instr(opcode, fields['rd'], fields['rs1'], fields['rs2'],
+                 fields['imm'], fields['label'], lineno)
+
 
 '''
 For this simple parser, I have not implemented error
@@ -408,69 +319,140 @@ def p_error(p):
                        "Did you end with a newline?")
 
 
-def encode_offset(ltokens, address, target):
+def encode_offset(linstr, address, target):
     '''
     In instructions having label, this function calculates
     the value of the offset that has to be encoded inplace of the
     the label.
     It uses the current address of the instruction and the target address
-    to calculate the difference and encode the offset in binary
+    to calculate the difference and encode the offset
 
-    returns: immediate offset in binary
+    returns: the instruction with the immediate offset in place of the
+    label
     '''
     # Offset address, should be divisible by 2 (2-byte aligned)
     offset = target - address
     assert(offset % 2 == 0)
-    lineno = ltokens['lineno']
-    if ltokens['opcode'] == mcc.INSTR_JAL:
-        ret, imm, msg = get_imm_UJ(offset, lineno)
-        if not ret:
-            # Label translation should not raise errors,
-            # Warnings make sense.
-            cp.cprint_fail("Internal error:" +
-                           str(tokens['lineno']) + ":" + msg)
-            exit(1)
-        result = {
-            'opcode': ltokens['opcode'],
-            'rd': ltokens['rd'],
-            'imm': imm,
-            'lineno': lineno
-        }
-
-    elif ltokens['opcode'] in mcc.INSTR_TYPE_SB:
-        ret, imm, msg = get_imm_SB(offset, lineno)
-        if not ret:
-            cp.cprint_fail("Internal error:" + str(lineno) + ":" + msg)
-            exit(1)
-        result = {
-            'opcode': ltokens['opcode'],
-            'rs1': ltokens['rs1'],
-            'rs2': ltokens['rs2'],
-            'imm': imm,
-            'lineno': lineno
-        }
-    elif ltokens['opcode'] == mcc.INSTR_JALR:
-        ret, imm, msg = get_imm_I(offset, lineno)
-        if not ret:
-            cp.cprint_fail("Error:" + str(lineno) + ":" + msg)
-            raise SyntaxError
-
-        result = {
-            'opcode': ltokens['opcode'],
-            'rd': ltokens['rd'],
-            'rs1': ltokens['rs1'],
-            'imm': imm,
-            'lineno': lineno
-        }
-    else:
+    lineno = linstr.lineno
+    desc = mcc.INSTR_DESC[linstr.opcode]
+    if desc.fmt not in IMM_FORMATS:
+        if cp.ordered is not None:
+            # An error of the second pass
+            cp.ordered.line = lineno
         cp.cprint_fail("Error: " + str(lineno) + " : " +
                        "Label not supported in '" +
-                       str(ltokens['opcode']) + "'")
+                       str(linstr.opcode) + "'")
+        raise Abort(1)
+    ret, imm, msg = IMM_FORMATS[desc.fmt](offset, lineno)
+    if not ret:
+        # Label translation should not raise errors,
+        # Warnings make sense.
+        if cp.ordered is not None:
+            cp.ordered.line = lineno
+        cp.cprint_fail("Internal error:" + str(lineno) + ":" + msg)
+        raise Abort(1)
+    return linstr._replace(imm=imm, label=None)
+
+
+'''
+Fast path line decoder
+----------------------
+Nearly every source line is a blank or comment line, a label
+declaration or an instruction in one of the shapes of the
+p_statement_* rules. Such lines are recognised here with precompiled
+regular expressions and the same result the grammar rules build is
+returned directly, without going through ply.
+
+Anything unusual - syntax errors, wrong opcode for the operands,
+register indices out of range, a missing newline at the end of the
+file - is left to the ply parser by returning None, so errors are
+reported exactly as before.
+'''
+_WS = r'[ \t\r]*'
+_IDENT = r'[a-zA-Z_][a-zA-Z_0-9]*'
+_REG = r'\$([0-9][0-9]?)'
+_END = _WS + r'(?:\#[^\n]*)?\n'
+
+_FAST_BLANK = re.compile(_END)
+_FAST_LABEL = re.compile(_WS + '(' + _IDENT + ')' + _WS + ':' + _END)
+# OPCODE reg, [reg,] (reg | IMMEDIATE | LABEL)
+_FAST_INSTR = re.compile(_WS + '(' + _IDENT + ')' + _WS +
+                         _REG + _WS + ',' + _WS +
+                         '(?:' + _REG + _WS + ',' + _WS + ')?' +
+                         '(?:' + _REG + '|([+-]?[0-9]+)|(' + _IDENT + '))' +
+                         _END)
+
+
+def decode_line(line, lineno):
+    '''
+    Decodes one source line without the ply parser.
+
+    returns: the same result parser.parse(line) returns, or None if
+    the line has to be parsed by ply.
+    '''
+    m = _FAST_INSTR.match(line)
+    if m is None:
+        if _FAST_BLANK.match(line):
+            return EMPTY
+        m = _FAST_LABEL.match(line)
+        if m is None or m.group(1) in OPCODES:
+            return None
+        return Label(symbol_id(m.group(1)), lineno)
+
+    opcode, r1, r2, r3, imm, label = m.groups()
+    r1 = int(r1)
+    if label in OPCODES or r1 > 31:
+        return None
+    if r2 is None:
+        if imm is not None:
+            shape, operands = 'ri', (r1, imm)
+        elif label is not None:
+            shape, operands = 'rl', (r1, label)
+        else:
+            return None
+    else:
+        r2 = int(r2)
+        if r2 > 31:
+            return None
+        if r3 is not None:
+            r3 = int(r3)
+            if r3 > 31:
+                return None
+            shape, operands = 'rrr', (r1, r2, r3)
+        elif imm is not None:
+            shape, operands = 'rri', (r1, r2, imm)
+        else:
+            shape, operands = 'rrl', (r1, r2, label)
+    return build_statement(opcode, shape, operands, lineno)
 
-    return result
 
+'''
+The parser tables are generated once at install time by `lib.tables`
+and only loaded here. If they are missing or out of date, yacc builds
+them in memory for this run without writing anything to disk.
 
-parser = yacc.yacc()
+A ply parser keeps the state of the parse in progress, so each thread
+parses with a copy of its own, the copies sharing the tables.
+'''
+parser = None
+_parser_lock = threading.Lock()
+_parsers = threading.local()
+
+
+def get_parser():
+    '''
+    returns: the parser of the calling thread
+    '''
+    try:
+        return _parsers.parser
+    except AttributeError:
+        pass
+    global parser
+    with _parser_lock:
+        if parser is None:
+            parser = yacc.yacc(debug=False, write_tables=False)
+    _parsers.parser = copy.copy(parser)
+    return _parsers.parser
 
 '''
 First pass of assembling:
@@ -478,7 +460,107 @@ Address and label resolution
 '''
 
 
+def check_imm(instr):
+    '''
+    Prints the warnings of the immediate of instr again.
+    '''
+    IMM_FORMATS[mcc.INSTR_DESC[instr.opcode].fmt](instr.imm, instr.lineno)
+
+# stripped line -> (record type, fields but the line number, whether
+# the immediate prints warnings, label name), (None, None, False, None)
+# for a blank line. Symbol ids only hold within an assembly (see ir.py),
+# so the label of a record is cached by name, its field being left out
+# of the cached fields, and interned again on every hit.
+parse_memo = memo.Memo('parse')
+
+
+def parse_lines(fin):
+    '''
+    Parses the source (see reader.py) one line at a time and yields
+    the Instr or Label record of each line holding one. Canonical lines
+    are decoded by the fast path, the remaining ones by the ply parser.
+    The records of the lines decoded by the fast path are cached (see
+    memo.py).
+    '''
+    parser = get_parser()
+    lexer = get_lexer()
+    cache = parse_memo.entries
+    if cache is not None:
+        get = cache.get
+        move = cache.move_to_end
+        capacity = parse_memo.capacity
+    make = tuple.__new__
+    cancel = cp.cancel
+    for lineno, line in fin.lines():
+        if cancel is not None and cancel.is_set():
+            raise Abort(1)
+        key = None
+        if cache is not None and line[-1:] == '\n':
+            key = line.strip(' \t\r\n')
+            hit = get(key)
+            if hit is not None:
+                move(key)
+                parse_memo.hits += 1
+                record, fields, noisy, name = hit
+                if record is not None:
+                    if name is not None:
+                        fields = fields + (symbol_id(name),)
+                    result = make(record, fields + (lineno,))
+                    if noisy:
+                        check_imm(result)
+                    yield result
+                continue
+            parse_memo.misses += 1
+            issued = cp.issued
+        result = decode_line(line, lineno)
+        if result is None:
+            # Not a canonical line, let the grammar handle (and
+            # report) it.
+            lexer.lineno = lineno
+            ordered = cp.ordered
+            if ordered is not None:
+                start = len(ordered.first)
+            result = parser.parse(line, lexer=lexer)
+            if result is None:
+                # The syntax error has been reported
+                raise Abort(1)
+            if ordered is not None:
+                ordered.again(start, lineno)
+        elif key is not None:
+            # Same as parse_memo.store, inlined
+            if result is EMPTY:
+                cache[key] = (None, None, False, None)
+            elif result[-2] is None:
+                # The label is the field before the line number, of both
+                # the Instr and the Label records
+                cache[key] = (type(result), result[:-1], cp.issued != issued,
+                              None)
+            else:
+                cache[key] = (type(result), result[:-2], cp.issued != issued,
+                              symbol_name(result[-2]))
+            if len(cache) > capacity:
+                cache.popitem(last=False)
+        if result is not EMPTY:
+            yield result
+
+
+def records(fin):
+    '''
+    returns: the records of the source fin, as parse_lines yields them,
+    their reading and parsing being timed when collecting statistics
+    (see stats.py)
+    '''
+    counters = cp.stats
+    if counters is None:
+        return parse_lines(fin)
+    return counters.records(parse_lines(counters.source(fin)))
+
+
 def parse_pass_one(fin, args):
+    return resolve_labels(records(fin), args)
+
+
+def resolve_labels(results, args):
     address = 0
     symbols_table = {}
     # Suppress instruction warnings
@@ -486,100 +568,416 @@ def parse_pass_one(fin, args):
     prev_warn32 = cp.warn32
     cp.warn = False
     cp.warn32 = False
-    for line in fin:
-        result = parser.parse(line)
-        if result["tokens"] is None:
-            continue
-
-        if result['type'] is 'non_label':
+    for result in results:
+        if not isinstance(result, Label):
             address += 4
             continue
 
-        if not result['tokens']['label'] in symbols_table:
-            symbols_table[result['tokens']['label']] = address
+        if result.label not in symbols_table:
+            symbols_table[result.label] = address
         else:
-            cp.cprint_fail("Error: " + str(result['tokens']['lineno']) +
-                           " : Redeclaration of label '" +
-                           str(result['tokens']) + "'.")
-            exit(1)
+            redeclared_label(result)
     # Restore warning state
     cp.warn = prev_warn
     cp.warn32 = prev_warn32
     if args['echo_symbols']:
-        cp.cprint_msgb("Symbols and Addresses:")
-        cp.cprint_msgb(str(symbols_table))
+        echo_symbols(symbols_table)
     return symbols_table
 
 
-def parse_pass_two(fin, fout, symbols_table, args):
-    fin.seek(0, 0)
+def redeclared_label(label):
+    if cp.ordered is not None:
+        # The first pass stops at its line
+        cp.ordered.end = label.lineno
+    cp.cprint_fail("Error: " + str(label.lineno) +
+                   " : Redeclaration of label '" +
+                   symbol_name(label.label) + "'.")
+    raise Abort(1)
+
+
+def undefined_label(instr):
+    if cp.ordered is not None:
+        # An error of the second pass
+        cp.ordered.line = instr.lineno
+    cp.cprint_fail("Error: " + str(instr.lineno) +
+                   " : Label used but never defined '" +
+                   symbol_name(instr.label) + "'.")
+    raise Abort(1)
+
+
+def echo_symbols(symbols_table):
+    cp.cprint_msgb("Symbols and Addresses:")
+    cp.cprint_msgb(str(symbol_names(symbols_table)))
+
+
+def echo_instr(lineno, opcode, instr, args):
+    '''
+    Echoes an encoded instruction to the console, as the echo and
+    tokenize options ask.
+    '''
+    if cp.ordered is not None:
+        cp.ordered.line = lineno
+    # Echo to console
+    if args['echo']:
+        # Use hex instead of binary
+        if args['hex']:
+            text = '%08X' % instr
+        else:
+            text = format(instr, '032b')
+        cp.cprint_msgb(str(lineno) + " " + text)
+    if args['tokenize']:
+        from pprint import pformat
+        cp.cprint_msgb(str(lineno))
+        cp.cprint(pformat(mcg.get_fields(opcode, instr)))
+    if cp.ordered is not None:
+        cp.ordered.line = None
+
+
+def write_instr(image, lineno, opcode, instr, args):
+    '''
+    Adds one encoded instruction to the image, honouring the console
+    echo options. The output files are written from the image once
+    the program is assembled.
+    '''
+    if args['echo'] or args['tokenize']:
+        echo_instr(lineno, opcode, instr, args)
+    image.append(instr)
+    if image.lines is not None:
+        image.lines.append(lineno)
+
+
+def parse_pass_two(fin, image, symbols_table, args):
     # Reset line number state
     reset_lineno()
-    address = 0
-    for line in fin:
-        result = parser.parse(line)
-        if result["tokens"] is None:
-            continue
+    encode_statements(records(fin), image, symbols_table, args)
+
 
-        if result['type'] is 'label':
+def encode_statements(results, image, symbols_table, args, address=0):
+    '''
+    Encodes the parsed statements into the image, address being the
+    address of the first one.
+    '''
+    for result in results:
+        if isinstance(result, Label):
             continue
 
-        instr = None
-        result = result['tokens']
-        if 'label' in result:
-            if result['label'] not in symbols_table:
-                cp.cprint_fail("Error: " + str(result['lineno']) +
-                               " : Label used but never defined '" +
-                               str(result['label']) + "'.")
-                exit(1)
+        if result.label is not None:
+            if result.label not in symbols_table:
+                undefined_label(result)
             result = encode_offset(
-                result, address, symbols_table[result['label']])
-        if result:
-            instr, instr_dict = mcg.convert_to_binary(result)
-        if not instr:
+                result, address, symbols_table[result.label])
+        instr = mcg.encode(result)
+        if instr is None:
             continue
 
-        # Use hex instead of binary
-        if args['hex']:
-            instr = '%08X' % int(instr, 2)
-        # Echo to console
-        if args['echo']:
-            cp.cprint_msgb(str(result['lineno']) + " " + str(instr))
-        if args['tokenize']:
-            cp.cprint_msgb(str(result['lineno']))
-            pprint(instr_dict)
-
-        fout.write(instr + '\n')
+        write_instr(image, result.lineno, result.opcode, instr, args)
+        address += 4
+
+
+'''
+Single pass assembling:
+Each line is parsed exactly once. Instructions whose label is already
+known are encoded right away. Instructions referring to a label that
+is defined further down (forward references) are kept in a fixup list
+and patched as soon as the label is defined. The output is written in
+program order and is identical to that of the two pass path.
+
+As the input is read only once, this is also how a pipe is assembled
+(`-` as input or output file). Each instruction is handed to the output
+as soon as it and every instruction before it are resolved, so only the
+instructions following the oldest unresolved forward reference are kept
+in memory, whatever the size of the program.
+'''
+
+
+def parse_single_pass(fin, image, args):
+    return assemble_single_pass(records(fin), image, args)
+
+
+def assemble_single_pass(results, image, args):
+    address = 0
+    symbols_table = {}
+    # label -> pending entries waiting for that label
+    fixups = {}
+    # Entries not yet written, in program order. Each entry is
+    # [instr, address, encoded], encoded being None until resolved.
+    pending = deque()
+
+    def flush():
+        while pending and pending[0][2] is not None:
+            result, _, instr = pending.popleft()
+            write_instr(image, result.lineno, result.opcode, instr, args)
+
+    def encode(entry, target):
+        linstr, addr, _ = entry
+        result = encode_offset(linstr, addr, target)
+        entry[0] = result
+        entry[2] = mcg.encode(result)
+
+    for result in results:
+        if isinstance(result, Label):
+            label = result.label
+            if label in symbols_table:
+                redeclared_label(result)
+            symbols_table[label] = address
+            for entry in fixups.pop(label, ()):
+                encode(entry, address)
+            flush()
+            continue
+
+        entry = [result, address, None]
+        if result.label is None:
+            entry[2] = mcg.encode(result)
+        elif result.label in symbols_table:
+            encode(entry, symbols_table[result.label])
+        else:
+            fixups.setdefault(result.label, []).append(entry)
+        pending.append(entry)
+        flush()
         address += 4
 
+    # Printed by the two pass assembly before the errors of its second
+    # pass
+    if args['echo_symbols']:
+        echo_symbols(symbols_table)
+
+    if fixups:
+        # Report the first use of an undefined label in program order
+        undefined_label(min((e[0] for entries in fixups.values()
+                             for e in entries), key=lambda i: i.lineno))
+    return symbols_table
+
 
 def parse_input(infile, **kwargs):
     if kwargs['no_color']:
         cp.no_color = True
     if kwargs['no_32']:
         cp.warn32 = False
+    outfile = kwargs['outfile']
+    if outfile == '-':
+        # Keep the standard output for the program
+        cp.out = sys.stderr
     fin = None
     try:
-        fin = open(infile, 'r')
+        fin = open_source(infile)
     except IOError:
         cp.cprint_fail("Error: File does not seem to exist or" +
                        " you do not have the required permissions.")
         return 1
 
-    outfile = kwargs['outfile']
-    fout = None
     try:
-        fout = open(outfile, 'w')
-    except IOError:
-        cp.cprint_fail("Error: Could not create '" + outfile + "' for output")
+        outputs = emitter.outputs(outfile, kwargs['hex'], kwargs.get('emit'))
+    except ValueError as e:
+        cp.cprint_fail(emitter.unknown_format(str(e)))
         return 1
+    fouts = []
+    for fmt, filename in outputs:
+        if filename == '-':
+            fouts.append((fmt, sys.stdout.buffer))
+            continue
+        try:
+            fouts.append((fmt, open(filename, 'wb')))
+        except IOError:
+            cp.cprint_fail("Error: Could not create '" + filename +
+                           "' for output")
+            return 1
+
+    try:
+        # The labels of this assembly only
+        with symbols_scope():
+            if (kwargs.get('incremental') is not None and
+                    isinstance(fin, MappedSource)):
+                # Only reassemble what changed since the previous assembly
+                from lib import incremental
+                incremental.assemble(fin, fouts, kwargs)
+            elif kwargs.get('cache') and isinstance(fin, MappedSource):
+                # Copy the outputs of a previous assembly of the same source
+                from lib import cache
+                cache.assemble(fin, outputs, fouts, kwargs)
+            else:
+                # A pipe cannot be read twice, and a pipe on either side is
+                # better served as soon as possible: stream through the single
+                # pass, writing each instruction once it is resolved.
+                streaming = ((not fin.rewindable or outfile == '-' or
+                              is_pipe(outfile)) and
+                             not kwargs.get('whole_program') and
+                             not kwargs.get('batch'))
+                image = None
+                if kwargs.get('index') is not None:
+                    # The index needs the line of every instruction, which
+                    # the pieces of a parallel assembly do not record
+                    image = emitter.Image(lines=True)
+                    kwargs = dict(kwargs, jobs=1)
+                symbols_table = assemble(fin, fouts, streaming, kwargs, image)
+                if image is not None:
+                    from lib import patch
+                    patch.save_index(patch.index_path(kwargs), fin, image,
+                                     symbols_table)
+    finally:
+        # Also when an error stops the assembly, so that a pipe being
+        # written to ends as soon as parse_input does
+        for fmt, fout in fouts:
+            close_output(fout)
+        fin.close()
+
+
+def parse_whole(fin):
+    '''
+    returns: the Program of the source fin, parsed with a single parser
+    invocation (see programparser.py)
+    '''
+    from lib.programparser import parse_program
+    text = stats.read(fin)
+    with stats.phase('parse'):
+        results = parse_program(text)
+        if results is None:
+            results = parse_again(text)
+    return results
+
+
+def parse_again(text):
+    '''
+    Parses the program text one line at a time after the whole program
+    parser found a syntax error. The whole program parser goes on after
+    an error and reports the errors of every line, where the line parser
+    stops at the first line it cannot parse, and goes on past the errors
+    it recovers from within a line. Its messages replace those of the
+    whole program parser.
+
+    returns: the Program of the lines
+
+    raises: Abort if a line cannot be parsed
+    '''
+    if cp.ordered is None:
+        # The messages have been printed
+        raise Abort(1)
+    cp.ordered = Ordered()
+    return Program(parse_lines(StreamSource(io.StringIO(text))))
+
+
+def in_line_order(enabled=True):
+    '''
+    returns: the context holding back the messages issued in it, and
+    printing them in the order of the two pass assembly when it exits
+    (see cprint.Ordered), doing nothing unless enabled
+    '''
+    if not enabled or cp.ordered is not None:
+        return contextlib.nullcontext()
+    return ordered_messages()
+
 
-    # Pass 1: Address resolution of labels
-    symbols_table = parse_pass_one(fin, kwargs)
-    # Pass 2: Mapping instructions to binary coding
-    parse_pass_two(fin, fout, symbols_table, kwargs)
-    fout.close()
-    fin.close()
+@contextlib.contextmanager
+def ordered_messages():
+    cp.ordered = Ordered()
+    try:
+        yield
+    except BaseException:
+        cp.ordered.aborted = True
+        raise
+    finally:
+        # Replaced by parse_again
+        ordered = cp.ordered
+        cp.ordered = None
+        cp.release(ordered)
+
+
+def assemble(fin, fouts, streaming, kwargs, image=None):
+    '''
+    Assembles the source fin (see reader.py) into image, a new one if
+    None, and writes the program to fouts, a list of (format, binary
+    file). If streaming, the first output is written while the program
+    is being assembled, the others once it is complete.
+
+    returns: the symbols table
+    '''
+    if image is None:
+        image = emitter.Image()
+    sink = image
+    if streaming:
+        fouts = list(fouts)
+        fmt, fout = fouts.pop(0)
+        # Only keep the image if other outputs or its lines are needed
+        keep = fouts or image.lines is not None
+        sink = emitter.Stream(fout, fmt, image if keep else None)
+
+    pieces = None
+    # The phases of the processes of a parallel assembly are not timed
+    if kwargs.get('jobs', 1) > 1 and cp.stats is None:
+        from lib import parallel
+        pieces = parallel.split(fin, kwargs['jobs'])
+
+    batch = kwargs.get('batch')
+    if batch:
+        # Imported here, NumPy takes long to load
+        from lib import batchencoder
+        batch = batchencoder.available()
+    # The assemblies parsing the source once print their messages as
+    # the two pass one does
+    once = (batch or kwargs.get('whole_program') or
+            kwargs.get('single_pass') or streaming)
+    with in_line_order(once):
+        if batch:
+            # Encode the whole program at once, the instruction checks
+            # are made on the whole program by the batch encoder.
+            prev_warn = cp.warn
+            prev_warn32 = cp.warn32
+            cp.warn = False
+            cp.warn32 = False
+            if kwargs.get('whole_program'):
+                results = parse_whole(fin)
+            else:
+                with stats.phase('parse'):
+                    results = Program(records(fin))
+            cp.warn = prev_warn
+            cp.warn32 = prev_warn32
+            with stats.phase('labels'):
+                symbols_table = resolve_labels(results, kwargs)
+            with stats.phase('encode'):
+                batchencoder.encode_program(results, image, symbols_table,
+                                            kwargs)
+        elif kwargs.get('whole_program'):
+            # Parse the complete input with a single parser invocation
+            results = parse_whole(fin)
+            if kwargs.get('single_pass'):
+                with stats.phase('encode'):
+                    symbols_table = assemble_single_pass(results, image,
+                                                         kwargs)
+            else:
+                with stats.phase('labels'):
+                    symbols_table = resolve_labels(results, kwargs)
+                with stats.phase('encode'):
+                    encode_statements(results, image, symbols_table, kwargs)
+        elif kwargs.get('single_pass') or streaming:
+            with stats.span('single_pass'), stats.phase('encode'):
+                symbols_table = parse_single_pass(fin, sink, kwargs)
+        elif pieces:
+            # Both passes on the pieces of the input in a process pool
+            symbols_table = parallel.assemble(fin, pieces, image, kwargs)
+        else:
+            # Pass 1: Address resolution of labels
+            with stats.span('pass_one'), stats.phase('labels'):
+                symbols_table = parse_pass_one(fin, kwargs)
+            # Pass 2: Mapping instructions to binary coding
+            with stats.span('pass_two'), stats.phase('encode'):
+                parse_pass_two(fin, image, symbols_table, kwargs)
+
+    # Write every output from the assembled image
+    symbols = symbol_names(symbols_table)
+    image.words.symbols = symbols
+    with stats.phase('write'):
+        for fmt, fout in fouts:
+            emitter.emit(image, fmt, symbols, fout)
+    if cp.stats is not None:
+        cp.stats.count(image if sink is image or sink.image is not None
+                       else None, symbols_table)
+    return symbols_table
+
+
+def close_output(fout):
+    if fout is sys.stdout.buffer:
+        fout.flush()
+    else:
+        fout.close()
 
 
 def main():
@@ -593,8 +991,9 @@ def main():
                        " you do not have the required permissions.")
         return 1
 
+    parser = get_parser()
     for line in fin:
-        result = parser.parse(line)
+        result = parser.parse(line, lexer=get_lexer())
         if result:
             print(result)
 
@@ -0,0 +1,320 @@
+#
+# @author:Don Dennis
+# patch.py
+#
+# Patching assembled programs in place.
+#
+# When a program is assembled with --index, an address index is saved
+# next to the output: the source line of every instruction and the
+# address and line of every label. A few lines of the source edited
+# afterwards can then be patched into the outputs without assembling
+# the program again: only the edited lines are parsed and encoded, and
+# their words are rewritten in place in the mapped output files.
+#
+# This only holds as long as the edits leave every instruction and
+# label where it was, so an edit is rejected if it adds or removes an
+# instruction or a label, or renames a label. The source must keep its
+# number of lines. Only the fixed width formats can be patched: memb,
+# memh and bin (see emitter.py).
+#
+# The index file is written next to the output file, with the
+# extension .rvx, unless another file is given.
+
+import json
+import mmap
+import os
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from lib import emitter
+from lib import parser
+from lib.cprint import cprint as cp, Abort
+from lib.ir import Instr, Label, symbol_id, symbol_name, symbols_scope
+from lib.machinecodegen import mcg
+from lib.reader import MappedSource
+
+MAGIC = b'RVI-INDEX 1\n'
+
+# A label declaration, as the fast path of the parser reads it
+_LABEL_LINE = re.compile(
+    rb'(?m)^[ \t\r]*([a-zA-Z_][a-zA-Z_0-9]*)[ \t\r]*:')
+
+'''
+Index
+-----
+The index file holds MAGIC, a line of JSON and the source line of every
+instruction, as an array('I') in program order. The JSON holds
+
+    key: the assembler code the index is valid for
+    source_lines: the number of lines of the source
+    count: the number of instructions
+    labels: [name, address, lineno] of every label
+'''
+
+
+class Index:
+
+    def __init__(self, source_lines, lines, labels):
+        self.source_lines = source_lines
+        self.lines = lines
+        # label id -> address
+        self.symbols = dict((symbol_id(name), address)
+                            for name, address, _ in labels)
+        # lineno -> label name
+        self.label_lines = dict((lineno, name)
+                                for name, _, lineno in labels)
+
+    def address(self, lineno):
+        '''
+        returns: the address of the instruction on line lineno, None if
+        there is none.
+        '''
+        i = bisect_left(self.lines, lineno)
+        if i < len(self.lines) and self.lines[i] == lineno:
+            return i * 4
+        return None
+
+
+def index_key():
+    from lib.cache import code_hash
+    return [code_hash()]
+
+
+def index_path(kwargs):
+    path = kwargs.get('index')
+    if path:
+        return path
+    outfile = kwargs['outfile']
+    if outfile == '-':
+        outfile = 'a.b'
+    return os.path.splitext(outfile)[0] + '.rvx'
+
+
+def load_index(path):
+    '''
+    returns: the Index saved in path, or None if there is none valid
+    for this assembler.
+    '''
+    try:
+        with open(path, 'rb') as fin:
+            if fin.readline() != MAGIC:
+                return None
+            header = json.loads(fin.readline().decode('utf-8'))
+            if header['key'] != index_key():
+                return None
+            lines = array('I')
+            lines.fromfile(fin, header['count'])
+            return Index(header['source_lines'], lines, header['labels'])
+    except (OSError, ValueError, KeyError, EOFError):
+        return None
+
+
+def save_index(path, fin, image, symbols_table):
+    '''
+    Saves the index of the program assembled from the source fin into
+    image, with the source line of every instruction.
+    '''
+    if not isinstance(fin, MappedSource):
+        cp.cprint_warn("Warning: The address index is only written for" +
+                       " source files.")
+        return
+    index = fin.index
+    # Lines of the labels, from the source as the parser has read it
+    label_lines = {}
+    for m in _LABEL_LINE.finditer(fin.data):
+        label_lines[m.group(1).decode('utf-8')] = \
+            bisect_right(index, m.start())
+    labels = []
+    for sid, address in symbols_table.items():
+        name = symbol_name(sid)
+        labels.append([name, address, label_lines.get(name)])
+    header = {
+        'key': index_key(),
+        'source_lines': len(fin),
+        'count': len(image.lines),
+        'labels': labels
+    }
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fout:
+        fout.write(MAGIC)
+        fout.write(json.dumps(header).encode('utf-8') + b'\n')
+        image.lines.tofile(fout)
+    os.replace(tmp, path)
+
+
+'''
+Patching
+--------
+'''
+
+
+class EditedLines:
+    '''
+    The edited lines of a MappedSource, read as a source of their own.
+    '''
+
+    def __init__(self, source, linenos):
+        self.source = source
+        self.linenos = linenos
+
+    def lines(self):
+        for lineno in self.linenos:
+            yield lineno, self.source.line(lineno)
+
+
+def rejected(lineno, what):
+    cp.cprint_fail("Error: " + str(lineno) + " : The edit changes " + what +
+                   ", the program has to be assembled again.")
+    raise Abort(1)
+
+
+def encode_edits(source, index, linenos, args):
+    '''
+    Parses and encodes the edited lines of the source.
+
+    returns: list of (word index, word) of the edited instructions
+    '''
+    records = dict((record.lineno, record)
+                   for record in parser.parse_lines(
+                       EditedLines(source, linenos)))
+    image = emitter.Image()
+    words = []
+    for lineno in linenos:
+        record = records.get(lineno)
+        address = index.address(lineno)
+        label = index.label_lines.get(lineno)
+        if isinstance(record, Instr):
+            if address is None:
+                rejected(lineno, "the number of instructions")
+        elif address is not None:
+            rejected(lineno, "the number of instructions")
+        elif isinstance(record, Label):
+            if symbol_name(record.label) != label:
+                rejected(lineno, "the labels")
+            continue
+        elif label is not None:
+            rejected(lineno, "the labels")
+        else:
+            # Still a blank or comment line
+            continue
+
+        if record.label is not None:
+            if record.label not in index.symbols:
+                parser.undefined_label(record)
+            record = parser.encode_offset(
+                record, address, index.symbols[record.label])
+        word = mcg.encode(record)
+        if word is None:
+            raise Abort(1)
+        parser.write_instr(image, lineno, record.opcode, word, args)
+        words.append((address // 4, word))
+    return words
+
+
+def open_outputs(outputs, count):
+    '''
+    Opens the output files to be patched, checking that each holds
+    count words.
+
+    returns: list of (format, file), or None if one cannot be patched
+    '''
+    files = []
+    try:
+        for fmt, filename in outputs:
+            if fmt not in emitter.STREAM_FORMATS:
+                cp.cprint_fail("Error: Output format '" + fmt +
+                               "' cannot be patched in place.")
+                return None
+            try:
+                fout = open(filename, 'r+b')
+            except IOError:
+                cp.cprint_fail("Error: Could not open '" + filename +
+                               "' for patching.")
+                return None
+            files.append((fmt, fout))
+            width = len(emitter.STREAM_FORMATS[fmt](0))
+            if os.fstat(fout.fileno()).st_size != count * width:
+                cp.cprint_fail("Error: '" + filename + "' does not hold" +
+                               " the indexed program, it has to be" +
+                               " assembled again.")
+                return None
+        result, files = files, []
+        return result
+    finally:
+        for fmt, fout in files:
+            fout.close()
+
+
+def write_words(fout, fmt, words):
+    '''
+    Rewrites the given (word index, word) in place in fout.
+    '''
+    encode = emitter.STREAM_FORMATS[fmt]
+    width = len(encode(0))
+    with mmap.mmap(fout.fileno(), 0) as data:
+        for i, word in words:
+            data[i * width:(i + 1) * width] = encode(word)
+        data.flush()
+
+
+def patch(infile, **kwargs):
+    '''
+    Patches the words of the source lines kwargs['patch'] of infile
+    into the outputs, using the index of its previous assembly.
+
+    returns: the exit status
+    '''
+    if kwargs['no_color']:
+        cp.no_color = True
+    if kwargs['no_32']:
+        cp.warn32 = False
+    outfile = kwargs['outfile']
+    if outfile == '-' or infile == '-':
+        cp.cprint_fail("Error: Only files can be patched.")
+        return 1
+    try:
+        outputs = emitter.outputs(outfile, kwargs['hex'], kwargs.get('emit'))
+    except ValueError as e:
+        cp.cprint_fail(emitter.unknown_format(str(e)))
+        return 1
+    path = index_path(kwargs)
+    # The labels of the index and of the edited lines, interned into
+    # the symbols table of this patch
+    with symbols_scope():
+        index = load_index(path)
+        if index is None:
+            cp.cprint_fail("Error: No address index in '" + path + "'," +
+                           " assemble the program with --index first.")
+            return 1
+        try:
+            source = MappedSource(infile)
+        except (OSError, ValueError):
+            cp.cprint_fail("Error: File does not seem to exist or" +
+                           " you do not have the required permissions.")
+            return 1
+
+        try:
+            if len(source) != index.source_lines:
+                cp.cprint_fail("Error: The source has " + str(len(source)) +
+                               " lines instead of " +
+                               str(index.source_lines) + ", the program has" +
+                               " to be assembled again.")
+                return 1
+            linenos = sorted(set(kwargs['patch']))
+            for lineno in linenos:
+                if lineno > len(source):
+                    cp.cprint_fail("Error: " + str(lineno) +
+                                   " : No such line in the source.")
+                    return 1
+            words = encode_edits(source, index, linenos, kwargs)
+        finally:
+            source.close()
+
+    files = open_outputs(outputs, len(index.lines))
+    if files is None:
+        return 1
+    # Every output is checked before any is written
+    for fmt, fout in files:
+        with fout:
+            if words:
+                write_words(fout, fmt, words)
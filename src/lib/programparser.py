@@ -0,0 +1,114 @@
+#
+# @author:Don Dennis
+# programparser.py
+#
+# Whole-program parser for a simple assembler for subset of RV32I.
+#
+# The line parser in parser.py is invoked once per source line. This
+# module reuses the same statement rules but adds a recursive `source`
+# rule so that a complete file (or any large buffer of lines) is parsed
+# by a single yacc invocation.
+
+import copy
+import re
+import threading
+import ply.yacc as yacc
+# This is required by design
+from lib.tokenizer import tokens
+from lib.tokenizer import get_lexer
+from lib.tokenizer import reset_lineno
+from lib.parser import p_program_statement
+from lib.parser import p_program_label
+from lib.parser import p_statement_R
+from lib.parser import p_statement_I_S_SB
+from lib.parser import p_statement_U_UJ
+from lib.parser import p_statement_UJ_LABEL
+from lib.parser import p_statement_SB__JALR_LABEL
+from lib.parser import p_register
+from lib.parser import p_statement_none
+from lib.parser import p_error
+from lib.ir import EMPTY, Program
+
+'''
+Grammar
+-------
+source: source program
+      | program
+
+program: statement
+       | LABEL COLUMN NEWLINE
+       | error NEWLINE
+
+The statement rules are the ones of the line parser. Empty statements
+are dropped from the result so that only labels and instructions are
+kept in the returned list, lines with errors being None.
+'''
+
+
+def p_source_program(p):
+    'source : source program'
+    p[0] = p[1]
+    if p[2] is not EMPTY:
+        p[0].append(p[2])
+
+
+def p_source(p):
+    'source : program'
+    p[0] = []
+    if p[1] is not EMPTY:
+        p[0].append(p[1])
+
+
+def p_program_error(p):
+    'program : error NEWLINE'
+    # The error has already been reported. Resynchronise on the
+    # newline so that errors on the following lines are reported too.
+    p.parser.errok()
+    p[0] = None
+
+
+# Last line holding no token and no newline
+_UNTERMINATED = re.compile(r'(?:^|\n)[ \t\r]*(?:#[^\n]*)?(?<!\n)\Z')
+
+TABMODULE = 'programparsetab'
+# One copy of the parser per thread, as in parser.py
+parser = None
+_parser_lock = threading.Lock()
+_parsers = threading.local()
+
+
+def get_parser():
+    '''
+    returns: the parser of the calling thread
+    '''
+    try:
+        return _parsers.parser
+    except AttributeError:
+        pass
+    global parser
+    with _parser_lock:
+        if parser is None:
+            parser = yacc.yacc(start='source', tabmodule=TABMODULE,
+                               debug=False, write_tables=False)
+    _parsers.parser = copy.copy(parser)
+    return _parsers.parser
+
+
+def parse_program(text):
+    '''
+    Parses the complete program in `text` in one go.
+
+    returns: the Program, or None if any syntax error was found.
+    '''
+    if not text:
+        return Program()
+    reset_lineno()
+    results = get_parser().parse(text, lexer=get_lexer())
+    if results is None or None in results:
+        return None
+    if _UNTERMINATED.search(text):
+        # A last line without a newline is an error, as when parsing
+        # line by line, even without any token
+        p_error(None)
+        return None
+    return Program(results)
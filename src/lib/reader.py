@@ -0,0 +1,229 @@
+#
+# @author:Don Dennis
+# reader.py
+#
+# Input layer of the assembler.
+#
+# Source files are memory mapped rather than read as text. The mapping
+# is split into lines a few megabytes at a time, and the lines are
+# handed to the parser as numbered strings. Blank and comment only
+# lines are recognised on the bytes and skipped; only the lines that
+# are actually parsed are decoded.
+#
+# The line index, built in one scan of the mapping the first time it
+# is needed, maps any line number back to its position in the source,
+# to fetch the text of a line for error reporting or to patch the
+# source in place.
+#
+# The standard input, and anything else that cannot be mapped, is
+# read as a text stream instead.
+
+import mmap
+import os
+import re
+import stat
+import sys
+from array import array
+
+_NEWLINE = re.compile(rb'\n')
+
+# Size of the pieces of the mapping split into lines at once
+CHUNK_SIZE = 1 << 22
+
+
+def build_index(data):
+    '''
+    returns: array of the byte offset at which each line starts,
+    followed by the size of the data, so that line n (from 1) spans
+    index[n - 1]:index[n].
+    '''
+    index = array('Q', [0])
+    index.extend(m.end() for m in _NEWLINE.finditer(data))
+    if index[-1] != len(data):
+        # Last line without a newline
+        index.append(len(data))
+    return index
+
+
+class MappedSource:
+    '''
+    A source file mapped into memory.
+    '''
+    # Can be read more than once
+    rewindable = True
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            st = os.fstat(self.file.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                raise ValueError("not a regular file")
+            if st.st_size:
+                self.data = mmap.mmap(self.file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            else:
+                # Empty files cannot be mapped
+                self.data = b''
+        except (OSError, ValueError):
+            self.file.close()
+            raise
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = build_index(self.data)
+        return self._index
+
+    def __len__(self):
+        '''
+        returns: the number of lines
+        '''
+        return len(self.index) - 1
+
+    def offset(self, lineno):
+        '''
+        returns: the byte offset of the start of line lineno
+        '''
+        return self.index[lineno - 1]
+
+    def line(self, lineno):
+        '''
+        returns: the text of line lineno, with its newline
+        '''
+        return str(self.data[self.index[lineno - 1]:self.index[lineno]],
+                   'utf-8')
+
+    def lines(self, start=0, end=None, lineno=0):
+        '''
+        Yields (lineno, line) for every line that is not blank or a
+        comment. A line is blank, as for the fast path of the parser, if
+        it holds only spaces, tabs and carriage returns up to a newline
+        or a #. The last line is always yielded if it has no newline, so
+        that the parser reports it.
+
+        Only the lines from byte offset start, the start of line
+        lineno + 1, to byte offset end are read if they are given.
+        '''
+        data = self.data
+        if end is None:
+            end = len(data)
+        while start < end:
+            stop = data.find(b'\n', min(start + CHUNK_SIZE, end) - 1, end)
+            stop = end if stop < 0 else stop + 1
+            lines = data[start:stop].split(b'\n')
+            # Empty unless the chunk ends without a newline
+            last = lines.pop()
+            for line in lines:
+                lineno += 1
+                text = line.lstrip(b' \t\r')
+                if not text or text[0] == 35:
+                    continue
+                yield lineno, line.decode('utf-8') + '\n'
+            if last:
+                lineno += 1
+                yield lineno, last.decode('utf-8')
+            start = stop
+
+    def split(self, count):
+        '''
+        Splits the source into at most count line aligned pieces of
+        about the same size.
+
+        returns: list of (start, end, lineno), each piece spanning the
+        bytes start:end and starting on line lineno + 1.
+        '''
+        data = self.data
+        size = len(data)
+        pieces = []
+        start = 0
+        lineno = 0
+        for i in range(1, count + 1):
+            if i == count:
+                end = size
+            else:
+                end = data.find(b'\n', size * i // count)
+                end = size if end < 0 else end + 1
+            if end <= start:
+                continue
+            pieces.append((start, end, lineno))
+            lineno += data[start:end].count(b'\n')
+            start = end
+        return pieces
+
+    def read(self):
+        return str(self.data, 'utf-8')
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+
+class SourcePiece:
+    '''
+    A piece of a MappedSource (see MappedSource.split), read as a source
+    of its own.
+    '''
+    rewindable = True
+
+    def __init__(self, source, start, end, lineno):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.lineno = lineno
+
+    def lines(self):
+        return self.source.lines(self.start, self.end, self.lineno)
+
+
+class StreamSource:
+    '''
+    A source read as a text stream, for the standard input and files
+    that cannot be mapped. Only a seekable stream can be read more than
+    once, and no line index is kept.
+    '''
+
+    def __init__(self, file):
+        self.file = file
+        self.started = False
+        self.rewindable = file.seekable()
+
+    def lines(self):
+        if self.started:
+            self.file.seek(0, 0)
+        self.started = True
+        return enumerate(self.file, 1)
+
+    def read(self):
+        return self.file.read()
+
+    def close(self):
+        if self.file is not sys.stdin:
+            self.file.close()
+
+
+def is_pipe(path):
+    '''
+    Whether the file path is a named pipe (FIFO).
+    '''
+    try:
+        return stat.S_ISFIFO(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+def open_source(path):
+    '''
+    Opens the source file path, - being the standard input.
+
+    raises: OSError if the file cannot be opened
+    '''
+    if path == '-':
+        return StreamSource(sys.stdin)
+    try:
+        return MappedSource(path)
+    except (OSError, ValueError):
+        # Not a regular file, a pipe for example
+        return StreamSource(open(path, 'r'))
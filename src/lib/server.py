@@ -0,0 +1,259 @@
+#
+# @author:Don Dennis
+# server.py
+#
+# Long lived assembler server.
+#
+# The server listens on a Unix domain socket (see client.py for the
+# protocol) and hands the assemble requests to a pool of worker
+# processes. The workers load the lexer, the parser tables and the
+# machine code generator once, when they start, and then assemble one
+# request after the other, so a request only costs its assembly.
+#
+# Each connection is served by a thread of its own, which waits for
+# the worker assembling its request: requests of several clients are
+# assembled concurrently, up to the number of workers.
+#
+# The server keeps the latency of the last requests to report their
+# percentiles in the stats response.
+
+import base64
+import io
+import os
+import signal
+import socket
+import socketserver
+import stat
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from lib.client import OPTIONS, recv_message, send_message
+from lib.cprint import cprint as cp
+
+# Number of latest requests the latency percentiles are computed on
+LATENCY_WINDOW = 10000
+PERCENTILES = (50, 90, 99)
+
+'''
+Worker side
+-----------
+'''
+
+
+def init_worker():
+    # The server stops the workers when it is interrupted
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    from lib import parser
+    parser.get_parser()
+
+
+def assemble_request(source, options, outputs):
+    '''
+    Assembles the source text with the given options.
+
+    returns: (status, messages, outputs), outputs holding the bytes of
+    each of the (format, filename) outputs.
+    '''
+    from lib import emitter, parser
+    from lib.ir import symbols_scope
+    from lib.reader import StreamSource
+    kwargs = dict(OPTIONS)
+    kwargs.update((key, value) for key, value in options.items()
+                  if key in OPTIONS)
+    cp.out = io.StringIO()
+    cp.no_color = bool(kwargs['no_color'])
+    cp.warn = True
+    cp.warn32 = not kwargs['no_32']
+    fin = StreamSource(io.StringIO(source))
+    fouts = [(fmt, emitter.Buffer(name)) for fmt, name in outputs]
+    status = 0
+    try:
+        with symbols_scope():
+            parser.assemble(fin, fouts, False, kwargs)
+    except SystemExit:
+        # The error has been reported
+        status = 1
+    return (status, cp.out.getvalue(),
+            [fout.getvalue() for _, fout in fouts])
+
+
+'''
+Server side
+-----------
+'''
+
+
+def percentile(values, p):
+    '''
+    returns: the p-th percentile of the sorted values (nearest rank)
+    '''
+    if not values:
+        return None
+    rank = max(0, -(-p * len(values) // 100) - 1)
+    return values[rank]
+
+
+class Stats:
+    '''
+    Request counts and latencies, updated by the connection threads.
+    '''
+
+    def __init__(self, workers):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.workers = workers
+        self.requests = 0
+        self.failed = 0
+        self.errors = 0
+        self.active = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def begin(self):
+        with self.lock:
+            self.active += 1
+
+    def end(self, seconds, status):
+        with self.lock:
+            self.active -= 1
+            self.requests += 1
+            if status is None:
+                self.errors += 1
+            elif status:
+                self.failed += 1
+            self.latencies.append(seconds)
+
+    def report(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                'uptime': round(time.time() - self.started, 3),
+                'workers': self.workers,
+                'requests': self.requests,
+                'failed': self.failed,
+                'errors': self.errors,
+                'active': self.active
+            }
+        latency = dict(('p%d' % p, percentile(latencies, p))
+                       for p in PERCENTILES)
+        latency['max'] = latencies[-1] if latencies else None
+        latency['mean'] = (sum(latencies) / len(latencies)
+                           if latencies else None)
+        latency['window'] = len(latencies)
+        stats['latency'] = latency
+        return stats
+
+
+class Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                message = recv_message(self.request)
+            except ValueError as e:
+                send_message(self.request, {'error': str(e)})
+                return
+            if message is None:
+                return
+            send_message(self.request, self.server.dispatch(message))
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, workers):
+        self.pool = ProcessPoolExecutor(workers, initializer=init_worker)
+        self.stats = Stats(workers)
+        socketserver.UnixStreamServer.__init__(self, path, Handler)
+
+    def dispatch(self, message):
+        op = message.get('op') if isinstance(message, dict) else None
+        if op == 'stats':
+            return self.stats.report()
+        if op != 'assemble':
+            return {'error': "unknown request '" + str(op) + "'"}
+        try:
+            source = message['source']
+            options = dict(message.get('options') or {})
+            outputs = [(str(fmt), str(name))
+                       for fmt, name in message.get('outputs') or ()]
+        except (KeyError, TypeError, ValueError):
+            return {'error': "invalid assemble request"}
+        from lib import emitter
+        for fmt, _ in outputs:
+            if fmt not in emitter.FORMATS:
+                return {'error': emitter.unknown_format(fmt)}
+
+        self.stats.begin()
+        start = time.perf_counter()
+        status = None
+        try:
+            status, messages, data = self.pool.submit(
+                assemble_request, source, options, outputs).result()
+        except Exception as e:
+            return {'error': "internal error: " + repr(e)}
+        finally:
+            self.stats.end(time.perf_counter() - start, status)
+        return {
+            'status': status,
+            'messages': messages,
+            'outputs': [base64.b64encode(d).decode('ascii') for d in data]
+        }
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        self.pool.shutdown()
+
+
+def remove_stale_socket(path):
+    '''
+    Removes the socket file path left by a server that is not running
+    anymore.
+
+    returns: False if a server is listening on path.
+    '''
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return True
+    except FileNotFoundError:
+        return True
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+            return False
+        except OSError:
+            pass
+    os.unlink(path)
+    return True
+
+
+def serve(path, workers=None):
+    '''
+    Serves assemble requests on the Unix domain socket path until
+    interrupted, with workers worker processes, one per CPU if None.
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if not remove_stale_socket(path):
+        cp.cprint_fail("Error: A server is already listening on '" +
+                       path + "'")
+        return 1
+    try:
+        server = Server(path, workers)
+    except OSError as e:
+        cp.cprint_fail("Error: Could not listen on '" + path + "': " +
+                       str(e))
+        return 1
+    # Stop on SIGTERM as on SIGINT
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    cp.cprint_msg("Serving on " + path + " with " + str(workers) +
+                  " workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
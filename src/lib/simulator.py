@@ -0,0 +1,631 @@
+#
+# @author:Don Dennis
+# simulator.py
+#
+# Instruction set simulator of the RV32I subset of the assembler.
+#
+# Every word of the program is decoded once, with the tables of the
+# disassembler (disassembler.py), into a handler and its operands,
+# (handler, a, b, c), the operands being the fields of the format in
+# source order with their immediates already in the form the handler
+# uses. Running the program is a loop calling the handler of the
+# instruction at pc, which returns the next pc:
+#
+#     handler, a, b, c = code[pc >> 2]
+#     pc = handler(a, b, c, pc)
+#
+# The registers are a list of 32 unsigned 32 bit integers, $0 being
+# left at 0 by decoding the instructions writing it as the same
+# instruction without the write, or, for the jumps and loads, as the
+# instruction followed by clearing $0 again. Data memory is a bytearray.
+#
+# The program is in its own memory (the instruction memory of the
+# hardware the assembler targets, the examples keeping their stack at
+# address 0) unless unified, in which case it is also loaded at address
+# 0 of the data memory, and stores to it change the program.
+#
+# The program halts when an instruction jumps or branches to itself,
+# such as the HALT: jal $31, HALT idiom, after executing it once, or
+# before executing the instruction at one of the halt addresses. These
+# are decoded into handlers raising Halt, so that checking for them
+# costs nothing. The instructions are executed with the fields of the
+# words, whatever warnings their assembly printed.
+#
+#   >>> machine = Machine(Assembler().assemble(source).words)
+#   >>> machine.run()
+#   >>> machine.regs[29]
+
+import struct
+import sys
+import time
+from lib.cprint import cprint as cp
+from lib.disassembler import FORMAT_FIELDS, lookup, read_words
+from lib.machinecodeconst import MachineCodeConst
+
+mcc = MachineCodeConst()
+
+MASK = 0xFFFFFFFF
+SIGN = 0x80000000
+
+# Default size of the data memory in bytes
+MEMORY_SIZE = 1 << 20
+
+_WORD = struct.Struct('<I')
+_HALF = struct.Struct('<H')
+_SHALF = struct.Struct('<h')
+
+
+class SimulationError(Exception):
+    '''
+    Raised when the program cannot go on: illegal instruction, jump
+    out of the program, access out of the data memory.
+    '''
+    pass
+
+
+class Halt(Exception):
+    '''
+    Raised by the handlers of the halting instructions.
+
+    executed: whether the instruction at pc was executed
+    '''
+
+    def __init__(self, executed):
+        self.executed = executed
+
+
+def signed(value):
+    return (value ^ SIGN) - SIGN
+
+
+def build_handlers(regs, mem):
+    '''
+    returns: mnemonic -> handler of the instructions, on the registers
+    regs and the data memory mem
+    '''
+    def lui(a, b, c, pc):
+        regs[a] = b
+        return pc + 4
+
+    def auipc(a, b, c, pc):
+        regs[a] = (pc + b) & MASK
+        return pc + 4
+
+    def jal(a, b, c, pc):
+        regs[a] = pc + 4
+        return (pc + b) & MASK
+
+    def jalr(a, b, c, pc):
+        target = (regs[b] + c) & 0xFFFFFFFE
+        regs[a] = pc + 4
+        return target
+
+    def beq(a, b, c, pc):
+        return (pc + c) & MASK if regs[a] == regs[b] else pc + 4
+
+    def bne(a, b, c, pc):
+        return (pc + c) & MASK if regs[a] != regs[b] else pc + 4
+
+    def blt(a, b, c, pc):
+        if regs[a] ^ SIGN < regs[b] ^ SIGN:
+            return (pc + c) & MASK
+        return pc + 4
+
+    def bge(a, b, c, pc):
+        if regs[a] ^ SIGN >= regs[b] ^ SIGN:
+            return (pc + c) & MASK
+        return pc + 4
+
+    def bltu(a, b, c, pc):
+        return (pc + c) & MASK if regs[a] < regs[b] else pc + 4
+
+    def bgeu(a, b, c, pc):
+        return (pc + c) & MASK if regs[a] >= regs[b] else pc + 4
+
+    unpack_word = _WORD.unpack_from
+    unpack_half = _HALF.unpack_from
+    unpack_shalf = _SHALF.unpack_from
+    pack_word = _WORD.pack_into
+    pack_half = _HALF.pack_into
+
+    def lb(a, b, c, pc):
+        value = mem[(regs[b] + c) & MASK]
+        regs[a] = value - 0x100 & MASK if value & 0x80 else value
+        return pc + 4
+
+    def lh(a, b, c, pc):
+        regs[a] = unpack_shalf(mem, (regs[b] + c) & MASK)[0] & MASK
+        return pc + 4
+
+    def lw(a, b, c, pc):
+        regs[a] = unpack_word(mem, (regs[b] + c) & MASK)[0]
+        return pc + 4
+
+    def lbu(a, b, c, pc):
+        regs[a] = mem[(regs[b] + c) & MASK]
+        return pc + 4
+
+    def lhu(a, b, c, pc):
+        regs[a] = unpack_half(mem, (regs[b] + c) & MASK)[0]
+        return pc + 4
+
+    def sb(a, b, c, pc):
+        mem[(regs[a] + c) & MASK] = regs[b] & 0xFF
+        return pc + 4
+
+    def sh(a, b, c, pc):
+        pack_half(mem, (regs[a] + c) & MASK, regs[b] & 0xFFFF)
+        return pc + 4
+
+    def sw(a, b, c, pc):
+        pack_word(mem, (regs[a] + c) & MASK, regs[b])
+        return pc + 4
+
+    def addi(a, b, c, pc):
+        regs[a] = (regs[b] + c) & MASK
+        return pc + 4
+
+    def slti(a, b, c, pc):
+        regs[a] = int(regs[b] ^ SIGN < c)
+        return pc + 4
+
+    def sltiu(a, b, c, pc):
+        regs[a] = int(regs[b] < c)
+        return pc + 4
+
+    def xori(a, b, c, pc):
+        regs[a] = regs[b] ^ c
+        return pc + 4
+
+    def ori(a, b, c, pc):
+        regs[a] = regs[b] | c
+        return pc + 4
+
+    def andi(a, b, c, pc):
+        regs[a] = regs[b] & c
+        return pc + 4
+
+    def slli(a, b, c, pc):
+        regs[a] = regs[b] << c & MASK
+        return pc + 4
+
+    def srli(a, b, c, pc):
+        regs[a] = regs[b] >> c
+        return pc + 4
+
+    def srai(a, b, c, pc):
+        regs[a] = ((regs[b] ^ SIGN) - SIGN) >> c & MASK
+        return pc + 4
+
+    def add(a, b, c, pc):
+        regs[a] = (regs[b] + regs[c]) & MASK
+        return pc + 4
+
+    def sub(a, b, c, pc):
+        regs[a] = (regs[b] - regs[c]) & MASK
+        return pc + 4
+
+    def sll(a, b, c, pc):
+        regs[a] = regs[b] << (regs[c] & 0x1F) & MASK
+        return pc + 4
+
+    def slt(a, b, c, pc):
+        regs[a] = int(regs[b] ^ SIGN < regs[c] ^ SIGN)
+        return pc + 4
+
+    def sltu(a, b, c, pc):
+        regs[a] = int(regs[b] < regs[c])
+        return pc + 4
+
+    def xor(a, b, c, pc):
+        regs[a] = regs[b] ^ regs[c]
+        return pc + 4
+
+    def srl(a, b, c, pc):
+        regs[a] = regs[b] >> (regs[c] & 0x1F)
+        return pc + 4
+
+    def sra(a, b, c, pc):
+        regs[a] = ((regs[b] ^ SIGN) - SIGN) >> (regs[c] & 0x1F) & MASK
+        return pc + 4
+
+    def or_(a, b, c, pc):
+        regs[a] = regs[b] | regs[c]
+        return pc + 4
+
+    def and_(a, b, c, pc):
+        regs[a] = regs[b] & regs[c]
+        return pc + 4
+
+    handlers = dict(locals())
+    handlers['or'] = handlers.pop('or_')
+    handlers['and'] = handlers.pop('and_')
+    for name in ('regs', 'mem', 'unpack_word', 'unpack_half',
+                 'unpack_shalf', 'pack_word', 'pack_half'):
+        del handlers[name]
+    return handlers
+
+
+'''
+Operands
+--------
+The immediate of each instruction as its handler takes it, from the
+immediate of the source.
+'''
+IMMEDIATES = {
+    mcc.INSTR_LUI: lambda imm: imm << 12 & MASK,
+    mcc.INSTR_AUIPC: lambda imm: imm << 12 & MASK,
+    # Compared with a register flipped by SIGN
+    mcc.INSTR_SLTI: lambda imm: imm & MASK ^ SIGN,
+    mcc.INSTR_SLTIU: lambda imm: imm & MASK,
+    mcc.INSTR_XORI: lambda imm: imm & MASK,
+    mcc.INSTR_ORI: lambda imm: imm & MASK,
+    mcc.INSTR_ANDI: lambda imm: imm & MASK,
+    mcc.INSTR_SLLI: lambda imm: imm & 0x1F,
+    mcc.INSTR_SRLI: lambda imm: imm & 0x1F,
+    mcc.INSTR_SRAI: lambda imm: imm & 0x1F
+}
+
+# Formats writing rd
+WRITES_RD = frozenset([mcc.FMT_R, mcc.FMT_I, mcc.FMT_U, mcc.FMT_UJ])
+# Instructions changing pc, executed even without the write to $0
+JUMPS = frozenset([mcc.INSTR_JAL, mcc.INSTR_JALR])
+# Loads, accessing the memory even without the write to $0
+LOADS = frozenset(mnemonic for mnemonic, desc in mcc.INSTR_DESC.items()
+                  if desc.opcode == mcc.BOP_LOAD)
+
+
+def nop(a, b, c, pc):
+    return pc + 4
+
+
+def jump(a, b, c, pc):
+    '''
+    jal without the write to $0, b being the offset
+    '''
+    return (pc + b) & MASK
+
+
+def halt_after(a, b, c, pc):
+    '''
+    Jump to itself without the write to $0.
+    '''
+    raise Halt(True)
+
+
+class Machine:
+    '''
+    State of a simulated RV32I core.
+
+    words: the program, an array('I') such as a MemoryImage, loaded at
+        address 0
+    memory_size: size of the data memory in bytes
+    unified: the program is also in the data memory
+    halt_at: addresses before which the program halts
+
+    regs: the registers
+    memory: the data memory, a bytearray
+    pc: the address of the next instruction
+    steps: number of instructions executed
+    '''
+
+    def __init__(self, words, memory_size=MEMORY_SIZE, unified=False,
+                 halt_at=()):
+        self.regs = [0] * 32
+        self.memory = bytearray(memory_size)
+        self.pc = 0
+        self.steps = 0
+        self.words = words
+        self.unified = unified
+        self.handlers = build_handlers(self.regs, self.memory)
+        if unified:
+            if len(words) * 4 > memory_size:
+                raise ValueError("the program does not fit in the memory")
+            for i, word in enumerate(words):
+                _WORD.pack_into(self.memory, i * 4, word)
+            self.handlers.update(self.store_handlers())
+        self.halt_at = frozenset(halt_at)
+        self.code = [self.predecode(word, i * 4)
+                     for i, word in enumerate(words)]
+        # Register written by each instruction, 0 for none
+        self.dest = [self.destination(word) for word in words]
+
+    def store_handlers(self):
+        '''
+        returns: the handlers of the stores into the unified memory,
+        decoding the instructions they overwrite again.
+        '''
+        stores = {}
+        size = len(self.words) * 4
+        for mnemonic in (mcc.INSTR_SB, mcc.INSTR_SH, mcc.INSTR_SW):
+            def store(a, b, c, pc, store=self.handlers[mnemonic]):
+                address = (self.regs[a] + c) & MASK
+                next_pc = store(a, b, c, pc)
+                if address < size:
+                    self.reload(address)
+                return next_pc
+            stores[mnemonic] = store
+        return stores
+
+    def reload(self, address):
+        '''
+        Decodes again the instructions overwritten by a store at address.
+        '''
+        for i in range(address >> 2, min((address + 3 >> 2) + 1,
+                                         len(self.code))):
+            word = _WORD.unpack_from(self.memory, i * 4)[0]
+            self.code[i] = self.predecode(word, i * 4)
+            self.dest[i] = self.destination(word)
+
+    def illegal(self, a, b, c, pc):
+        raise SimulationError("Illegal instruction 0x%08X at address 0x%08X"
+                              % (a, pc))
+
+    def misaligned(self, a, b, c, pc):
+        '''
+        Taken branch or jump to an address that is not 4 bytes aligned,
+        a being the handler.
+        '''
+        target = a(b[0], b[1], b[2], pc)
+        if target & 3:
+            raise SimulationError("Jump to misaligned address 0x%08X at"
+                                  " address 0x%08X" % (target, pc))
+        return target
+
+    def halt_before(self, a, b, c, pc):
+        raise Halt(False)
+
+    def predecode(self, word, address):
+        '''
+        returns: the (handler, a, b, c) of the instruction word at address
+        '''
+        if address in self.halt_at:
+            return (self.halt_before, None, None, None)
+        entry = lookup(word)
+        if entry is None:
+            return (self.illegal, word, None, None)
+        mnemonic, desc = entry
+        operands = FORMAT_FIELDS[desc.fmt](word)
+        if mnemonic in IMMEDIATES:
+            operands = operands[:-1] + (IMMEDIATES[mnemonic](operands[-1]),)
+        a, b, c = (operands + (None,))[:3]
+        handler = self.handlers[mnemonic]
+        if desc.fmt in WRITES_RD and a == 0:
+            if mnemonic == mcc.INSTR_JAL:
+                handler = jump
+            elif mnemonic == mcc.INSTR_JALR or mnemonic in LOADS:
+                # Linking or loading into $0 undone after, the loads
+                # still accessing the memory, which may be out of range
+                def handler(a, b, c, pc, execute=handler, regs=self.regs):
+                    target = execute(a, b, c, pc)
+                    regs[0] = 0
+                    return target
+            else:
+                handler = nop
+        if desc.fmt in (mcc.FMT_SB, mcc.FMT_UJ):
+            offset = c if desc.fmt == mcc.FMT_SB else b
+            if offset == 0:
+                if handler is jump:
+                    handler = halt_after
+                else:
+                    handler = self.halting(handler)
+            elif offset & 3:
+                return (self.misaligned, handler, (a, b, c), None)
+        elif mnemonic == mcc.INSTR_JALR:
+            handler = self.checked(handler)
+        return (handler, a, b, c)
+
+    def halting(self, handler):
+        '''
+        returns: handler, halting when it jumps to itself
+        '''
+        def halt(a, b, c, pc):
+            target = handler(a, b, c, pc)
+            if target == pc:
+                raise Halt(True)
+            return target
+        return halt
+
+    def checked(self, handler):
+        '''
+        returns: the jalr handler, checking the alignment of the target
+        '''
+        def jalr(a, b, c, pc):
+            target = handler(a, b, c, pc)
+            if target & 3:
+                raise SimulationError("Jump to misaligned address 0x%08X"
+                                      " at address 0x%08X" % (target, pc))
+            return target
+        return jalr
+
+    def destination(self, word):
+        entry = lookup(word)
+        if entry is None or entry[1].fmt not in WRITES_RD:
+            return 0
+        return word >> 7 & 0x1F
+
+    def accessed(self, pc):
+        '''
+        returns: the address the load or store at pc accesses, its base
+        register plus its immediate
+        '''
+        _, a, b, c = self.code[pc >> 2]
+        if self.unified:
+            word = _WORD.unpack_from(self.memory, pc)[0]
+        else:
+            word = self.words[pc >> 2]
+        # The base register is rs1, the first operand of the stores
+        base = a if lookup(word)[1].fmt == mcc.FMT_S else b
+        return (self.regs[base] + c) & MASK
+
+    def run(self, max_steps=None, trace=None):
+        '''
+        Runs the program from pc until it halts, for at most max_steps
+        instructions if given. If trace is a text file, every write to
+        a register is written to it as 'ADDRESS $N = VALUE', in hex.
+
+        returns: 'halt', or 'limit' if max_steps instructions were
+        executed first
+
+        raises: SimulationError if the program cannot go on, pc and
+        steps being those of the faulting instruction
+        '''
+        limit = range(max_steps if max_steps is not None else 1 << 62)
+        code = self.code
+        pc = self.pc
+        steps = 0
+        try:
+            if trace is None:
+                for steps in limit:
+                    handler, a, b, c = code[pc >> 2]
+                    pc = handler(a, b, c, pc)
+            else:
+                regs = self.regs
+                dest = self.dest
+                write = trace.write
+                for steps in limit:
+                    handler, a, b, c = code[pc >> 2]
+                    next_pc = handler(a, b, c, pc)
+                    rd = dest[pc >> 2]
+                    if rd:
+                        write('%08X $%d = %08X\n' % (pc, rd, regs[rd]))
+                    pc = next_pc
+            steps += 1
+            reason = 'limit'
+        except Halt as halt:
+            if halt.executed:
+                steps += 1
+                rd = self.dest[pc >> 2]
+                if trace is not None and rd:
+                    trace.write('%08X $%d = %08X\n' % (pc, rd, self.regs[rd]))
+            reason = 'halt'
+        except (IndexError, struct.error) as e:
+            self.pc = pc
+            self.steps += steps
+            if pc >> 2 >= len(code):
+                raise SimulationError("Jump out of the program to address" +
+                                      " 0x%08X" % pc) from None
+            raise SimulationError("Memory access to address 0x%08X out of"
+                                  " range at address 0x%08X"
+                                  % (self.accessed(pc), pc)) from None
+        except SimulationError:
+            self.pc = pc
+            self.steps += steps
+            raise
+        if max_steps == 0:
+            steps = 0
+        self.pc = pc
+        self.steps += steps
+        return reason
+
+
+def load(infile, fmt=None, source=False):
+    '''
+    Reads the program of infile, - being the standard input: a program
+    written by the assembler in the format fmt, guessed if None, or its
+    assembly code if source.
+
+    returns: (words, symbols), symbols mapping the labels of the source
+    to their addresses, empty for a program
+
+    raises: ValueError if the program cannot be read
+    '''
+    fin = sys.stdin.buffer if infile == '-' else open(infile, 'rb')
+    try:
+        if not source:
+            return read_words(fin, fmt), {}
+        from lib.assembler import Assembler, AssemblyError
+        try:
+            result = Assembler().assemble(fin.read())
+        except AssemblyError as e:
+            raise ValueError(str(e)) from None
+        except UnicodeDecodeError:
+            raise ValueError("the source is not UTF-8 text") from None
+        return result.words, result.symbols
+    finally:
+        if fin is not sys.stdin.buffer:
+            fin.close()
+
+
+def halt_addresses(specs, symbols):
+    '''
+    returns: the addresses of specs, each an address or a label of
+    symbols
+
+    raises: ValueError if a spec is neither
+    '''
+    addresses = []
+    for spec in specs:
+        if spec in symbols:
+            addresses.append(symbols[spec])
+            continue
+        try:
+            addresses.append(int(spec, 0))
+        except ValueError:
+            raise ValueError("'" + spec + "' is neither an address nor" +
+                             " a label") from None
+    return addresses
+
+
+def simulate(infile, fmt=None, source=False, max_steps=None, halt_at=(),
+             memory_size=MEMORY_SIZE, unified=False, trace=None):
+    '''
+    Runs the program of infile (see load) and prints how it stopped and
+    its registers. halt_at are addresses or labels, and trace the file
+    the register writes are written to, - being the standard output.
+
+    returns: the exit status
+    '''
+    try:
+        words, symbols = load(infile, fmt, source)
+    except IOError:
+        cp.cprint_fail("Error: File does not seem to exist or" +
+                       " you do not have the required permissions.")
+        return 1
+    except ValueError as e:
+        cp.cprint_fail("Error: Invalid input: " + str(e) + ".")
+        return 1
+    try:
+        machine = Machine(words, memory_size, unified,
+                          halt_addresses(halt_at, symbols))
+    except ValueError as e:
+        cp.cprint_fail("Error: " + str(e) + ".")
+        return 1
+
+    fout = None
+    if trace == '-':
+        fout = sys.stdout
+    elif trace is not None:
+        try:
+            fout = open(trace, 'w')
+        except IOError:
+            cp.cprint_fail("Error: Could not create '" + trace +
+                           "' for output")
+            return 1
+    status = 0
+    start = time.perf_counter()
+    try:
+        reason = machine.run(max_steps, fout)
+    except SimulationError as e:
+        cp.cprint_fail("Error: " + str(e))
+        reason = 'error'
+        status = 1
+    finally:
+        elapsed = time.perf_counter() - start
+        if fout is sys.stdout:
+            fout.flush()
+        elif fout is not None:
+            fout.close()
+
+    if reason == 'halt':
+        cp.cprint_msg("Halted at address 0x%08X" % machine.pc)
+    elif reason == 'limit':
+        cp.cprint_warn("Warning: Stopped after " + str(max_steps) +
+                       " instructions at address 0x%08X" % machine.pc)
+    rate = machine.steps / elapsed if elapsed else 0
+    cp.cprint_msgb("%d instructions in %.3fs (%.0f instructions/s)"
+                   % (machine.steps, elapsed, rate))
+    for n, value in enumerate(machine.regs):
+        if value:
+            cp.cprint_msgb("$%-2d = 0x%08X  %d" % (n, value, signed(value)))
+    return status
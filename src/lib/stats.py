@@ -0,0 +1,314 @@
+#
+# @author:Don Dennis
+# stats.py
+#
+# Counters of an assembly: time spent in each phase, sizes of the
+# program and messages issued.
+#
+# The time of the run is split between the phases as it goes. The
+# assembler streams the source through generators (reading the lines,
+# parsing them, resolving the labels or encoding them as they come),
+# so the phases are interleaved: each level of the pipeline is wrapped
+# in a generator switching the current phase around every item it
+# pulls from the level below, and the time between two switches is
+# charged to the phase that was current. The phases are
+#
+#     read      reading the lines of the source
+#     parse     parsing them into records, in both passes of the two
+#               pass assembler
+#     labels    building the symbols table (pass one)
+#     encode    resolving the label offsets and encoding (pass two, or
+#               the single pass, where labels are resolved on the fly)
+#     write     writing the outputs, unless streamed while encoding
+#     other     everything else: options, opening files, imports
+#
+# Nothing is collected unless a Stats is installed as cp.stats, the
+# assembler only checking for one once per phase, not per line. When
+# collecting, each switch reads the wall and CPU clocks, which makes the
+# assembly about a third slower, and tracing the memory allocations
+# (tracemalloc) makes it several times slower: the times are best read
+# relative to each other.
+#
+#   >>> with stats.collect() as counters:
+#   ...     Assembler().assemble(source)
+#   >>> counters.as_dict()['phases']['encode']
+
+import contextlib
+import json
+import re
+import time
+import tracemalloc
+from collections import Counter
+from itertools import chain, islice
+from lib.cprint import cprint as cp
+
+PHASES = ('read', 'parse', 'labels', 'encode', 'write', 'other')
+
+# Lines read at a time from a file while timed
+READ_BATCH = 1024
+
+# Location of a message, 'Warning:12:', 'Error: 12 :' or
+# '32_Warning:12:', and the quoted names in it
+_LOCATION = re.compile(r'(?:32_)?(?:Warning|Error)\s*:\s*(?:\d+\s*:)?\s*')
+_QUOTED = re.compile(r"'[^']*'")
+
+
+def category(msg):
+    '''
+    returns: the category of the message msg, its text without its
+    location and with its quoted names replaced by '...'
+    '''
+    text = _QUOTED.sub("'...'", _LOCATION.sub('', msg, count=1))
+    if msg.startswith('32_'):
+        text = '32 bit: ' + text
+    return text.strip()
+
+
+class Stats:
+    '''
+    Counters of the assemblies run while installed as cp.stats, see
+    collect(). memory traces the peak of the memory allocated with
+    tracemalloc.
+    '''
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.wall = dict.fromkeys(PHASES, 0.0)
+        self.cpu = dict.fromkeys(PHASES, 0.0)
+        # pass name -> [wall, cpu] of the passes, phases included
+        self.passes = {}
+        self.current = 'other'
+        self.wall_mark = None
+        self.cpu_mark = None
+        self.started = None
+        self.total = None
+        # Number of the last line read, of records parsed in a pass,
+        # of instructions and of symbols
+        self.lines = 0
+        self.statements = 0
+        self.instructions = 0
+        self.symbols = 0
+        self.messages = {'warning': Counter(), 'error': Counter()}
+        self.memory_peak = None
+        self.tracing = False
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+        self.wall_mark = time.perf_counter()
+        self.cpu_mark = time.process_time()
+        self.started = (self.wall_mark, self.cpu_mark)
+
+    def stop(self):
+        self.switch(self.current)
+        self.total = (self.wall_mark - self.started[0],
+                      self.cpu_mark - self.started[1])
+        if self.memory and tracemalloc.is_tracing():
+            self.memory_peak = tracemalloc.get_traced_memory()[1]
+            if self.tracing:
+                tracemalloc.stop()
+                self.tracing = False
+
+    def switch(self, phase):
+        '''
+        Charges the time since the last switch to the current phase and
+        makes phase the current one.
+
+        returns: the phase that was current
+        '''
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        current = self.current
+        self.wall[current] += wall - self.wall_mark
+        self.cpu[current] += cpu - self.cpu_mark
+        self.wall_mark = wall
+        self.cpu_mark = cpu
+        self.current = phase
+        return current
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        previous = self.switch(phase)
+        try:
+            yield
+        finally:
+            self.switch(previous)
+
+    @contextlib.contextmanager
+    def span(self, name):
+        '''
+        Measures the pass name as a whole, whatever its phases.
+        '''
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            total = self.passes.setdefault(name, [0.0, 0.0])
+            total[0] += time.perf_counter() - wall
+            total[1] += time.process_time() - cpu
+
+    def timed(self, items, phase):
+        '''
+        Yields the items, the time spent getting each being charged to
+        phase.
+
+        returns: the number of items
+        '''
+        switch = self.switch
+        items = iter(items)
+        count = 0
+        while True:
+            previous = switch(phase)
+            try:
+                item = next(items)
+            except StopIteration:
+                return count
+            finally:
+                switch(previous)
+            count += 1
+            yield item
+
+    def records(self, records):
+        '''
+        Yields the records of a pass, timed as parsing.
+        '''
+        count = yield from self.timed(records, 'parse')
+        self.statements = max(self.statements, count)
+
+    def source(self, fin):
+        return TimedSource(fin, self)
+
+    def count(self, image, symbols_table, lines=0):
+        '''
+        Counts the instructions of image and the symbols of
+        symbols_table, and the lines of the source if not read through
+        source(). Without the image of a streamed program, its
+        instructions are the records parsed but the labels.
+        '''
+        self.lines = max(self.lines, lines)
+        if image is None:
+            self.instructions += self.statements - len(symbols_table)
+        else:
+            self.instructions += len(image)
+        self.symbols += len(symbols_table)
+
+    def message(self, kind, msg):
+        self.messages[kind][category(msg)] += 1
+
+    def as_dict(self):
+        '''
+        returns: the counters as a dict of numbers, strings and dicts,
+        times being in seconds and the memory peak in bytes
+        '''
+        total = self.total
+        if total is None and self.started is not None:
+            # Still running
+            total = (time.perf_counter() - self.started[0],
+                     time.process_time() - self.started[1])
+        return {
+            'wall': total and round(total[0], 6),
+            'cpu': total and round(total[1], 6),
+            'phases': dict((phase, {'wall': round(self.wall[phase], 6),
+                                    'cpu': round(self.cpu[phase], 6)})
+                           for phase in PHASES),
+            'passes': dict((name, {'wall': round(wall, 6),
+                                   'cpu': round(cpu, 6)})
+                           for name, (wall, cpu) in self.passes.items()),
+            'lines': self.lines,
+            'instructions': self.instructions,
+            'symbols': self.symbols,
+            'warnings': dict(self.messages['warning']),
+            'errors': dict(self.messages['error']),
+            'memory_peak': self.memory_peak
+        }
+
+
+class TimedSource:
+    '''
+    A source (see reader.py) whose reading is timed by stats.
+    '''
+
+    def __init__(self, source, stats):
+        self.source = source
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self.source, name)
+
+    def lines(self):
+        source = self.source.lines()
+        if self.source.rewindable:
+            # A file, whose lines can be read ahead without waiting for
+            # them: timed by batch rather than by line
+            batches = iter(lambda: list(islice(source, READ_BATCH)), [])
+            lines = chain.from_iterable(self.stats.timed(batches, 'read'))
+        else:
+            lines = self.stats.timed(source, 'read')
+        lineno = 0
+        for lineno, line in lines:
+            yield lineno, line
+        self.stats.lines = max(self.stats.lines, lineno)
+
+    def read(self):
+        with self.stats.phase('read'):
+            text = self.source.read()
+        lines = text.count('\n') + (text[-1:] not in ('', '\n'))
+        self.stats.lines = max(self.stats.lines, lines)
+        return text
+
+
+def read(fin):
+    '''
+    returns: the text of the source fin, its reading being timed when
+    collecting
+    '''
+    if cp.stats is None:
+        return fin.read()
+    return cp.stats.source(fin).read()
+
+
+def phase(name):
+    '''
+    returns: the context charging its time to the phase name, doing
+    nothing when not collecting
+    '''
+    if cp.stats is None:
+        return contextlib.nullcontext()
+    return cp.stats.phase(name)
+
+
+def span(name):
+    '''
+    returns: the context measuring the pass name, doing nothing when
+    not collecting
+    '''
+    if cp.stats is None:
+        return contextlib.nullcontext()
+    return cp.stats.span(name)
+
+
+@contextlib.contextmanager
+def collect(memory=True):
+    '''
+    Collects the counters of the assemblies run by this thread in the
+    context, which yields the Stats.
+    '''
+    stats = Stats(memory)
+    saved = cp.stats
+    cp.stats = stats
+    stats.start()
+    try:
+        yield stats
+    finally:
+        stats.stop()
+        cp.stats = saved
+
+
+def dump(stats, fout):
+    '''
+    Writes the counters of stats as JSON to the text file fout.
+    '''
+    json.dump(stats.as_dict(), fout, indent=2, sort_keys=True)
+    fout.write('\n')
@@ -0,0 +1,53 @@
+#
+# @author:Don Dennis
+# tables.py
+#
+# Generates the parser tables used by the assembler.
+#
+# This is meant to be run once at install time (and again whenever the
+# grammar changes) from the `src` directory:
+#
+#     python -m lib.tables
+#
+# The tables are written next to the parser modules in the `lib`
+# directory, which is the fixed location the parsers load them from.
+# At run time the parsers never write tables or debug output. The
+# modules of the `lib` directory, tables included, are byte-compiled
+# as well so that no launch has to compile them.
+
+import argparse
+import compileall
+import os
+import ply.yacc as yacc
+import lib.parser
+import lib.programparser
+
+TABLES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_tables(debug=False):
+    '''
+    Builds and writes the tables of the line parser and the whole-program
+    parser. If debug is set, the grammar and the LALR states are also
+    written to parser.out and programparser.out for inspection.
+    '''
+    yacc.yacc(module=lib.parser, debug=debug, write_tables=True,
+              outputdir=TABLES_DIR,
+              debugfile=os.path.join(TABLES_DIR, 'parser.out'))
+    yacc.yacc(module=lib.programparser, start='source',
+              tabmodule=lib.programparser.TABMODULE, debug=debug,
+              write_tables=True, outputdir=TABLES_DIR,
+              debugfile=os.path.join(TABLES_DIR, 'programparser.out'))
+    compileall.compile_dir(TABLES_DIR, quiet=1)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate the RVI parser tables.")
+    ap.add_argument('-d', '--debug', action="store_true",
+                    help="Also write the parser debug files.")
+    args = ap.parse_args()
+    build_tables(args.debug)
+
+
+if __name__ == '__main__':
+    main()
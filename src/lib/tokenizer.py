@@ -8,8 +8,10 @@
 # The assembler is build around `ply` and you can refer to
 # http://www.dabeaz.com/ply/ply.html
 # for its documentation.
+import threading
 import ply.lex as lex
 from lib.machinecodeconst import MachineCodeConst
+from lib.cprint import cprint as cp
 
 mcc = MachineCodeConst()
 # List of token names. This is always required
@@ -40,19 +42,15 @@ tok.type, tok.value, tok.lineno, and tok.lexpos.
 '''
 
 
-def t_OPCODE(t):
-    r'[a-zA-Z_][a-zA-Z_0-9]*'
-    if t.value in mcc.ALL_INSTR:
-        t.type = "OPCODE"
-        return t
-    return t_LABEL(t)
+# Opcodes are the reserved identifiers, every other identifier is a
+# label. A set keeps the lookup constant time for every identifier.
+OPCODES = frozenset(mcc.ALL_INSTR)
 
 
-def t_LABEL(t):
+def t_OPCODE(t):
     r'[a-zA-Z_][a-zA-Z_0-9]*'
-    if t.value in mcc.ALL_INSTR:
-        return t_OPCODE(t)
-    t.type = "LABEL"
+    if t.value not in OPCODES:
+        t.type = "LABEL"
     return t
 
 
@@ -82,16 +80,43 @@ def t_COMMENT(t):
 
 
 def t_error(t):
-    print("Illegal character '%s'" % t.value[0])
+    msg = "Illegal character '%s'" % t.value[0]
+    if cp.ordered is not None:
+        # Printed again with the messages of its line, as the two pass
+        # assembly does when it lexes the line again
+        cp.ordered.add(None, msg, 'message', at=t.lexer.lineno)
+        cp.ordered.add(None, msg, 'message', t.lexer.lineno)
+    else:
+        cp.cprint(msg)
     t.lexer.skip(1)
 
 
-# Build the lexer
-lexer = lex.lex()
+# The lexer is built on first use so that importing this module
+# stays cheap. A lexer keeps the position and line number of its
+# input, so each thread lexes with a clone of its own.
+lexer = None
+_lexer_lock = threading.Lock()
+_lexers = threading.local()
+
+
+def get_lexer():
+    '''
+    returns: the lexer of the calling thread
+    '''
+    try:
+        return _lexers.lexer
+    except AttributeError:
+        pass
+    global lexer
+    with _lexer_lock:
+        if lexer is None:
+            lexer = lex.lex()
+    _lexers.lexer = lexer.clone()
+    return _lexers.lexer
 
 
 def reset_lineno():
-    lexer.lineno = 1
+    get_lexer().lineno = 1
 
 
 if __name__ == '__main__':
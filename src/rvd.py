@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# @author:Don Dennis
+# rvd.py
+#
+# Disassembler of the programs written by the assembler.
+
+import argparse
+from rvi import VERSION
+
+
+def get_arguments():
+    descr = '''
+    RVD v''' + str(VERSION) + '''
+    - Disassembles the programs written by RVI back into
+    assembly code.
+    '''
+    ap = argparse.ArgumentParser(description=descr)
+    ap.add_argument("INFILE",
+                    help="Program to disassemble, - for the standard" +
+                    " input.")
+    ap.add_argument('-o', "--outfile", default='-',
+                    help="Output file name. Defaults to the standard" +
+                    " output.")
+    ap.add_argument('-f', "--format", choices=('memb', 'memh', 'bin'),
+                    help="Format of the program: memb (binary text, as" +
+                    " written by default), memh (hex text, as written" +
+                    " with -x) or bin (raw little endian). Guessed from" +
+                    " the first line by default.")
+    ap.add_argument('-nc', "--no-color", help="Turn off color output.",
+                    action="store_true")
+    ap.add_argument("-b", "--batch", action="store_true",
+                    help="Disassemble the whole program at once with" +
+                    " NumPy. Falls back to the regular disassembler if" +
+                    " NumPy is not installed.")
+    return ap.parse_args()
+
+
+def main():
+    args = get_arguments()
+    import sys
+    from lib.cprint import cprint as cp
+    from lib.disassembler import disassemble
+    if args.no_color:
+        cp.no_color = True
+    if args.outfile == '-':
+        # Keep the standard output for the program
+        cp.out = sys.stderr
+    return disassemble(args.INFILE, args.outfile, args.format, args.batch)
+
+
+if __name__ == '__main__':
+    exit(main())
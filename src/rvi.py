@@ -4,23 +4,31 @@
 #
 # The RISC-V assembler for subset of instructions.
 
-from lib.parser import parse_input
 import argparse
+import os
 
 
 VERSION = 0.1
 
 
-def get_arguments():
+def argument_parser():
+    '''
+    returns: the parser of the options shared by rvi.py and the
+    client of the assembler server, rvic.py.
+    '''
     descr = '''
     RVI v''' + str(VERSION) + '''
     - A simple RV32I assembler developed for testing
     RV32I targeted hardware designs.
     '''
     ap = argparse.ArgumentParser(description=descr)
-    ap.add_argument("INFILE", help="Input file containing assembly code.")
+    ap.add_argument("INFILE", nargs='*',
+                    help="Input file containing assembly code," +
+                    " - for the standard input. Several files or glob" +
+                    " patterns are assembled each into its own output.")
     ap.add_argument('-o', "--outfile",
-                    help="Output file name.", default = 'a.b')
+                    help="Output file name, - for the standard output." +
+                    " Defaults to a.b.")
     ap.add_argument('-e', "--echo", help="Echo converted code to console",
                     action="store_true")
     ap.add_argument('-nc', "--no-color", help="Turn off color output.",
@@ -35,15 +43,236 @@ def get_arguments():
                     " for debugging.")
     ap.add_argument("-es", "--echo-symbols", action="store_true",
                     help="Echo the symbols table.")
+    ap.add_argument("-s", "--single-pass", action="store_true",
+                    help="Assemble in a single pass, backpatching forward" +
+                    " label references.")
+    ap.add_argument("-w", "--whole-program", action="store_true",
+                    help="Parse the whole input with a single parser" +
+                    " invocation instead of line by line.")
+    ap.add_argument("--emit", action="append", metavar="FORMAT[:FILE]",
+                    help="Also write the program in FORMAT, one of bin" +
+                    " (raw little endian), ihex (Intel HEX), memh, memb" +
+                    " (Verilog $readmemh/$readmemb), c (C header) or elf" +
+                    " (ELF32 with symbols). FILE defaults to OUTFILE with" +
+                    " the extension of the format. Can be given several" +
+                    " times.")
+    ap.add_argument("-b", "--batch", action="store_true",
+                    help="Encode the whole program at once with NumPy." +
+                    " Falls back to the regular encoder if NumPy is" +
+                    " not installed.")
+    return ap
+
+
+def line_numbers(spec):
+    '''
+    returns: the list of line numbers of a LINES specification, such as
+    12,40-42
+    '''
+    linenos = []
+    try:
+        for part in spec.split(','):
+            first, _, last = part.partition('-')
+            first = int(first)
+            last = int(last) if last else first
+            if first < 1 or last < first:
+                raise ValueError(part)
+            linenos.extend(range(first, last + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid line numbers '" +
+                                         spec + "'")
+    return linenos
+
+
+def get_arguments():
+    ap = argument_parser()
+    ap.add_argument("-j", "--jobs", type=int, metavar="N",
+                    help="Assemble large input files, or several input" +
+                    " files, in N processes, 1 by default. With --serve," +
+                    " the number of workers, by default one per CPU.")
+    ap.add_argument("-m", "--manifest", metavar="FILE",
+                    help="Also assemble the files listed in FILE, one" +
+                    " per line.")
+    ap.add_argument("-d", "--outdir", metavar="DIR",
+                    help="With several input files, write the outputs" +
+                    " into DIR instead of next to their sources.")
+    ap.add_argument("--summary", metavar="FILE",
+                    help="With several input files, write the JSON" +
+                    " summary of the run to FILE instead of the" +
+                    " standard output.")
+    ap.add_argument("--cache", metavar="DIR",
+                    default=os.environ.get('RVI_CACHE'),
+                    help="Keep the assembled programs in the cache" +
+                    " directory DIR, by default $RVI_CACHE, and copy" +
+                    " them from there when the same source is" +
+                    " assembled again with the same options.")
+    ap.add_argument("--cache-size", metavar="MB", type=float,
+                    help="Size limit of the cache, 256 MB by default.")
+    ap.add_argument("--cache-stats", action="store_true",
+                    help="Print the hits, misses and bytes saved by the" +
+                    " cache as JSON.")
+    ap.add_argument("-i", "--incremental", nargs='?', const='',
+                    metavar="STATE",
+                    help="Only parse and encode again what changed since" +
+                    " the previous assembly, kept in the file STATE," +
+                    " by default OUTFILE with the extension .rvs.")
+    ap.add_argument("--index", nargs='?', const='', metavar="INDEX",
+                    help="Also write the address index used by --patch" +
+                    " to the file INDEX, by default OUTFILE with the" +
+                    " extension .rvx.")
+    ap.add_argument("-p", "--patch", metavar="LINES", type=line_numbers,
+                    help="Only encode again the source lines LINES, such" +
+                    " as 12,40-42, edited since the program was" +
+                    " assembled with --index, and rewrite their words" +
+                    " in place in the outputs.")
+    ap.add_argument("--parse-memo", metavar="N", type=int,
+                    help="Keep the last N distinct lines parsed, such as" +
+                    " 4096, and parse the lines seen again only once." +
+                    " Only faster on programs repeating many lines," +
+                    " none by default.")
+    ap.add_argument("--encode-memo", metavar="N", type=int,
+                    help="Keep the last N distinct instructions encoded," +
+                    " none by default.")
+    ap.add_argument("--memo-stats", action="store_true",
+                    help="Print the hits and misses of the parse and" +
+                    " encode caches as JSON.")
+    ap.add_argument("--stats", nargs='?', const='-', metavar="FILE",
+                    help="Write the time spent in each phase of the" +
+                    " assembly, the sizes of the program, the warnings" +
+                    " by category and the peak of the memory allocated" +
+                    " as JSON to FILE, by default the standard output.")
+    ap.add_argument("--no-memory-stats", action="store_true",
+                    help="Leave the memory peak out of --stats: tracing" +
+                    " the memory allocations makes the assembly several" +
+                    " times slower.")
+    ap.add_argument("--profile", metavar="FILE",
+                    help="Profile the whole run with cProfile and write" +
+                    " the profile to FILE, to be read with pstats.")
+    ap.add_argument("--serve", metavar="SOCKET",
+                    help="Run as a server assembling the requests of" +
+                    " rvic.py on the Unix domain socket SOCKET.")
     args = ap.parse_args()
+    if args.jobs is not None and args.jobs < 1:
+        ap.error("--jobs must be at least 1")
+    if args.serve is not None:
+        # The server has one worker per CPU unless told otherwise
+        return args
+    if args.jobs is None:
+        args.jobs = 1
+    if args.cache_stats and args.cache is None:
+        ap.error("--cache-stats requires --cache DIR")
+    if args.cache_stats and not args.INFILE and args.manifest is None:
+        return args
+    if not args.INFILE and args.manifest is None:
+        ap.error("the following arguments are required: INFILE")
+    if args.index is not None or args.patch is not None:
+        if args.incremental is not None or args.cache_stats:
+            ap.error("--index and --patch cannot be used with -i or" +
+                     " --cache-stats")
+        # Copies from the cache have no index
+        args.cache = None
+        if many_files(args):
+            ap.error("--index and --patch take a single input file")
+    if args.stats is not None and many_files(args):
+        ap.error("--stats takes a single input file")
+    if args.no_memory_stats and args.stats is None:
+        ap.error("--no-memory-stats requires --stats")
     return args
 
 
+def many_files(args):
+    '''
+    Whether the run assembles several files rather than one.
+    '''
+    from glob import has_magic
+    return (len(args.INFILE) > 1 or args.manifest is not None or
+            args.outdir is not None or args.summary is not None or
+            any(has_magic(infile) for infile in args.INFILE))
+
+
 def main():
     args = get_arguments()
-    infile = args.INFILE
+    if args.profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(run, args)
+        finally:
+            profiler.dump_stats(args.profile)
+    return run(args)
+
+
+def run(args):
+    if args.stats is not None:
+        status = assemble_with_stats(args)
+    else:
+        status = assemble(args)
+    if args.cache_stats:
+        from lib import cache
+        status = cache.print_stats(vars(args)) or status
+    if args.memo_stats:
+        from lib import memo
+        memo.print_stats()
+    return status
+
+
+def assemble_with_stats(args):
+    '''
+    Assembles, then writes the counters of the assembly, also when it
+    fails.
+    '''
+    import sys
+    from lib import stats
+    from lib.cprint import cprint as cp
+    counters = None
+    try:
+        with stats.collect(not args.no_memory_stats) as counters:
+            return assemble(args)
+    finally:
+        if counters is not None:
+            if args.stats == '-':
+                stats.dump(counters, cp.out or sys.stdout)
+            else:
+                try:
+                    with open(args.stats, 'w') as fout:
+                        stats.dump(counters, fout)
+                except IOError:
+                    cp.cprint_fail("Error: Could not create '" +
+                                   args.stats + "' for output")
+
+
+def assemble(args):
+    # Imported only once the arguments are known to be valid, so that
+    # `--help` and usage errors do not pay for loading the parser.
+    from lib import memo
+    memo.configure(args.parse_memo, args.encode_memo)
+    if args.serve is not None:
+        from lib import server
+        return server.serve(args.serve, args.jobs)
+    if not args.INFILE and args.manifest is None:
+        # Only the cache statistics were asked for
+        return None
+    if many_files(args):
+        if args.outfile is not None:
+            exit("Error: -o cannot be used with several input files," +
+                 " use -d to choose the output directory.")
+        from lib import multifile
+        infiles = multifile.expand(args.INFILE)
+        if args.manifest is not None:
+            try:
+                infiles += multifile.read_manifest(args.manifest)
+            except IOError:
+                exit("Error: Could not read the manifest '" +
+                     args.manifest + "'")
+        return multifile.assemble_many(infiles, **vars(args))
+    from lib.parser import parse_input
+    if args.outfile is None:
+        args.outfile = 'a.b'
+    infile = args.INFILE[0]
+    if args.patch is not None:
+        from lib import patch
+        return patch.patch(infile, **vars(args))
     return parse_input(infile, **vars(args))
 
 
 if __name__ == '__main__':
-    main()
+    exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# @author:Don Dennis
+# rvic.py
+#
+# Client of the assembler server (`rvi.py --serve SOCKET`).
+#
+# Takes the same options as rvi.py for a single input file and writes
+# the same outputs and messages, the program being assembled by the
+# server listening on the socket given with --socket or in the
+# RVI_SOCKET environment variable.
+
+import base64
+import os
+import sys
+from rvi import argument_parser
+from lib import emitter
+from lib.client import OPTIONS, request
+from lib.cprint import cprint as cp
+
+DEFAULT_SOCKET = '/tmp/rvi.sock'
+
+
+def get_arguments():
+    ap = argument_parser()
+    ap.add_argument("--socket", metavar="SOCKET",
+                    default=os.environ.get('RVI_SOCKET', DEFAULT_SOCKET),
+                    help="Unix domain socket of the server, by default" +
+                    " $RVI_SOCKET or " + DEFAULT_SOCKET + ".")
+    ap.add_argument("--stats", action="store_true",
+                    help="Print the statistics of the server instead of" +
+                    " assembling.")
+    args = ap.parse_args()
+    if not args.stats and len(args.INFILE) != 1:
+        ap.error("exactly one INFILE is required")
+    return args
+
+
+def server_error(args, msg):
+    cp.cprint_fail("Error: Assembler server on '" + args.socket + "': " +
+                   msg)
+    return 1
+
+
+def print_stats(args):
+    import json
+    try:
+        stats = request(args.socket, {'op': 'stats'})
+    except OSError as e:
+        return server_error(args, str(e))
+    print(json.dumps(stats, indent=2))
+
+
+def assemble(args):
+    infile = args.INFILE[0]
+    outfile = args.outfile or 'a.b'
+    if args.no_color:
+        cp.no_color = True
+    if outfile == '-':
+        # Keep the standard output for the program
+        cp.out = sys.stderr
+    try:
+        if infile == '-':
+            source = sys.stdin.read()
+        else:
+            with open(infile, 'r') as fin:
+                source = fin.read()
+    except IOError:
+        cp.cprint_fail("Error: File does not seem to exist or" +
+                       " you do not have the required permissions.")
+        return 1
+    try:
+        outputs = emitter.outputs(outfile, args.hex, args.emit)
+    except ValueError as e:
+        cp.cprint_fail(emitter.unknown_format(str(e)))
+        return 1
+
+    options = dict((key, getattr(args, key)) for key in OPTIONS)
+    try:
+        response = request(args.socket, {
+            'op': 'assemble',
+            'source': source,
+            'options': options,
+            'outputs': outputs})
+    except OSError as e:
+        return server_error(args, str(e))
+    if 'error' in response:
+        return server_error(args, response['error'])
+
+    if response['messages']:
+        print(response['messages'], end='', file=cp.out)
+    for (fmt, filename), data in zip(outputs, response['outputs']):
+        data = base64.b64decode(data)
+        if filename == '-':
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+            continue
+        try:
+            with open(filename, 'wb') as fout:
+                fout.write(data)
+        except IOError:
+            cp.cprint_fail("Error: Could not create '" + filename +
+                           "' for output")
+            return 1
+    return response['status'] or None
+
+
+def main():
+    args = get_arguments()
+    if args.stats:
+        return print_stats(args)
+    return assemble(args)
+
+
+if __name__ == '__main__':
+    exit(main())
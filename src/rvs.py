@@ -0,0 +1,65 @@
+#!/usr/bin/python
+# @author:Don Dennis
+# rvs.py
+#
+# Simulator of the programs written by the assembler.
+
+import argparse
+from rvi import VERSION
+
+
+def get_arguments():
+    descr = '''
+    RVS v''' + str(VERSION) + '''
+    - Runs the programs written by RVI on a simulated RV32I
+    core and prints its registers when they halt.
+    '''
+    ap = argparse.ArgumentParser(description=descr)
+    ap.add_argument("INFILE",
+                    help="Program to run, - for the standard input.")
+    ap.add_argument('-f', "--format", choices=('memb', 'memh', 'bin'),
+                    help="Format of the program: memb (binary text, as" +
+                    " written by default), memh (hex text, as written" +
+                    " with -x) or bin (raw little endian). Guessed from" +
+                    " the first line by default.")
+    ap.add_argument('-s', "--source", action="store_true",
+                    help="INFILE is assembly code, assembled in memory" +
+                    " before running it.")
+    ap.add_argument('-n', "--max-steps", type=int, metavar="N",
+                    help="Stop after N instructions.")
+    ap.add_argument("--halt-at", action="append", default=[],
+                    metavar="ADDRESS",
+                    help="Halt before executing the instruction at" +
+                    " ADDRESS, or at a label with -s. Can be repeated." +
+                    " Programs also halt at instructions jumping to" +
+                    " themselves.")
+    ap.add_argument('-m', "--memory", type=int, metavar="BYTES",
+                    help="Size of the data memory. Defaults to 1 MiB.")
+    ap.add_argument("--unified", action="store_true",
+                    help="Load the program at address 0 of the data" +
+                    " memory as well, where it can be read and changed.")
+    ap.add_argument('-t', "--trace", metavar="FILE",
+                    help="Write every register write to FILE, - for the" +
+                    " standard output.")
+    ap.add_argument('-nc', "--no-color", help="Turn off color output.",
+                    action="store_true")
+    return ap.parse_args()
+
+
+def main():
+    args = get_arguments()
+    import sys
+    from lib.cprint import cprint as cp
+    from lib.simulator import MEMORY_SIZE, simulate
+    if args.no_color:
+        cp.no_color = True
+    if args.trace == '-':
+        # Keep the standard output for the trace
+        cp.out = sys.stderr
+    memory = args.memory if args.memory is not None else MEMORY_SIZE
+    return simulate(args.INFILE, args.format, args.source, args.max_steps,
+                    args.halt_at, memory, args.unified, args.trace)
+
+
+if __name__ == '__main__':
+    exit(main())
@@ -0,0 +1,145 @@
+#
+# @author:Don Dennis
+# common.py
+#
+# Helpers shared by the tests: running the command line tools, the
+# paths of the sources and of the examples, and a generator of programs.
+# Importing it also makes the modules of src/lib importable as lib.*.
+
+import os
+import subprocess
+import sys
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(TESTS, os.pardir, 'src')
+EXAMPLES = os.path.join(TESTS, os.pardir, 'examples')
+
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
+
+
+def examples():
+    '''
+    returns: the paths of the example programs, sorted
+    '''
+    return [os.path.join(EXAMPLES, name)
+            for name in sorted(os.listdir(EXAMPLES))
+            if name.endswith('.rvi')]
+
+
+def run(tool, *args, stdin=None, cwd=None):
+    '''
+    returns: (exit status, standard output, standard error) of the
+    command line tool, such as 'rvi.py', given the bytes stdin and run
+    in the directory cwd
+    '''
+    run = subprocess.run([sys.executable, os.path.abspath(
+        os.path.join(SRC, tool))] + list(args), input=stdin, cwd=cwd,
+        capture_output=True)
+    return run.returncode, run.stdout, run.stderr
+
+
+def rvi(*args, stdin=None, cwd=None):
+    '''
+    returns: (exit status, standard output, standard error) of rvi.py
+    '''
+    return run('rvi.py', *args, stdin=stdin, cwd=cwd)
+
+
+class Program:
+    '''
+    Source lines of a program of labels L0, L1, ... and instructions
+    referring to them, some of which print warnings when encoded.
+    '''
+
+    def __init__(self, rnd, lines=600):
+        self.rnd = rnd
+        self.count = 0
+        self.referred = set()
+        self.lines = []
+        for _ in range(lines):
+            if rnd.random() < 0.05:
+                self.lines.append(self.new_label() + ':')
+            else:
+                self.lines.append(self.instruction())
+        # Every label referred to is declared, the ones referred to
+        # before being declared at the end
+        self.lines.extend('L%d:' % i for i in sorted(self.referred)
+                          if i >= self.count)
+        self.count = max([self.count] + [i + 1 for i in self.referred])
+
+    def new_label(self):
+        self.count += 1
+        return 'L%d' % (self.count - 1)
+
+    def label(self):
+        # Backward or forward
+        label = self.rnd.randrange(self.count + 10)
+        self.referred.add(label)
+        return 'L%d' % label
+
+    def instruction(self):
+        rnd = self.rnd
+        r = lambda: rnd.randrange(32)
+        kind = rnd.randrange(7)
+        if kind == 0:
+            # Out of range now and then
+            return '\taddi $%d, $%d, %d' % (r(), r(),
+                                             rnd.randint(-2100, 2100))
+        if kind == 1:
+            return '\tadd $%d, $%d, $%d' % (r(), r(), r())
+        if kind == 2:
+            # Misaligned now and then
+            return '\tlw $%d, $%d, %d' % (r(), r(), rnd.randrange(-64, 64))
+        if kind == 3:
+            return '\tsw $%d, $%d, %d' % (r(), r(), 4 * rnd.randrange(16))
+        if kind == 4:
+            return '\tbeq $%d, $%d, %s' % (r(), r(), self.label())
+        if kind == 5:
+            return '\tjal $%d, %s' % (r(), self.label())
+        return '\tlui $%d, %d' % (r(), rnd.randrange(1 << 19))
+
+    def text(self):
+        return ''.join(line + '\n' for line in self.lines)
+
+    def edit(self):
+        '''
+        Applies a random edit.
+
+        returns: the name of the edit
+        '''
+        rnd = self.rnd
+        lines = self.lines
+        at = rnd.randrange(len(lines))
+        name = rnd.choice(['immediate', 'insert', 'delete', 'add_label',
+                           'delete_label', 'duplicate_label',
+                           'undefined_label', 'syntax_error',
+                           'illegal_character', 'replace'])
+        if name == 'immediate':
+            for i in range(at, len(lines)):
+                if lines[i].startswith(('\taddi', '\tlw', '\tsw')):
+                    head, _, _ = lines[i].rpartition(',')
+                    lines[i] = head + ', %d' % rnd.randint(-2100, 2100)
+                    break
+        elif name == 'insert':
+            lines.insert(at, self.instruction())
+        elif name == 'delete':
+            del lines[at]
+        elif name == 'add_label':
+            lines.insert(at, self.new_label() + ':')
+        elif name == 'delete_label':
+            labels = [i for i, line in enumerate(lines)
+                      if line.endswith(':')]
+            if labels:
+                del lines[rnd.choice(labels)]
+        elif name == 'duplicate_label':
+            lines.insert(at, self.label() + ':')
+        elif name == 'undefined_label':
+            lines.insert(at, '\tjal $1, NOWHERE%d' % at)
+        elif name == 'syntax_error':
+            lines.insert(at, '\taddi $1, $2,, 3')
+        elif name == 'illegal_character':
+            lines.insert(at, '\tadd $1, $2, $3 @')
+        else:
+            lines[at] = self.instruction()
+        return name
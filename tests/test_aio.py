@@ -0,0 +1,216 @@
+#
+# @author:Don Dennis
+# test_aio.py
+#
+# The asyncio interface (aio.py) with threads and processes: assembled
+# files and streams against rvi.py, failed assemblies, and cancelled
+# assemblies and abandoned streams, which must stop their assembly and
+# keep their turn until their worker is done with it.
+#
+#     python -m unittest discover tests
+
+import asyncio
+import os
+import pickle
+import random
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from common import Program, examples, rvi
+from lib import aio
+from lib.assembler import AssemblyError, read_messages
+
+EXECUTORS = ('thread', 'process')
+
+# Time allowed to the workers to get going or to stop, in seconds
+TIMEOUT = 60
+
+
+def gated_run(gate, started):
+    '''
+    returns: a stand-in for aio.run, writing a line to its output and
+    then waiting for the Event gate, whatever its cancel Event says,
+    started being set once it runs
+    '''
+    def run(infile, outfile, args, cancel=None):
+        started.set()
+        with open(outfile, 'wb') as fout:
+            fout.write(b'00000000\n')
+            fout.flush()
+            gate.wait(TIMEOUT)
+        return {'status': 'ok', 'messages': ''}
+    return run
+
+
+async def wait_for(condition):
+    for _ in range(TIMEOUT * 100):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError('timed out')
+
+
+class AioTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as fin:
+            return fin.read()
+
+    def large(self):
+        '''
+        returns: the path of a program taking seconds to assemble
+        '''
+        source = self.path('large.rvi')
+        if not os.path.exists(source):
+            with open(source, 'w') as fout:
+                fout.write(Program(random.Random(7), lines=150000).text())
+        return source
+
+    async def test_assemble(self):
+        for executor in EXECUTORS:
+            async with aio.AsyncAssembler(executor, workers=2) as asm:
+                for source in examples():
+                    with self.subTest(executor=executor, source=source):
+                        expected = rvi(source, '-o', self.path('rvi.x'),
+                                       '-x', '-nc')
+                        entry = await asm.assemble(source, self.path('aio.x'),
+                                                   hex=True)
+                        self.assertEqual(entry['status'], 'ok')
+                        self.assertEqual(self.read('aio.x'),
+                                         self.read('rvi.x'))
+                        self.assertEqual(entry['messages'],
+                                         read_messages(expected[1].decode()))
+
+    async def test_failure(self):
+        source = self.path('bad.rvi')
+        with open(source, 'w') as fout:
+            fout.write('\tjal $1, NOWHERE\n')
+        for executor in EXECUTORS:
+            async with aio.AsyncAssembler(executor, workers=1) as asm:
+                with self.subTest(executor=executor):
+                    with self.assertRaises(AssemblyError) as caught:
+                        await asm.assemble(source, self.path('bad.b'))
+                    self.assertEqual(caught.exception.diagnostics[0].lineno,
+                                     1)
+                    self.assertFalse(os.path.exists(self.path('bad.b')))
+
+    async def test_stream(self):
+        source = self.path('prog.rvi')
+        with open(source, 'w') as fout:
+            fout.write(Program(random.Random(3), lines=20000).text())
+        rvi(source, '-o', self.path('rvi.b'))
+        for executor in EXECUTORS:
+            async with aio.AsyncAssembler(executor, workers=2) as asm:
+                with self.subTest(executor=executor):
+                    chunks = [chunk async for chunk in asm.stream(source)]
+                    self.assertGreater(len(chunks), 1)
+                    self.assertEqual(b''.join(chunks), self.read('rvi.b'))
+
+    async def test_cancel_stops_assembly(self):
+        # In a process too, where the assembly is stopped by a flag
+        for executor in EXECUTORS:
+            async with aio.AsyncAssembler(executor, workers=1) as asm:
+                with self.subTest(executor=executor):
+                    assembly = await asm.submit(
+                        self.large(), self.path('large.b'),
+                        asm.arguments({}))
+                    await wait_for(assembly.task.running)
+                    await asyncio.sleep(0.5)
+                    assembly.stop()
+                    entry = await asyncio.wait_for(assembly.future, TIMEOUT)
+                    self.assertEqual(entry['status'], 'failed')
+                    self.assertFalse(os.path.exists(self.path('large.b')))
+                    # Its turn has been given back
+                    await wait_for(lambda: not asm.semaphore().locked())
+                    entry = await asm.assemble(examples()[0],
+                                               self.path('next.b'))
+                    self.assertEqual(entry['status'], 'ok')
+
+    def test_cancel_flag(self):
+        flag = aio.CancelFlag()
+        try:
+            copy = pickle.loads(pickle.dumps(flag))
+            copy.open()
+            self.assertFalse(copy.is_set())
+            flag.set()
+            self.assertTrue(copy.is_set())
+            copy.close()
+        finally:
+            flag.remove()
+        self.assertFalse(os.path.exists(flag.path))
+
+    async def test_cancelled_keeps_turn(self):
+        gate = threading.Event()
+        started = threading.Event()
+        with mock.patch.object(aio, 'run', gated_run(gate, started)):
+            async with aio.AsyncAssembler('thread', workers=2,
+                                          limit=1) as asm:
+                task = asyncio.ensure_future(
+                    asm.assemble(examples()[0], self.path('a.b')))
+                await wait_for(started.is_set)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+                # The worker still runs
+                await asyncio.sleep(0.1)
+                self.assertTrue(asm.semaphore().locked())
+                gate.set()
+                await wait_for(lambda: not asm.semaphore().locked())
+
+    async def test_abandoned_stream_keeps_turn(self):
+        gate = threading.Event()
+        started = threading.Event()
+        with mock.patch.object(aio, 'run', gated_run(gate, started)):
+            async with aio.AsyncAssembler('thread', workers=2,
+                                          limit=1) as asm:
+                stream = asm.stream(examples()[0])
+                self.assertEqual(await stream.__anext__(), b'00000000\n')
+                await stream.aclose()
+                await asyncio.sleep(0.1)
+                self.assertTrue(asm.semaphore().locked())
+                self.assertEqual(len(asm.discarding), 1)
+                gate.set()
+                await wait_for(lambda: not asm.semaphore().locked())
+                await wait_for(lambda: not asm.discarding)
+
+    async def test_limit(self):
+        # No more than limit assemblies run at once
+        running = []
+        most = []
+        lock = threading.Lock()
+
+        def counting_run(infile, outfile, args, cancel=None):
+            with lock:
+                running.append(infile)
+                most.append(len(running))
+            try:
+                # Long enough for the assemblies to overlap
+                time.sleep(0.05)
+                return real_run(infile, outfile, args, cancel)
+            finally:
+                with lock:
+                    running.remove(infile)
+
+        real_run = aio.run
+        with mock.patch.object(aio, 'run', counting_run):
+            async with aio.AsyncAssembler('thread', workers=4,
+                                          limit=2) as asm:
+                await asyncio.gather(*[
+                    asm.assemble(source, self.path('%d.b' % i))
+                    for i, source in enumerate(examples() * 3)])
+        self.assertEqual(max(most), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
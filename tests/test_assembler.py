@@ -0,0 +1,119 @@
+#
+# @author:Don Dennis
+# test_assembler.py
+#
+# The in-memory interface (assembler.py) against rvi.py: the words,
+# symbols and diagnostics of the examples and of generated programs,
+# failed assemblies, the options, and assemblies run by several threads
+# at once.
+#
+#     python -m unittest discover tests
+
+import os
+import random
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from common import Program, examples, rvi
+from lib.assembler import Assembler, AssemblyError, read_messages
+
+
+def sources():
+    '''
+    returns: the examples and generated programs, as (name, text)
+    '''
+    programs = []
+    for path in examples():
+        with open(path) as fin:
+            programs.append((os.path.basename(path), fin.read()))
+    for seed in range(3):
+        program = Program(random.Random(seed), lines=500)
+        programs.append(('generated %d' % seed, program.text()))
+    return programs
+
+
+class AssemblerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.sources = sources()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def expected(self, text, *flags):
+        '''
+        returns: (exit status, words, Diagnostic list) of rvi.py
+        assembling text
+        '''
+        source = os.path.join(self.tmp.name, 'prog.rvi')
+        output = os.path.join(self.tmp.name, 'prog.x')
+        with open(source, 'w') as fout:
+            fout.write(text)
+        rc, out, _ = rvi(source, '-o', output, '-x', '-nc', *flags)
+        words = None
+        if rc == 0:
+            with open(output) as fin:
+                words = [int(line, 16) for line in fin]
+        return rc, words, read_messages(out.decode())
+
+    def test_against_rvi(self):
+        for name, text in self.sources:
+            with self.subTest(name):
+                _, words, diagnostics = self.expected(text)
+                result = Assembler().assemble(text)
+                self.assertEqual(list(result.words), words)
+                self.assertEqual(result.diagnostics, diagnostics)
+                # Given as bytes
+                self.assertEqual(Assembler().assemble(text.encode()),
+                                 result)
+
+    def test_symbols(self):
+        result = Assembler().assemble('L:\naddi $1, $0, 5\nM:\njal $0, L\n')
+        self.assertEqual(result.symbols, {'L': 0, 'M': 4})
+        self.assertEqual(list(result.words), [5243027, 4292866159])
+
+    def test_errors(self):
+        for text in ('\tjal $1, NOWHERE\n', 'L:\nL:\n',
+                     'add $1, $2, $40\n'):
+            with self.subTest(text=text):
+                _, _, diagnostics = self.expected(text)
+                with self.assertRaises(AssemblyError) as caught:
+                    Assembler().assemble(text)
+                self.assertEqual(caught.exception.diagnostics, diagnostics)
+                error = caught.exception.diagnostics[0]
+                self.assertEqual(error.severity, 'error')
+                self.assertEqual(str(caught.exception), 'Line %d: %s' %
+                                 (error.lineno, error.message))
+
+    def test_options(self):
+        name, text = self.sources[0]
+        for flag, option in (('-n32', 'no_32'), ('-s', 'single_pass'),
+                             ('-w', 'whole_program'), ('-b', 'batch')):
+            with self.subTest(option):
+                _, words, diagnostics = self.expected(text, flag)
+                for assembler, options in (
+                        (Assembler(**{option: True}), {}),
+                        (Assembler(), {option: True})):
+                    result = assembler.assemble(text, **options)
+                    self.assertEqual(list(result.words), words)
+                    self.assertEqual(result.diagnostics, diagnostics)
+        with self.assertRaises(TypeError):
+            Assembler(hex=True)
+        with self.assertRaises(TypeError):
+            Assembler().assemble(text, echo=True)
+
+    def test_threads(self):
+        assembler = Assembler()
+        expected = [assembler.assemble(text) for _, text in self.sources]
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(lambda source: assembler.assemble(
+                source[1]), self.sources * 4))
+        self.assertEqual(results, expected * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#
+# @author:Don Dennis
+# test_cache.py
+#
+# The cache of assembled programs (--cache, cache.py): hits and misses
+# counted in its statistics, the keys of the assemblies, and the
+# messages and outputs of a hit against those of a fresh build.
+#
+#     python -m unittest discover tests
+
+import os
+import shutil
+import tempfile
+import unittest
+from common import examples, rvi
+from lib import cache
+from lib.client import OPTIONS
+
+SOURCE = examples()[0]
+
+# Options the messages and outputs of a hit are compared with
+FLAGS = ([], ['-nc'], ['-e'], ['-es', '-nc'], ['-x', '-n32'])
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.tmp.name, 'cache')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as fin:
+            return fin.read()
+
+    def cached(self, source, *flags):
+        return rvi(source, '-o', self.path('cached.b'), '--cache',
+                   self.cache, *flags)
+
+    def stats(self):
+        return cache.Cache(self.cache).stats()
+
+    def test_hit_counted(self):
+        self.assertEqual(self.cached(SOURCE)[0], 0)
+        self.assertEqual(self.cached(SOURCE)[0], 0)
+        stats = self.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']),
+                         (1, 1, 1))
+        self.assertEqual(stats['bytes_saved'], len(self.read('cached.b')))
+
+    def test_options_and_source_change_key(self):
+        with open(SOURCE, 'rb') as fin:
+            data = fin.read()
+        outputs = [('memb', 'a.b')]
+        key = cache.cache_key(data, outputs, {})
+        self.assertEqual(cache.cache_key(data, outputs, {}), key)
+        keys = set()
+        for option in OPTIONS:
+            keys.add(cache.cache_key(data, outputs, {option: True}))
+        self.assertEqual(len(keys), len(OPTIONS))
+        self.assertNotIn(key, keys)
+        self.assertNotEqual(cache.cache_key(data + b'\n', outputs, {}), key)
+        self.assertNotEqual(cache.cache_key(data.replace(b'$1', b'$2', 1),
+                                            outputs, {}), key)
+        self.assertNotEqual(cache.cache_key(
+            data, outputs + [('bin', 'a.bin')], {}), key)
+        # Only the C header depends on the name of its output
+        self.assertEqual(cache.cache_key(data, [('memb', 'b.b')], {}), key)
+        self.assertNotEqual(
+            cache.cache_key(data, outputs + [('c', 'a.h')], {}),
+            cache.cache_key(data, outputs + [('c', 'b.h')], {}))
+
+    def test_changes_miss(self):
+        source = self.path('prog.rvi')
+        shutil.copy(SOURCE, source)
+        self.cached(source)
+        self.cached(source, '-x')
+        with open(source, 'a') as fout:
+            fout.write('\tadd $1, $2, $3\n')
+        self.cached(source)
+        stats = self.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']),
+                         (0, 3, 3))
+
+    def test_hit_replays_messages(self):
+        for source in examples():
+            for flags in FLAGS:
+                with self.subTest(source=os.path.basename(source),
+                                  flags=flags):
+                    fresh = rvi(source, '-o', self.path('fresh.b'), *flags)
+                    self.assertEqual(self.cached(source, *flags), fresh)
+                    self.assertEqual(self.read('cached.b'),
+                                     self.read('fresh.b'))
+                    # From the cache
+                    os.unlink(self.path('cached.b'))
+                    self.assertEqual(self.cached(source, *flags), fresh)
+                    self.assertEqual(self.read('cached.b'),
+                                     self.read('fresh.b'))
+        self.assertEqual(self.stats()['hits'],
+                         len(examples()) * len(FLAGS))
+
+    def test_failure_not_cached(self):
+        source = self.path('bad.rvi')
+        with open(source, 'w') as fout:
+            fout.write('\tjal $1, NOWHERE\n')
+        for _ in range(2):
+            rc, out, _ = self.cached(source, '-nc')
+            self.assertEqual(rc, 1)
+            self.assertIn(b'NOWHERE', out)
+        stats = self.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']),
+                         (0, 2, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
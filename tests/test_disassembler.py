@@ -0,0 +1,145 @@
+#
+# @author:Don Dennis
+# test_disassembler.py
+#
+# The disassembler (disassembler.py): the NumPy batch disassembler
+# (batchdisassembler.py) against the regular one, on the examples, on
+# generated programs and on random words, part of which are not
+# instructions, and the programs disassembled and assembled again,
+# which must give back the same words.
+#
+#     python -m unittest discover tests
+
+import io
+import os
+import random
+import tempfile
+import unittest
+from common import Program, examples, rvi, run
+from lib import batchencoder, disassembler
+from lib.assembler import Assembler
+from lib.cprint import cprint as cp
+from lib.memoryimage import MemoryImage
+
+
+def programs():
+    '''
+    returns: the examples and generated programs, as (name, text)
+    '''
+    sources = []
+    for path in examples():
+        with open(path) as fin:
+            sources.append((os.path.basename(path), fin.read()))
+    for seed in range(3):
+        sources.append(('generated %d' % seed,
+                        Program(random.Random(seed), lines=3000).text()))
+    return sources
+
+
+def disassembled(words, batch):
+    '''
+    returns: the text of words and the messages printed disassembling
+    them
+    '''
+    saved = cp.diagnostics
+    cp.diagnostics = []
+    try:
+        text = ''.join(disassembler.text_chunks(words, batch))
+        return text, cp.diagnostics
+    finally:
+        cp.diagnostics = saved
+
+
+class DisassemblerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.programs = [(name, Assembler().assemble(text).words)
+                        for name, text in programs()]
+
+    def setUp(self):
+        if not batchencoder.available():
+            self.skipTest('NumPy is not installed')
+
+    def test_batch_programs(self):
+        for name, words in self.programs:
+            with self.subTest(name):
+                # With the symbols of the program and without
+                self.assertEqual(disassembled(words, True),
+                                 disassembled(words, False))
+                plain = MemoryImage(words)
+                self.assertEqual(disassembled(plain, True),
+                                 disassembled(plain, False))
+
+    def test_batch_random_words(self):
+        rnd = random.Random(5)
+        _, program = self.programs[-1]
+        for size in (1, 100, disassembler.CHUNK_LINES + 10):
+            with self.subTest(size=size):
+                # Random words, most of which are not instructions, and
+                # instructions among words that are not
+                words = MemoryImage(rnd.getrandbits(32) for _ in range(size))
+                self.assertEqual(disassembled(words, True),
+                                 disassembled(words, False))
+                mixed = MemoryImage(word if rnd.random() < 0.9
+                                    else rnd.getrandbits(32)
+                                    for word in list(program) * 8)
+                self.assertEqual(disassembled(mixed, True),
+                                 disassembled(mixed, False))
+
+    def test_batch_read_words(self):
+        _, words = self.programs[-1]
+        data = {
+            'memb': ''.join(format(w, '032b') + '\n' for w in words),
+            'memh': ''.join('%08X\n' % w for w in words),
+            'bin': words.tobytes()
+        }
+        for fmt, content in data.items():
+            with self.subTest(fmt):
+                if isinstance(content, str):
+                    content = content.encode('ascii')
+                for batch in (False, True):
+                    read = disassembler.read_words(io.BytesIO(content), None,
+                                                   batch)
+                    self.assertEqual(list(read), list(words))
+
+    def test_round_trip(self):
+        for name, words in self.programs:
+            for batch in (False, True):
+                with self.subTest(name, batch=batch):
+                    text, messages = disassembled(MemoryImage(words), batch)
+                    self.assertEqual(messages, [])
+                    again = Assembler().assemble(text)
+                    self.assertEqual(list(again.words), list(words))
+
+    def test_round_trip_files(self):
+        # Through rvi.py and rvd.py, in every format
+        source = examples()[0]
+        with tempfile.TemporaryDirectory() as tmp:
+
+            def assemble(source, fmt):
+                # The -o output is in memb or memh, bin is emitted besides
+                output = os.path.join(tmp, 'prog.' + fmt)
+                flags = {'memb': ['-o', output], 'memh': ['-o', output, '-x'],
+                         'bin': ['-o', os.path.join(tmp, 'prog.b'),
+                                 '--emit', 'bin:' + output]}[fmt]
+                rc, _, _ = rvi(source, '-nc', *flags)
+                self.assertEqual(rc, 0)
+                with open(output, 'rb') as fin:
+                    return output, fin.read()
+
+            for fmt in ('memb', 'memh', 'bin'):
+                for batch in ([], ['-b']):
+                    with self.subTest(fmt, batch=batch):
+                        output, words = assemble(source, fmt)
+                        rc, text, _ = run('rvd.py', output, '-f', fmt, '-nc',
+                                          *batch)
+                        self.assertEqual(rc, 0)
+                        again = os.path.join(tmp, 'again.rvi')
+                        with open(again, 'wb') as fout:
+                            fout.write(text)
+                        self.assertEqual(assemble(again, fmt)[1], words)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+#
+# @author:Don Dennis
+# test_emitter.py
+#
+# The output formats (--emit, emitter.py) of a small program against
+# their expected bytes, the ELF header, program header, sections and
+# symbols read field by field and the Intel HEX records checked down to
+# their checksums.
+#
+#     python -m unittest discover tests
+
+import os
+import struct
+import tempfile
+import unittest
+from common import rvi
+from lib import emitter
+
+SOURCE = '''start:
+\taddi $1, $0, 5
+\tadd $2, $1, $1
+loop:
+\tbeq $1, $2, start
+\tjal $0, loop
+'''
+
+WORDS = (0x00500093, 0x00108133, 0xFE208CE3, 0xFFDFF06F)
+
+MEMB = b'''00000000010100000000000010010011
+00000000000100001000000100110011
+11111110001000001000110011100011
+11111111110111111111000001101111
+'''
+
+MEMH = b'''00500093
+00108133
+FE208CE3
+FFDFF06F
+'''
+
+IHEX = b''':100000009300500033811000E38C20FE6FF0DFFF7F
+:00000001FF
+'''
+
+C = b'''/* Generated by RVI */
+#ifndef PROG_H
+#define PROG_H
+
+#include <stdint.h>
+
+#define PROG_LEN 4
+#define PROG_START 0x00000000
+#define PROG_LOOP 0x00000008
+
+static const uint32_t prog[4] = {
+    0x00500093, 0x00108133, 0xFE208CE3, 0xFFDFF06F,
+};
+
+#endif
+'''
+
+
+def ihex_records(text):
+    '''
+    returns: the (type, address, data) of every record of the Intel
+    HEX text, whose lengths and checksums are checked
+    '''
+    records = []
+    for line in text.decode('ascii').splitlines():
+        assert line[0] == ':', line
+        record = bytes.fromhex(line[1:])
+        assert sum(record) & 0xFF == 0, 'checksum of ' + line
+        length, address, rtype = struct.unpack('>BHB', record[:4])
+        assert length == len(record) - 5, 'length of ' + line
+        records.append((rtype, address, record[4:-1]))
+    return records
+
+
+class EmitterTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        source = os.path.join(cls.tmp.name, 'prog.rvi')
+        with open(source, 'w') as fout:
+            fout.write(SOURCE)
+        args = [source, '-o', os.path.join(cls.tmp.name, 'prog.b')]
+        for fmt in ('memh', 'bin', 'ihex', 'c', 'elf'):
+            args += ['--emit', fmt]
+        rc, out, err = rvi(*args)
+        assert (rc, out, err) == (0, b'', b''), (rc, out, err)
+        cls.outputs = {}
+        for ext in ('.b', '.memh', '.bin', '.hex', '.h', '.elf'):
+            with open(os.path.join(cls.tmp.name, 'prog' + ext), 'rb') as fin:
+                cls.outputs[ext] = fin.read()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_text_formats(self):
+        self.assertEqual(self.outputs['.b'], MEMB)
+        self.assertEqual(self.outputs['.memh'], MEMH)
+        self.assertEqual(self.outputs['.h'], C)
+
+    def test_bin(self):
+        self.assertEqual(self.outputs['.bin'], struct.pack('<4I', *WORDS))
+
+    def test_ihex(self):
+        self.assertEqual(self.outputs['.hex'], IHEX)
+        self.assertEqual(ihex_records(IHEX), [
+            (0x00, 0, struct.pack('<4I', *WORDS)),
+            (0x01, 0, b'')])
+
+    def test_ihex_segments(self):
+        # Extended linear address records past every 64K
+        image = emitter.Image()
+        image.extend(range(40000))
+        records = ihex_records(emitter.emit_ihex(image, {}, 'big'))
+        data = bytearray()
+        base = 0
+        for rtype, address, payload in records[:-1]:
+            if rtype == 0x04:
+                base = struct.unpack('>H', payload)[0] << 16
+                self.assertEqual(base, len(data))
+                continue
+            self.assertEqual(rtype, 0x00)
+            self.assertEqual(base + address, len(data))
+            data += payload
+        self.assertEqual(bytes(data), image.tobytes())
+        self.assertEqual([r[0] for r in records].count(0x04), 2)
+        self.assertEqual(records[-1], (0x01, 0, b''))
+
+    def test_elf(self):
+        elf = self.outputs['.elf']
+        (ident, e_type, machine, version, entry, phoff, shoff, flags,
+         ehsize, phentsize, phnum, shentsize, shnum,
+         shstrndx) = emitter.ELF_HEADER.unpack_from(elf)
+        # 32 bit, little endian, version 1
+        self.assertEqual(ident, b'\x7fELF\x01\x01\x01' + bytes(9))
+        self.assertEqual((e_type, machine, version, entry, flags),
+                         (2, 243, 1, 0, 0))
+        self.assertEqual((phoff, ehsize, phentsize, phnum),
+                         (52, 52, 32, 1))
+        self.assertEqual((shentsize, shnum, shstrndx), (40, 5, 4))
+        self.assertEqual(shoff % 4, 0)
+        self.assertEqual(shoff + shnum * shentsize, len(elf))
+
+        # One loadable segment at 0, readable and executable
+        text = struct.pack('<4I', *WORDS)
+        self.assertEqual(emitter.PROGRAM_HEADER.unpack_from(elf, phoff),
+                         (1, 84, 0, 0, len(text), len(text), 5, 4))
+
+        sections = [emitter.SECTION_HEADER.unpack_from(elf, shoff + 40 * i)
+                    for i in range(shnum)]
+        self.assertEqual(sections[0], (0,) * 10)
+        shstrtab = sections[4]
+        names = elf[shstrtab[4]:shstrtab[4] + shstrtab[5]]
+
+        def name(offset, table=names):
+            return table[offset:table.index(b'\0', offset)].decode()
+
+        self.assertEqual([name(s[0]) for s in sections],
+                         ['', '.text', '.symtab', '.strtab', '.shstrtab'])
+        # name, type, flags, address, offset, size, link, info, align,
+        # entry size
+        _, *fields = sections[1]
+        self.assertEqual(fields, [1, 6, 0, 84, len(text), 0, 0, 4, 0])
+        self.assertEqual(elf[84:84 + len(text)], text)
+        _, *fields = sections[2]
+        self.assertEqual(fields, [2, 0, 0, 100, 64, 3, 4, 4, 16])
+        self.assertEqual(sections[3][1:4], (3, 0, 0))
+        self.assertEqual(shstrtab[1:4], (3, 0, 0))
+
+        strtab = sections[3]
+        strings = elf[strtab[4]:strtab[4] + strtab[5]]
+        symbols = [emitter.SYMBOL.unpack_from(elf, 100 + 16 * i)
+                   for i in range(4)]
+        self.assertEqual(symbols[0], (0, 0, 0, 0, 0, 0))
+        # Section symbol of .text
+        self.assertEqual(symbols[1], (0, 0, 0, 3, 0, 1))
+        self.assertEqual([(name(s[0], strings), s[1:]) for s in symbols[2:]],
+                         [('start', (0, 0, 0, 0, 1)),
+                          ('loop', (8, 0, 0, 0, 1))])
+
+
+if __name__ == '__main__':
+    unittest.main()
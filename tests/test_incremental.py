@@ -0,0 +1,127 @@
+#
+# @author:Don Dennis
+# test_incremental.py
+#
+# Incremental reassembly (-i) against clean builds.
+#
+# A generated program is edited by seeded random edit sequences:
+# immediates changed, lines and labels inserted and deleted, labels
+# declared twice or used without being declared, syntax errors and
+# lines the lexer complains about. After every edit the program is
+# assembled both incrementally and from scratch, and the exit status,
+# the messages and the output files must be the same byte for byte.
+# The edits making the assembly fail are undone afterwards.
+#
+#     python -m unittest discover tests
+
+import os
+import random
+import tempfile
+import unittest
+from common import Program, rvi
+
+# Options the edit sequences are run with
+FLAGS = ([], ['-e'], ['-n32'], ['-x'], ['-es'])
+
+# Edits per sequence
+EDITS = 12
+
+
+class IncrementalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'prog.rvi')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def write(self, text):
+        with open(self.source, 'w') as fout:
+            fout.write(text)
+
+    def read(self, name):
+        try:
+            with open(self.path(name), 'rb') as fin:
+                return fin.read()
+        except FileNotFoundError:
+            return None
+
+    def check(self, flags, what):
+        '''
+        Assembles the source incrementally and from scratch, and
+        compares the two.
+        '''
+        clean = rvi(self.source, '-o', self.path('clean.b'), *flags)
+        incremental = rvi(self.source, '-o', self.path('inc.b'), '-i',
+                          *flags)
+        self.assertEqual(incremental, clean, what)
+        self.assertEqual(self.read('inc.b'), self.read('clean.b'), what)
+        return clean[0]
+
+    def test_edit_sequences(self):
+        for seed, flags in enumerate(FLAGS):
+            with self.subTest(flags=flags):
+                rnd = random.Random(seed)
+                program = Program(rnd)
+                self.write(program.text())
+                self.assertEqual(self.check(flags, 'initial'), 0)
+                for step in range(EDITS):
+                    previous = list(program.lines)
+                    what = '%s, edit %d' % (program.edit(), step)
+                    self.write(program.text())
+                    if self.check(flags, what):
+                        # Undone, so that the next edits are not made
+                        # to a program failing anyway
+                        program.lines = previous
+                        self.write(program.text())
+                        self.assertEqual(self.check(flags, 'undo ' + what),
+                                         0)
+                os.unlink(self.path('inc.rvs'))
+
+    def test_revert(self):
+        # Back to a version assembled before, after failed assemblies
+        program = Program(random.Random(100))
+        original = program.text()
+        self.write(original)
+        self.check([], 'initial')
+        for line in ('\tjal $1, NOWHERE', 'L0:', '\taddi $1, $2,, 3'):
+            program.lines.insert(len(program.lines) // 2, line)
+            self.write(program.text())
+            self.assertEqual(self.check([], line), 1)
+            del program.lines[len(program.lines) // 2]
+        self.write(original)
+        self.check([], 'reverted')
+
+    def test_fallback_saves_state(self):
+        # A block the lexer complains about is assembled the regular
+        # way, after which the state is that of the new source
+        program = Program(random.Random(200))
+        self.write(program.text())
+        self.check([], 'initial')
+        with open(self.path('inc.rvs'), 'rb') as fin:
+            before = fin.read()
+        program.lines.insert(10, '\tadd $1, $2, $3 @')
+        self.write(program.text())
+        self.check([], 'illegal character')
+        with open(self.path('inc.rvs'), 'rb') as fin:
+            self.assertNotEqual(fin.read(), before)
+        # Its messages are still printed once it is unchanged
+        self.check([], 'unchanged')
+        program.lines.insert(300, '\taddi $4, $5, 6')
+        self.write(program.text())
+        self.check([], 'edited after the fallback')
+
+    def test_flags_change(self):
+        # The state of an assembly is not used with other options
+        program = Program(random.Random(300))
+        self.write(program.text())
+        for flags in (['-x'], ['-n32'], [], ['-n32', '-e']):
+            self.check(flags, str(flags))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#
+# @author:Don Dennis
+# test_memo.py
+#
+# The parse and encode caches (--parse-memo, --encode-memo, memo.py):
+# disabled unless asked for, and the same messages and outputs with and
+# without them, on the examples and on generated programs repeating
+# their lines, some of which print warnings.
+#
+#     python -m unittest discover tests
+
+import json
+import os
+import random
+import tempfile
+import unittest
+from common import Program, examples, rvi
+from lib import memo
+
+# Options the programs are assembled with
+FLAGS = ([], ['-e'], ['-x'], ['-n32'], ['-s'], ['-w'], ['-b'])
+
+# Sizes of the caches, small ones dropping entries all along
+SIZES = ('4', '4096')
+
+
+class MemoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as fin:
+            return fin.read()
+
+    def repeating(self, seed):
+        '''
+        returns: the path of a program of 2000 lines drawn from 40
+        '''
+        rnd = random.Random(seed)
+        program = Program(rnd, lines=40)
+        lines = [rnd.choice(program.lines) for _ in range(2000)]
+        # Labels declared once, those referred to being declared at the
+        # end
+        lines = [line for line in lines if not line.endswith(':')]
+        lines.extend('L%d:' % i for i in range(program.count))
+        source = self.path('rep%d.rvi' % seed)
+        with open(source, 'w') as fout:
+            fout.write(''.join(line + '\n' for line in lines))
+        return source
+
+    def check(self, source):
+        for flags in FLAGS:
+            expected = rvi(source, '-o', self.path('off.b'), *flags)
+            output = self.read('off.b')
+            for size in SIZES:
+                with self.subTest(source=os.path.basename(source),
+                                  flags=flags, size=size):
+                    got = rvi(source, '-o', self.path('on.b'), '--parse-memo',
+                              size, '--encode-memo', size, *flags)
+                    self.assertEqual(got, expected)
+                    self.assertEqual(self.read('on.b'), output)
+
+    def memo_stats(self, source, *args):
+        rc, out, _ = rvi(source, '-o', self.path('a.b'), '-n32', '-nc',
+                         '--memo-stats', *args)
+        self.assertEqual(rc, 0)
+        # After the warnings
+        return json.loads(out[out.index(b'{'):])
+
+    def test_disabled_by_default(self):
+        self.assertEqual(memo.SIZES, {'parse': 0, 'encode': 0})
+        self.assertEqual(self.memo_stats(examples()[0]),
+                         {'parse': None, 'encode': None})
+
+    def test_examples(self):
+        for source in examples():
+            self.check(source)
+
+    def test_repeated_lines(self):
+        for seed in range(2):
+            source = self.repeating(seed)
+            self.check(source)
+        # The caches are used
+        stats = self.memo_stats(source, '--parse-memo', '4096',
+                                '--encode-memo', '4096')
+        self.assertGreater(stats['parse']['hits'], 1000)
+        self.assertGreater(stats['encode']['hits'], 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#
+# @author:Don Dennis
+# test_messages.py
+#
+# The messages of the assemblies parsing their source once (single
+# pass, whole program, batch and the standard input) against those of
+# the two pass assembly.
+#
+# A generated program, printing warnings and complaints of the lexer
+# and holding errors the parser recovers from, is assembled as it is
+# and with each of the errors stopping an assembly added. Every mode
+# must print the same messages, in the same order, exit with the same
+# status and write the same output as the two pass assembly.
+#
+#     python -m unittest discover tests
+
+import os
+import random
+import tempfile
+import unittest
+from common import Program, rvi
+
+# Options of the modes parsing the source once
+MODES = (['-s'], ['-w'], ['-w', '-s'], ['-b'], ['-b', '-w'])
+
+FLAGS = ([], ['-e'], ['-es'], ['-n32'])
+
+# Lines added to the program, each stopping its assembly
+STOPPING = {
+    'duplicate label': 'L0:',
+    'undefined label': '\tjal $1, NOWHERE',
+    'incomplete line': '\taddi $1, $2',
+    'bad register': '\tadd $1, $2, $40',
+}
+
+
+class MessagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'prog.rvi')
+        program = Program(random.Random(1), lines=300)
+        lines = program.lines
+        lines.insert(20, '\tadd $1, $2, $3 @')
+        # Reported, the line being dropped, without stopping
+        lines.insert(150, 'L: beq $1, $2, 7')
+        lines.insert(170, '\taddi $1, $2,, 3')
+        lines.insert(250, '\tsub $4, $5, $6 ` ~')
+        self.lines = lines
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def read(self, name):
+        try:
+            with open(self.path(name), 'rb') as fin:
+                return fin.read()
+        except FileNotFoundError:
+            return None
+
+    def check(self, text):
+        with open(self.source, 'w') as fout:
+            fout.write(text)
+        for flags in FLAGS:
+            expected = rvi(self.source, '-o', self.path('two.b'), '-nc',
+                           *flags)
+            output = self.read('two.b')
+            for mode in MODES:
+                with self.subTest(flags=flags, mode=mode):
+                    if os.path.exists(self.path('once.b')):
+                        os.unlink(self.path('once.b'))
+                    got = rvi(self.source, '-o', self.path('once.b'), '-nc',
+                              *(flags + mode))
+                    self.assertEqual(got, expected)
+                    self.assertEqual(self.read('once.b'), output)
+            with self.subTest(flags=flags, mode='stream'):
+                # The messages go to the standard error, the output
+                # taking the standard output
+                rc, out, err = rvi('-', '-o', '-', '-nc', *flags,
+                                   stdin=text.encode())
+                self.assertEqual((rc, err), expected[:2])
+                if rc == 0:
+                    self.assertEqual(out, output)
+        return expected[0]
+
+    def text(self, lines):
+        return ''.join(line + '\n' for line in lines)
+
+    def test_messages(self):
+        self.assertEqual(self.check(self.text(self.lines)), 0)
+
+    def test_stopping_errors(self):
+        for what, line in sorted(STOPPING.items()):
+            with self.subTest(what):
+                lines = list(self.lines)
+                lines.insert(200, line)
+                self.assertEqual(self.check(self.text(lines)), 1)
+
+    def test_no_final_newline(self):
+        self.assertEqual(self.check(self.text(self.lines) + '\t  '), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#
+# @author:Don Dennis
+# test_modes.py
+#
+# The single pass assembly (-s), the standard input streamed to the
+# standard output and the parallel assembly (-j) against the two pass
+# assembly.
+#
+# The examples and generated programs, referring to labels declared
+# before and after them, are assembled into binary and hex text, as
+# they are and with errors added. Every mode must exit with the same
+# status, print the same messages and write the same output as the two
+# pass assembly. The large programs are split across the processes of
+# the parallel assembly, their errors falling in different pieces.
+#
+#     python -m unittest discover tests
+
+import os
+import random
+import tempfile
+import unittest
+from common import Program, examples, rvi
+
+# Options of the modes compared with the two pass assembly, besides the
+# standard input
+MODES = (['-s'], ['-j', '2'], ['-j', '3'])
+
+# Output formats and their options
+FORMATS = (('.b', []), ('.x', ['-x']))
+
+# Lines added to the programs, at a quarter, half and three quarters
+ERRORS = {
+    'recovered errors': ('\taddi $1, $2,, 3', 'L: beq $1, $2, 7',
+                         '\tadd $1, $2, $3 @'),
+    'duplicate label': ('\tsub $1, $2, $3', 'L1:', '\tor $4, $5, $6'),
+    'undefined label': ('\tbeq $1, $2, NOWHERE', '\tjal $1, L2',
+                        '\tjal $0, NOWHERE'),
+    'incomplete line': ('\tadd $1, $2, $3 ~', '\tbeq $1, $2, L3',
+                        '\taddi $1, $2'),
+}
+
+
+class ModesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def read(self, name):
+        try:
+            with open(self.path(name), 'rb') as fin:
+                return fin.read()
+        except FileNotFoundError:
+            return None
+
+    def check(self, source, modes=MODES):
+        '''
+        Assembles source with the two pass assembly and every mode, and
+        compares them.
+
+        returns: the exit status of the two pass assembly
+        '''
+        with open(source, 'rb') as fin:
+            text = fin.read()
+        for ext, flags in FORMATS:
+            expected = rvi(source, '-o', self.path('two' + ext), '-nc',
+                           *flags)
+            output = self.read('two' + ext)
+            for mode in modes:
+                with self.subTest(source=os.path.basename(source),
+                                  flags=flags, mode=mode):
+                    out = self.path('mode' + ext)
+                    if os.path.exists(out):
+                        os.unlink(out)
+                    got = rvi(source, '-o', out, '-nc', *(flags + mode))
+                    self.assertEqual(got, expected)
+                    self.assertEqual(self.read('mode' + ext), output)
+            with self.subTest(source=os.path.basename(source), flags=flags,
+                              mode='stream'):
+                # The messages go to the standard error, the output
+                # taking the standard output
+                rc, out, err = rvi('-', '-o', '-', '-nc', *flags,
+                                   stdin=text)
+                self.assertEqual((rc, err), expected[:2])
+                if rc == 0:
+                    self.assertEqual(out, output)
+        return expected[0]
+
+    def write(self, name, lines):
+        source = self.path(name)
+        with open(source, 'w') as fout:
+            fout.write(''.join(line + '\n' for line in lines))
+        return source
+
+    def check_errors(self, program, name):
+        for what, added in sorted(ERRORS.items()):
+            lines = list(program.lines)
+            for i, line in reversed(list(enumerate(added))):
+                lines.insert(len(lines) * (i + 1) // 4, line)
+            status = self.check(self.write(name, lines))
+            self.assertEqual(status, what != 'recovered errors', what)
+
+    def test_examples(self):
+        for source in examples():
+            self.assertEqual(self.check(source), 0)
+
+    def test_generated(self):
+        for seed in range(4):
+            program = Program(random.Random(seed), lines=400)
+            source = self.write('gen%d.rvi' % seed, program.lines)
+            self.assertEqual(self.check(source), 0)
+        self.check_errors(program, 'gen.rvi')
+
+    def test_parallel(self):
+        # Large enough to be split into pieces
+        program = Program(random.Random(10), lines=40000)
+        source = self.write('large.rvi', program.lines)
+        self.assertEqual(self.check(source), 0)
+        self.check_errors(program, 'large.rvi')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#
+# @author:Don Dennis
+# test_multifile.py
+#
+# Several files assembled in one run (multifile.py): where the outputs
+# go, inputs that would overwrite each other's output, and the status
+# and outputs of the files that fail.
+#
+#     python -m unittest discover tests
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from common import examples, rvi
+from lib import multifile, parser
+from lib.cprint import cprint as cp
+
+GOOD = examples()[0]
+BAD = '\tadd $1, $2\n'
+
+
+class MultifileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, *names):
+        return os.path.join(self.tmp.name, *names)
+
+    def source(self, *names, text=None):
+        path = self.path(*names)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if text is None:
+            shutil.copyfile(GOOD, path)
+        else:
+            with open(path, 'w') as fout:
+                fout.write(text)
+        return path
+
+    def read(self, *names):
+        with open(self.path(*names), 'rb') as fin:
+            return fin.read()
+
+    def expected(self):
+        status, _, _ = rvi(GOOD, '-o', self.path('expected.b'))
+        self.assertEqual(status, 0)
+        return self.read('expected.b')
+
+    def test_same_name_in_other_directories(self):
+        # A relative and an absolute path ending the same way
+        self.source('a', 'x.rvi')
+        absolute = self.source('b', 'x.rvi')
+        status, out, _ = rvi(os.path.join('a', 'x.rvi'), absolute,
+                             '-d', 'out', cwd=self.tmp.name)
+        self.assertEqual(status, 0)
+        outputs = [entry['output'] for entry in json.loads(out)['files']]
+        self.assertEqual(outputs, [os.path.join('out', 'a', 'x.b'),
+                                   os.path.join('out', 'b', 'x.b')])
+        self.assertEqual(self.read('out', 'a', 'x.b'), self.expected())
+        self.assertEqual(self.read('out', 'b', 'x.b'), self.expected())
+
+    def test_parent_directory(self):
+        self.source('x.rvi')
+        self.source('d', 'x.rvi')
+        status, _, _ = rvi('x.rvi', os.path.join(os.pardir, 'x.rvi'),
+                           '-d', 'out', cwd=self.path('d'))
+        self.assertEqual(status, 0)
+        self.assertEqual(self.read('d', 'out', 'x.b'), self.expected())
+        self.assertEqual(self.read('d', 'out', 'd', 'x.b'), self.expected())
+
+    def test_same_output(self):
+        # Nothing is assembled, the error naming both inputs
+        first = self.source('x.rvi')
+        second = self.source('x.s')
+        status, out, err = rvi(first, second)
+        self.assertEqual(status, 1)
+        self.assertEqual(out, b'')
+        self.assertIn(first.encode(), err)
+        self.assertIn(second.encode(), err)
+        self.assertFalse(os.path.exists(self.path('x.b')))
+        status, _, err = rvi(first, first, '-d', self.path('out'))
+        self.assertEqual(status, 1)
+        self.assertFalse(os.path.exists(self.path('out')))
+
+    def test_failed_output_removed(self):
+        bad = self.source('bad.rvi', text=BAD)
+        good = self.source('good.rvi')
+        # Left from an earlier run, and rewritten by this one
+        with open(self.path('bad.b'), 'w') as fout:
+            fout.write('0' * 32 + '\n')
+        status, out, _ = rvi(bad, good, '-x', '--emit', 'bin')
+        self.assertEqual(status, 1)
+        statuses = [entry['status'] for entry in json.loads(out)['files']]
+        self.assertEqual(statuses, ['failed', 'ok'])
+        self.assertFalse(os.path.exists(self.path('bad.x')))
+        self.assertFalse(os.path.exists(self.path('bad.bin')))
+        self.assertTrue(os.path.exists(self.path('good.x')))
+        self.assertTrue(os.path.exists(self.path('good.bin')))
+        # Not written by the run, so kept
+        self.assertTrue(os.path.exists(self.path('bad.b')))
+
+    def test_exit_status(self):
+        args = dict(no_color=True, no_32=False, hex=False)
+        outfile = self.path('x.b')
+        saved = cp.out
+        try:
+            for code, status in ((0, 'ok'), (None, 'ok'), (1, 'failed'),
+                                 (2, 'failed'), ('Error', 'failed')):
+                with self.subTest(code=code), \
+                        mock.patch.object(parser, 'parse_input',
+                                          side_effect=SystemExit(code)):
+                    entry = multifile.assemble_file(GOOD, outfile, args)
+                    self.assertEqual(entry['status'], status)
+        finally:
+            cp.out = saved
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+#
+# @author:Don Dennis
+# test_parser.py
+#
+# The fast path line decoder (parser.decode_line) against the ply
+# parser. The fast path must decode a line into the record the grammar
+# builds, printing the same warnings, or leave it to the ply parser,
+# which reports its errors. Lines of every shape, malformed lines and
+# generated lines with random damage are checked.
+#
+#     python -m unittest discover tests
+
+import io
+import random
+import unittest
+from common import Program
+from lib import parser
+from lib.cprint import cprint as cp, Abort
+from lib.ir import symbols_scope
+from lib.reader import StreamSource
+
+VALID = [
+    'add $1, $2, $3',
+    '\tsub $31, $0, $17   # comment',
+    'addi $1, $2, -2048',
+    'addi $1, $2, 99999999',
+    'slli $1, $2, 40',
+    'lw $5, $6, 3',
+    'sw $1, $2, 4',
+    'beq $1, $2, 3',
+    'bne $1, $2, L',
+    'lui $1, 9999999999',
+    'jal $1, 2047',
+    'jal $0, L',
+    'jalr $1, $2, 8',
+    'L:',
+    '  loop_2 :  # comment',
+    '',
+    '   # comment',
+]
+
+MALFORMED = {
+    'bad register': 'add $1, $2, $40',
+    'bad first register': 'addi $32, $2, 1',
+    'missing comma': 'add $1 $2, $3',
+    'two commas': 'addi $1, $2,, 3',
+    'trailing token': 'add $1, $2, $3 x',
+    'illegal character': 'add $1, $2, $3 @',
+    'unknown opcode': 'foo $1, $2, $3',
+    'wrong operands': 'lui $1, $2, $3',
+    'immediate for a register': 'add $1, $2, 3',
+    'opcode as a label': 'add:',
+    'label after an instruction': 'L: beq $1, $2, 7',
+    'missing operand': 'addi $1, $2',
+    'no newline': 'add $1, $2, $3',
+}
+
+
+def captured(function, *args):
+    '''
+    returns: the result of function(*args), or the exception it
+    raised, and the messages it printed, as (kind, message)
+    '''
+    saved = (cp.diagnostics, cp.warn, cp.warn32, cp.fail)
+    cp.diagnostics = []
+    cp.warn = cp.warn32 = cp.fail = True
+    try:
+        with symbols_scope():
+            try:
+                result = function(*args)
+            except (Abort, SyntaxError) as e:
+                result = type(e)
+        return result, cp.diagnostics
+    finally:
+        cp.diagnostics, cp.warn, cp.warn32, cp.fail = saved
+
+
+def ply(line, lineno):
+    lexer = parser.get_lexer()
+    lexer.lineno = lineno
+    return parser.get_parser().parse(line, lexer=lexer)
+
+
+def pipeline(line):
+    return list(parser.parse_lines(StreamSource(io.StringIO(line))))
+
+
+class FastPathTest(unittest.TestCase):
+
+    def check(self, line, valid=None):
+        '''
+        Compares the fast path and the ply parser on line.
+
+        returns: whether the fast path decoded the line
+        '''
+        fast, fast_messages = captured(parser.decode_line, line, 1)
+        grammar, messages = captured(ply, line, 1)
+        if valid is not None:
+            self.assertEqual(fast is not None, valid)
+        if fast is not None:
+            self.assertEqual(fast, grammar)
+            self.assertEqual(fast_messages, messages)
+        else:
+            self.assertEqual(fast_messages, [])
+        # The lines reach the ply parser through parse_lines
+        records, read_messages = captured(pipeline, line)
+        self.assertEqual(read_messages, messages)
+        if grammar is None:
+            self.assertIs(records, Abort)
+        elif records is not Abort:
+            self.assertEqual(records, [grammar] if grammar else [])
+        return fast is not None
+
+    def test_valid(self):
+        for line in VALID:
+            with self.subTest(line=line):
+                self.check(line + '\n', True)
+
+    def test_malformed(self):
+        for what, line in sorted(MALFORMED.items()):
+            with self.subTest(what):
+                if what != 'no newline':
+                    line += '\n'
+                self.assertFalse(self.check(line, False))
+                _, messages = captured(ply, line, 1)
+                self.assertTrue(any(kind == 'error' or 'Illegal' in msg
+                                    for kind, msg in messages), messages)
+
+    def test_error_text(self):
+        for line, error in (
+                ('add $1, $2, $40\n', 'Error:1:Invalid register index.'),
+                ('add $1 $2, $3\n',
+                 "Error:1: Invalid or incomplete token found '$2'"),
+                ('add $1, $2, $3 x\n',
+                 "Error:1: Invalid or incomplete token found 'x'"),
+                ('add $1, $2, $3',
+                 'Error: Invalid or incomplete token found Did you end'
+                 ' with a newline?')):
+            with self.subTest(line=line):
+                _, messages = captured(pipeline, line)
+                self.assertIn(('error', error), messages)
+
+    def test_generated(self):
+        # Generated lines as they are, and damaged
+        rnd = random.Random(4)
+        lines = Program(rnd, lines=2000).lines
+        damages = (
+            lambda line: line.replace(',', '', 1),
+            lambda line: line.replace('$', '$9', 1),
+            lambda line: line + ' x',
+            lambda line: line + ',',
+            lambda line: line.replace(' ', '', 1),
+            lambda line: line.replace('$', '', 1),
+            lambda line: line.rpartition(',')[0],
+        )
+        fast = 0
+        for line in lines:
+            with self.subTest(line=line):
+                fast += self.check(line + '\n', True)
+            damaged = rnd.choice(damages)(line)
+            with self.subTest(line=damaged):
+                self.check(damaged + '\n')
+        self.assertEqual(fast, len(lines))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+#
+# @author:Don Dennis
+# test_patch.py
+#
+# Patching assembled programs in place (--index and -p, patch.py):
+# edits leaving every instruction and label where it was must give the
+# outputs of a full rebuild, in every patchable format, and edits
+# changing the size or the layout of the program must be rejected,
+# leaving the outputs and the index as they were.
+#
+#     python -m unittest discover tests
+
+import os
+import tempfile
+import unittest
+from common import rvi
+
+SOURCE = '''\
+# A loop
+START:
+\taddi $1, $0, 10
+\taddi $2, $0, 0
+
+LOOP:
+\tadd $2, $2, $1
+\taddi $1, $1, -1
+\tbne $1, $0, LOOP
+\tsw $2, $0, 64
+END:
+\tjal $0, END
+'''
+
+# Formats of the outputs, as the flags writing them
+FORMATS = {
+    'memb': [],
+    'memh': ['-x'],
+    'bin': ['--emit', 'memb:prog.b', '--emit', 'bin:prog.bin']
+}
+
+
+def edited(lineno, line):
+    '''
+    returns: SOURCE with its line lineno replaced by line
+    '''
+    lines = SOURCE.split('\n')
+    lines[lineno - 1] = line
+    return '\n'.join(lines)
+
+
+class PatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = self.path('prog.rvi')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def write(self, text):
+        with open(self.source, 'w') as fout:
+            fout.write(text)
+
+    def outputs(self):
+        '''
+        returns: name -> content of the outputs and index in the
+        directory
+        '''
+        contents = {}
+        for name in sorted(os.listdir(self.tmp.name)):
+            if name.startswith('prog.') and name != 'prog.rvi':
+                with open(self.path(name), 'rb') as fin:
+                    contents[name] = fin.read()
+        return contents
+
+    def assemble(self, *flags):
+        return rvi(self.source, '-o', self.path('prog.b'), '-nc', *flags,
+                   cwd=self.tmp.name)
+
+    def test_patch_as_rebuild(self):
+        edits = (
+            (3, '\taddi $1, $0, 20'),
+            (7, '\tsub $2, $2, $1'),
+            (9, '\tbeq $1, $0, LOOP'),
+            (12, '\tjal $0, START'),
+            (5, '# Blank no more'),
+            (1, ''),
+        )
+        for fmt, flags in FORMATS.items():
+            for lineno, line in edits:
+                with self.subTest(fmt, line=line):
+                    self.write(SOURCE)
+                    self.assertEqual(self.assemble('--index', *flags)[0], 0)
+                    self.write(edited(lineno, line))
+                    rc, out, _ = self.assemble('-p', str(lineno), *flags)
+                    self.assertEqual((rc, out), (0, b''))
+                    patched = self.outputs()
+                    self.assertEqual(self.assemble('--index', *flags)[0], 0)
+                    self.assertEqual(patched, self.outputs())
+
+    def test_patch_many_lines(self):
+        self.write(SOURCE)
+        self.assertEqual(self.assemble('--index')[0], 0)
+        text = edited(3, '\taddi $1, $0, 7')
+        text = text.replace('\taddi $1, $1, -1', '\taddi $1, $1, -2')
+        self.write(text)
+        self.assertEqual(self.assemble('-p', '3,6-8')[0], 0)
+        patched = self.outputs()
+        self.assertEqual(self.assemble('--index')[0], 0)
+        self.assertEqual(patched, self.outputs())
+
+    def test_layout_changes_rejected(self):
+        rejected = (
+            # Instructions added or removed, labels added, renamed or
+            # removed, and lines added or removed
+            (edited(5, '\tadd $1, $1, $1'), '5'),
+            (edited(4, '# None'), '4'),
+            (edited(6, 'LOOP2:'), '6'),
+            (edited(2, ''), '2'),
+            (edited(5, 'EXTRA:'), '5'),
+            (edited(3, 'L:\taddi $1, $0, 10'), '3'),
+            (SOURCE + '\tadd $1, $1, $1\n', '12'),
+            (SOURCE.replace('\n\n', '\n'), '5'),
+        )
+        for fmt, flags in FORMATS.items():
+            for text, lines in rejected:
+                with self.subTest(fmt, text=text):
+                    self.write(SOURCE)
+                    self.assertEqual(self.assemble('--index', *flags)[0], 0)
+                    before = self.outputs()
+                    self.write(text)
+                    rc, out, _ = self.assemble('-p', lines, *flags)
+                    self.assertEqual(rc, 1)
+                    self.assertIn(b'assembled again', out)
+                    self.assertEqual(self.outputs(), before)
+
+    def test_errors_leave_outputs(self):
+        self.write(SOURCE)
+        self.assertEqual(self.assemble('--index')[0], 0)
+        before = self.outputs()
+        for line in ('\tadd $1, $2', '\tjal $1, NOWHERE'):
+            with self.subTest(line):
+                self.write(edited(3, line))
+                self.assertEqual(self.assemble('-p', '3')[0], 1)
+                self.assertEqual(self.outputs(), before)
+
+    def test_no_index(self):
+        self.write(SOURCE)
+        self.assertEqual(self.assemble()[0], 0)
+        rc, out, _ = self.assemble('-p', '3')
+        self.assertEqual(rc, 1)
+        self.assertIn(b'--index', out)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#
+# @author:Don Dennis
+# test_simulator.py
+#
+# The simulator (simulator.py): the accesses out of the data memory,
+# reported with the address accessed and that of the instruction, and
+# the instructions writing $0, which must still do everything else
+# they do.
+#
+#     python -m unittest discover tests
+
+import unittest
+from common import examples
+from lib.assembler import Assembler
+from lib.simulator import Machine, SimulationError
+
+# Size of the data memory of the tests
+SIZE = 4096
+
+
+def machine(source, **kwargs):
+    return Machine(Assembler().assemble(source).words, memory_size=SIZE,
+                   **kwargs)
+
+
+class SimulatorTest(unittest.TestCase):
+
+    def fault(self, source):
+        '''
+        returns: the message of the SimulationError running source
+        '''
+        m = machine(source)
+        with self.assertRaises(SimulationError) as caught:
+            m.run(100)
+        return m, str(caught.exception)
+
+    def test_load_out_of_range(self):
+        for load in ('lw', 'lh', 'lhu', 'lb', 'lbu'):
+            with self.subTest(load):
+                m, msg = self.fault('\taddi $1, $0, 2047\n'
+                                    '\tslli $1, $1, 2\n'
+                                    '\t%s $2, $1, 100\n' % load)
+                self.assertEqual(msg, 'Memory access to address 0x00002060'
+                                 ' out of range at address 0x00000008')
+                self.assertEqual(m.pc, 8)
+
+    def test_store_out_of_range(self):
+        for store in ('sw', 'sh', 'sb'):
+            with self.subTest(store):
+                m, msg = self.fault('\tlui $1, 1\n'
+                                    '\t%s $1, $2, 4\n' % store)
+                self.assertEqual(msg, 'Memory access to address 0x00001004'
+                                 ' out of range at address 0x00000004')
+
+    def test_load_into_zero_out_of_range(self):
+        for load in ('lw', 'lh', 'lhu', 'lb', 'lbu'):
+            with self.subTest(load):
+                m, msg = self.fault('\tlui $1, 2\n'
+                                    '\t%s $0, $1, 8\n' % load)
+                self.assertEqual(msg, 'Memory access to address 0x00002008'
+                                 ' out of range at address 0x00000004')
+                self.assertEqual(m.regs[0], 0)
+
+    def test_load_into_zero(self):
+        m = machine('\taddi $1, $0, 77\n'
+                    '\tsw $0, $1, 16\n'
+                    '\tlw $0, $0, 16\n'
+                    '\tlw $2, $0, 16\n'
+                    'HALT:\n'
+                    '\tjal $0, HALT\n')
+        self.assertEqual(m.run(100), 'halt')
+        self.assertEqual(m.regs[:3], [0, 77, 77])
+
+    def test_writes_to_zero(self):
+        m = machine('\taddi $0, $0, 5\n'
+                    '\tlui $0, 5\n'
+                    '\tjal $0, NEXT\n'
+                    '\taddi $1, $0, 1\n'
+                    'NEXT:\n'
+                    '\tjalr $0, $0, 24\n'
+                    '\taddi $2, $0, 2\n'
+                    'HALT:\n'
+                    '\tjal $0, HALT\n')
+        self.assertEqual(m.run(100), 'halt')
+        self.assertEqual(m.regs[:3], [0, 0, 0])
+        self.assertEqual(m.steps, 5)
+
+    def test_examples(self):
+        # Run to their end, or as far as the steps allow
+        for source in examples():
+            with self.subTest(source):
+                with open(source) as fin:
+                    m = Machine(Assembler().assemble(fin.read()).words)
+                try:
+                    m.run(100000)
+                except SimulationError:
+                    pass
+                self.assertEqual(m.regs[0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
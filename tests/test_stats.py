@@ -0,0 +1,125 @@
+#
+# @author:Don Dennis
+# test_stats.py
+#
+# The counters of an assembly (--stats, stats.py): the lines,
+# instructions and labels of a known program in every mode, the
+# messages counted by category, and the outputs and messages of the
+# assembly, which --stats must leave as they were.
+#
+#     python -m unittest discover tests
+
+import json
+import os
+import tempfile
+import unittest
+from common import examples, rvi
+from lib import stats
+from lib.assembler import Assembler
+
+SOURCE = '''\
+# 9 lines, 4 instructions and 3 labels
+START:
+\taddi $1, $0, 5
+
+LOOP:
+\taddi $1, $1, -1
+\tbne $1, $0, LOOP
+END:
+\tjal $0, END
+'''
+
+# Options the counters and outputs are checked with
+FLAGS = ([], ['-s'], ['-w'], ['-b'], ['-x'], ['-e'])
+
+
+class StatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = self.path('prog.rvi')
+        with open(self.source, 'w') as fout:
+            fout.write(SOURCE)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp.name, name)
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as fin:
+            return fin.read()
+
+    def counters(self, source, *flags):
+        '''
+        returns: (exit status, counters) of rvi.py assembling source
+        with --stats
+        '''
+        rc, _, _ = rvi(source, '-o', self.path('prog.b'), '--stats',
+                       self.path('stats.json'), '--no-memory-stats', *flags)
+        with open(self.path('stats.json')) as fin:
+            return rc, json.load(fin)
+
+    def test_counts(self):
+        for flags in FLAGS:
+            with self.subTest(flags=flags):
+                rc, counters = self.counters(self.source, *flags)
+                self.assertEqual(rc, 0)
+                self.assertEqual((counters['lines'],
+                                  counters['instructions'],
+                                  counters['symbols']), (9, 4, 3))
+                self.assertEqual(counters['warnings'], {})
+                self.assertEqual(counters['errors'], {})
+                self.assertIsNone(counters['memory_peak'])
+                self.assertEqual(set(counters['phases']), set(stats.PHASES))
+
+    def test_in_memory(self):
+        with stats.collect(False) as counters:
+            Assembler().assemble(SOURCE)
+        counters = counters.as_dict()
+        self.assertEqual((counters['lines'], counters['instructions'],
+                          counters['symbols']), (9, 4, 3))
+
+    def test_messages_counted(self):
+        with open(self.source, 'w') as fout:
+            fout.write('\taddi $1, $0, 5000\n'
+                       '\taddi $2, $0, 6000\n'
+                       '\tjal $1, NOWHERE\n')
+        rc, counters = self.counters(self.source)
+        self.assertEqual(rc, 1)
+        self.assertEqual(counters['lines'], 3)
+        self.assertEqual(counters['warnings'],
+                         {'Immediate is too big, will overflow.': 2})
+        self.assertEqual(counters['errors'],
+                         {"Label used but never defined '...'.": 1})
+
+    def test_outputs_unchanged(self):
+        for source in examples() + [self.source]:
+            for flags in FLAGS:
+                with self.subTest(source=os.path.basename(source),
+                                  flags=flags):
+                    plain = rvi(source, '-o', self.path('plain.b'), *flags)
+                    counted = rvi(source, '-o', self.path('prog.b'),
+                                  '--stats', self.path('stats.json'),
+                                  '--no-memory-stats', *flags)
+                    self.assertEqual(counted, plain)
+                    self.assertEqual(self.read('prog.b'),
+                                     self.read('plain.b'))
+                    # The counters written to the standard output follow
+                    # the messages
+                    counted = rvi(source, '-o', self.path('prog.b'),
+                                  '--stats', '--no-memory-stats', *flags)
+                    self.assertTrue(counted[1].startswith(plain[1]))
+                    self.assertEqual(
+                        json.loads(counted[1][len(plain[1]):])['lines'],
+                        self.counters(source, *flags)[1]['lines'])
+                    # Streamed to the standard output
+                    streamed = rvi(source, '-o', '-', '--stats',
+                                   self.path('stats.json'), *flags)
+                    self.assertEqual(streamed, rvi(source, '-o', '-',
+                                                   *flags))
+
+
+if __name__ == '__main__':
+    unittest.main()